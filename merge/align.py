@@ -0,0 +1,238 @@
+"""
+Forced alignment — หาเวลาของ script ที่รู้อยู่แล้วจาก PCM ของ TTS โดยตรง ไม่ต้องถอดเสียง (ASR)
+
+TTS พูดตาม script เป๊ะ สิ่งที่ไม่รู้มีแค่ "คำไหนอยู่ตรงไหน" — ใช้ energy ของเสียงแทน acoustic model:
+- คำนวณ RMS ทีละเฟรม 10ms (numpy) → แยกช่วงมีเสียง/เงียบด้วย threshold ที่ปรับตามแต่ละไฟล์
+- ช่วงเงียบกลางประโยค (≥ ALIGN_MIN_PAUSE_MS) = จุดเว้นวรรคที่ TTS หยุดหายใจ
+- จับคู่ช่องว่างระหว่างวลีของ script กับช่วงเงียบแบบ monotonic (DP) ตามตำแหน่งที่คาดจากจำนวนตัวอักษร
+- ภายในวลี ตัดคำด้วย thaiseg แล้วกระจายเวลาตามน้ำหนักตัวอักษรเฉพาะเฟรมที่มีเสียง
+- ถ้ามีเวลาของท่อน TTS (tts.Segment) ใช้เป็นจุดยึดเพิ่ม — align ทีละท่อน
+
+ผลเป็น transcribe.Word(start, end, text) ต่อคำ → thaiseg.to_srt จัดเป็น block ซับ
+
+ENV:
+  ALIGN_MIN_PAUSE_MS  ช่วงเงียบสั้นสุดที่นับเป็นจุดเว้นวรรค (default 120)
+"""
+import os
+import re
+import unicodedata
+
+import numpy as np
+
+import thaiseg
+from transcribe import Word
+
+ALIGN_MIN_PAUSE_MS = int(os.environ.get("ALIGN_MIN_PAUSE_MS", "120"))
+
+FRAME_MS = 10
+# ช่องว่างสั้นกว่านี้ในช่วงพูด (เช่นพยัญชนะหยุด) ไม่นับเป็นเงียบ
+_FILL_MS = 40
+# ต้นทุนของการไม่จับคู่ช่องว่างระหว่างวลีกับช่วงเงียบใดเลย (สัดส่วนของความยาวเสียง)
+_SKIP_COST = 0.06
+# ต้นทุนต่อวินาทีของช่วงเงียบที่ไม่ได้ใช้ — เงียบนานแต่ไม่มีวลีไหนจบตรงนั้นแปลว่าจับคู่ผิด
+_UNUSED_PAUSE_COST = 0.15
+
+_PHRASE_RE = re.compile(r"\S+")
+
+
+def cache_tag():
+    """ค่าที่มีผลกับผล align — ใส่ใน result cache key"""
+    return f"align:v2:p{ALIGN_MIN_PAUSE_MS}:{thaiseg.cache_tag()}"
+
+
+def _weight(text):
+    """
+    น้ำหนักเวลาพูดโดยประมาณ — นับตัวอักษรที่ไม่ใช่วรรณยุกต์/สระบนล่าง
+    ตัวเลขอ่านยาว (เช่น "199" = หนึ่งร้อยเก้าสิบเก้า) นับหนักกว่า
+    """
+    w = 0.0
+    for ch in text:
+        if ch.isdigit():
+            w += 3.0
+        elif unicodedata.category(ch) == "Mn":
+            continue
+        elif ch.isalpha():
+            w += 1.0
+        elif not ch.isspace():
+            w += 0.3
+    return max(w, 0.5)
+
+
+class _Voicing:
+    """เฟรม RMS ของเสียงทั้งไฟล์ + แผนที่ "เวลาจริง ↔ เวลาที่มีเสียงพูดสะสม" """
+
+    def __init__(self, pcm, sample_rate):
+        x = np.frombuffer(pcm[:len(pcm) // 2 * 2], dtype="<i2").astype(np.float32) / 32768.0
+        self.hop = sample_rate * FRAME_MS // 1000
+        n = len(x) // self.hop
+        frames = x[:n * self.hop].reshape(n, self.hop) if n else np.zeros((0, self.hop), np.float32)
+        db = 20 * np.log10(np.sqrt((frames ** 2).mean(axis=1)) + 1e-9) if n else np.zeros(0)
+        self.duration = len(x) / sample_rate
+
+        if n:
+            floor, loud = np.percentile(db, 10), np.percentile(db, 95)
+            voiced = db > max(floor + 0.35 * (loud - floor), -55.0)
+        else:
+            voiced = np.zeros(0, dtype=bool)
+        self.voiced = _fill_gaps(voiced, _FILL_MS // FRAME_MS)
+        # cum[i] = จำนวนเฟรมมีเสียงก่อนเฟรม i
+        self.cum = np.concatenate([[0], np.cumsum(self.voiced)])
+
+    def frame(self, t):
+        return int(np.clip(round(t * 1000 / FRAME_MS), 0, len(self.voiced)))
+
+    def speech_span(self, t0, t1):
+        """(เริ่มพูด, หยุดพูด) ภายในหน้าต่าง [t0, t1]"""
+        f0, f1 = self.frame(t0), self.frame(t1)
+        idx = np.flatnonzero(self.voiced[f0:f1])
+        if not len(idx):
+            return t0, t1
+        return (f0 + idx[0]) * FRAME_MS / 1000, (f0 + idx[-1] + 1) * FRAME_MS / 1000
+
+    def pauses(self, t0, t1, min_ms):
+        """ช่วงเงียบ ≥ min_ms ภายใน (t0, t1) → [(start, end)] วินาที"""
+        f0, f1 = self.frame(t0), self.frame(t1)
+        silent = ~self.voiced[f0:f1]
+        edges = np.diff(np.concatenate([[0], silent.astype(np.int8), [0]]))
+        starts, ends = np.flatnonzero(edges == 1), np.flatnonzero(edges == -1)
+        keep = (ends - starts) * FRAME_MS >= min_ms
+        return [((f0 + s) * FRAME_MS / 1000, (f0 + e) * FRAME_MS / 1000)
+                for s, e in zip(starts[keep], ends[keep])]
+
+    def voiced_at(self, t):
+        return float(self.cum[self.frame(t)])
+
+    def time_at_voiced(self, v, t0, t1):
+        """เวลาจริงที่เสียงพูดสะสมถึง v (จำกัดใน [t0, t1])"""
+        f0, f1 = self.frame(t0), self.frame(t1)
+        i = int(np.searchsorted(self.cum[f0:f1 + 1], v, side="left"))
+        return min(max((f0 + i) * FRAME_MS / 1000, t0), t1)
+
+    def spread(self, t0, t1, weights):
+        """กระจาย [t0, t1] ตามน้ำหนัก โดยนับเฉพาะเวลาที่มีเสียงพูด → [(start, end)]"""
+        v0, v1 = self.voiced_at(t0), self.voiced_at(t1)
+        total = float(sum(weights)) or 1.0
+        edges = np.concatenate([[0.0], np.cumsum(weights)]) / total
+        if v1 - v0 < 1:
+            # ไม่มีเฟรมที่มีเสียงเลย → แบ่งตามเวลาจริง
+            times = t0 + edges * (t1 - t0)
+        else:
+            times = np.array([self.time_at_voiced(v0 + e * (v1 - v0), t0, t1) for e in edges])
+            times[0], times[-1] = t0, t1
+        return list(zip(times[:-1].tolist(), times[1:].tolist()))
+
+
+def _fill_gaps(voiced, max_gap):
+    """ถมช่วงเงียบสั้นๆ (≤ max_gap เฟรม) ระหว่างช่วงมีเสียง"""
+    if not len(voiced) or max_gap <= 0:
+        return voiced
+    v = voiced.copy()
+    edges = np.diff(np.concatenate([[0], (~v).astype(np.int8), [0]]))
+    starts, ends = np.flatnonzero(edges == 1), np.flatnonzero(edges == -1)
+    for s, e in zip(starts, ends):
+        if s > 0 and e < len(v) and e - s <= max_gap:
+            v[s:e] = True
+    return v
+
+
+def _match_pauses(expected, pauses, voicing, total_v):
+    """
+    จับคู่ขอบวลี (เวลาพูดสะสมที่คาดไว้) กับช่วงเงียบแบบ monotonic — edit-distance DP
+    return list ยาวเท่า expected: (start, end) ของช่วงเงียบที่จับคู่ หรือ None
+    """
+    k, p = len(expected), len(pauses)
+    if not k or not p:
+        return [None] * k
+    pv = np.array([voicing.voiced_at(s) for s, _e in pauses])
+    plen = np.array([e - s for s, e in pauses])
+    exp = np.asarray(expected)
+    match = np.abs(exp[:, None] - pv[None, :]) / max(total_v, 1.0)
+
+    cost = np.full((k + 1, p + 1), np.inf)
+    move = np.zeros((k + 1, p + 1), dtype=np.int8)   # 0 = จับคู่, 1 = ข้ามขอบวลี, 2 = ข้ามช่วงเงียบ
+    cost[0, 0] = 0.0
+    for j in range(1, p + 1):
+        cost[0, j] = cost[0, j - 1] + _UNUSED_PAUSE_COST * plen[j - 1]
+        move[0, j] = 2
+    for i in range(1, k + 1):
+        cost[i, 0] = cost[i - 1, 0] + _SKIP_COST
+        move[i, 0] = 1
+        for j in range(1, p + 1):
+            options = (cost[i - 1, j - 1] + match[i - 1, j - 1],
+                       cost[i - 1, j] + _SKIP_COST,
+                       cost[i, j - 1] + _UNUSED_PAUSE_COST * plen[j - 1])
+            move[i, j] = int(np.argmin(options))
+            cost[i, j] = options[move[i, j]]
+
+    out = [None] * k
+    i, j = k, p
+    while i > 0 or j > 0:
+        m = move[i, j]
+        if m == 0:
+            out[i - 1] = pauses[j - 1]
+            i, j = i - 1, j - 1
+        elif m == 1:
+            i -= 1
+        else:
+            j -= 1
+    return out
+
+
+def _align_window(voicing, text, t0, t1):
+    """align ข้อความ 1 ท่อนภายในหน้าต่างเวลา [t0, t1] → [Word]"""
+    phrases = _PHRASE_RE.findall(text)
+    if not phrases:
+        return []
+    s0, s1 = voicing.speech_span(t0, t1)
+    weights = [_weight(p) for p in phrases]
+
+    # ขอบระหว่างวลี → ตำแหน่งที่คาด (เวลาพูดสะสม) → จับคู่กับช่วงเงียบ
+    v0, v1 = voicing.voiced_at(s0), voicing.voiced_at(s1)
+    total_w = sum(weights)
+    cum_w = np.cumsum(weights)[:-1] / total_w
+    matched = _match_pauses((v0 + cum_w * (v1 - v0)).tolist(),
+                            voicing.pauses(s0, s1, ALIGN_MIN_PAUSE_MS), voicing, v1 - v0)
+
+    # จุดยึด: เริ่ม/จบ และขอบที่จับคู่กับช่วงเงียบได้ — ระหว่างจุดยึดกระจายตามน้ำหนัก
+    spans = [None] * len(phrases)
+    start, first = s0, 0
+    for i, pause in enumerate(matched + [(s1, s1)]):
+        if pause is None:
+            continue
+        group = range(first, i + 1)
+        for idx, span in zip(group, voicing.spread(start, pause[0], [weights[g] for g in group])):
+            spans[idx] = span
+        start, first = pause[1], i + 1
+
+    words = []
+    for pi, (phrase, (ps, pe)) in enumerate(zip(phrases, spans)):
+        units = thaiseg.tokenize(phrase)
+        for ui, (unit, (us, ue)) in enumerate(zip(units, voicing.spread(ps, pe, [_weight(u) for u in units]))):
+            # เว้นวรรคนำหน้าเหมือนคำของ Whisper (ขอบวลีใน script)
+            words.append(Word(us, ue, (" " if ui == 0 and pi > 0 else "") + unit))
+    return words
+
+
+def align(pcm, script, sample_rate=24000, segments=None):
+    """
+    script + PCM s16le mono ที่พูด script นั้น → [Word(start, end, text)] เรียงตามเวลา
+    segments: [tts.Segment] (optional) — เวลาของแต่ละท่อน TTS ใช้เป็นจุดยึด
+    """
+    voicing = _Voicing(pcm, sample_rate)
+    if segments and len(segments) > 1:
+        words = []
+        for i, seg in enumerate(segments):
+            # ขยายหน้าต่างถึงกึ่งกลางช่องว่างระหว่างท่อน เผื่อ trim/crossfade ทำให้ขอบเพี้ยนเล็กน้อย
+            lo = (segments[i - 1].end + seg.start) / 2 if i > 0 else 0.0
+            hi = (seg.end + segments[i + 1].start) / 2 if i + 1 < len(segments) else voicing.duration
+            part = _align_window(voicing, seg.text, lo, hi)
+            if part and words:
+                part[0] = part[0]._replace(text=" " + part[0].text.lstrip())
+            words.extend(part)
+        return words
+    return _align_window(voicing, script, 0.0, voicing.duration)
+
+
+def to_srt(pcm, script, sample_rate=24000, segments=None, max_chars=None):
+    """script + PCM → SRT (1 บรรทัด/block) จาก thaiseg"""
+    return thaiseg.to_srt(script, align(pcm, script, sample_rate, segments), max_chars=max_chars)
@@ -0,0 +1,931 @@
+"""
+Gemini client กลางของ container — generateContent + Files API
+
+generateContent (client.generate):
+- retry ด้วย exponential backoff + jitter, แยก error ที่ retry ได้ตาม HTTP status / gRPC status
+- circuit breaker ต่อ model: model ไหน overload ติดกันหลายครั้ง งานถัดไปข้ามไป fallback ทันที
+- fallback policy เดียว (GEMINI_FALLBACK_MODELS) แทนที่เคย hard-code ไว้หลายที่
+- เก็บ latency / จำนวน attempt ต่อ model และ purpose (ดูได้ที่ /health)
+- hedged requests (optional): model หลักตอบช้า → ยิงซ้ำไป fallback แล้วเอาผลที่มาก่อน
+- adaptive rate limit ต่อ (API key, model): RPM + concurrency แบบ AIMD (ลดเมื่อเจอ 429/503, เพิ่มเมื่อสำเร็จ)
+  ทุก request (รวม upload) ต่อคิวเดียวกันทั้ง container แทนที่แต่ละงานจะยิงจนโดน "high demand"
+
+Files API (files):
+- resumable upload protocol: แบ่งเป็น chunk (ทวีคูณของ 256 KB) แต่ละ chunk retry ได้
+  ถ้า chunk ล้ม จะถาม offset ที่ server ได้รับแล้ว (query) แล้วส่งต่อจากตรงนั้น ไม่ส่งใหม่ทั้งไฟล์
+- จำ URI ของไฟล์ตาม sha256 ของเนื้อหา (ต่อ API key) จนไฟล์หมดอายุ — retry / ส่งงานซ้ำใช้ URI เดิม
+- release() หลังจบงาน → ลบไฟล์ออกจาก Gemini เมื่อพ้น grace period (ไม่กิน storage quota)
+
+ENV:
+  GEMINI_UPLOAD_CHUNK    ขนาด chunk เป็น byte (default 8 MB)
+  GEMINI_UPLOAD_RETRIES  จำนวนครั้งที่ลองต่อ chunk (default 4)
+  GEMINI_FILE_GRACE      วินาทีที่เก็บไฟล์ไว้หลังงานจบ เผื่อ retry/ส่งซ้ำ ก่อนลบ (default 900)
+  GEMINI_MAX_ATTEMPTS    จำนวนครั้งสูงสุดต่อ 1 call (default 5)
+  GEMINI_BACKOFF_BASE / GEMINI_BACKOFF_MAX  วินาทีของ backoff (default 1 / 20)
+  GEMINI_BREAKER_THRESHOLD  overload ติดกันกี่ครั้งถึงเปิด breaker (default 3)
+  GEMINI_BREAKER_COOLDOWN   วินาทีที่ breaker เปิดก่อนลอง model นั้นใหม่ (default 60)
+  GEMINI_FALLBACK_MODELS    "model=fallback,..." (default gemini-3-flash-preview=gemini-2.0-flash)
+  GEMINI_HEDGE              "1" = เปิด hedged requests สำหรับ call ที่ขอ hedge=True (default ปิด)
+  GEMINI_HEDGE_PERCENTILE   รอ model หลักถึง percentile นี้ของ latency ล่าสุดก่อน hedge (default 0.9)
+  GEMINI_HEDGE_MIN_SAMPLES / GEMINI_HEDGE_DELAY  ข้อมูลน้อยกว่านี้ใช้ delay คงที่ (default 5 / 15s)
+  GEMINI_RPM                request/นาที ต่อ (API key, model) (default 60)
+  GEMINI_RPM_OVERRIDES      "model=rpm,..." ค่าเฉพาะ model (Files API ใช้ชื่อ "files")
+  GEMINI_CONCURRENCY / GEMINI_MAX_CONCURRENCY  limit เริ่มต้น / สูงสุดของ request ค้างพร้อมกัน (default 4 / 16)
+  GEMINI_QUEUE_TIMEOUT      วินาทีสูงสุดที่รอคิว limiter (default 300)
+  GEMINI_API_BASE           base URL ของ API (default https://generativelanguage.googleapis.com)
+"""
+import base64
+import datetime
+import hashlib
+import json
+import os
+import random
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+
+import requests as http_requests
+
+import http_clients
+from ratelimit import AdaptiveLimiter
+
+# override ได้เพื่อชี้ไปที่ stand-in server ในเครื่อง (scripts/fake_gemini.py)
+API_BASE = os.environ.get("GEMINI_API_BASE", "https://generativelanguage.googleapis.com").rstrip("/")
+
+GEMINI_UPLOAD_CHUNK = int(os.environ.get("GEMINI_UPLOAD_CHUNK", str(8 * 1024 * 1024)))
+GEMINI_UPLOAD_RETRIES = int(os.environ.get("GEMINI_UPLOAD_RETRIES", "4"))
+GEMINI_FILE_GRACE = float(os.environ.get("GEMINI_FILE_GRACE", "900"))
+GEMINI_MAX_ATTEMPTS = int(os.environ.get("GEMINI_MAX_ATTEMPTS", "5"))
+GEMINI_BACKOFF_BASE = float(os.environ.get("GEMINI_BACKOFF_BASE", "1"))
+GEMINI_BACKOFF_MAX = float(os.environ.get("GEMINI_BACKOFF_MAX", "20"))
+GEMINI_BREAKER_THRESHOLD = int(os.environ.get("GEMINI_BREAKER_THRESHOLD", "3"))
+GEMINI_BREAKER_COOLDOWN = float(os.environ.get("GEMINI_BREAKER_COOLDOWN", "60"))
+GEMINI_FALLBACK_MODELS = dict(
+    pair.split("=", 1) for pair in
+    os.environ.get("GEMINI_FALLBACK_MODELS", "gemini-3-flash-preview=gemini-2.0-flash").split(",") if "=" in pair)
+
+# hedged requests (script / subtitle): model หลักช้ากว่า percentile ของ latency ล่าสุด → ยิงซ้ำไป fallback
+GEMINI_HEDGE = os.environ.get("GEMINI_HEDGE", "") == "1"
+GEMINI_HEDGE_PERCENTILE = float(os.environ.get("GEMINI_HEDGE_PERCENTILE", "0.9"))
+GEMINI_HEDGE_MIN_SAMPLES = int(os.environ.get("GEMINI_HEDGE_MIN_SAMPLES", "5"))
+GEMINI_HEDGE_DELAY = float(os.environ.get("GEMINI_HEDGE_DELAY", "15"))
+
+# quota ฝั่ง client ต่อ (API key, model) — ทุกงานใน container ต่อคิวเดียวกัน
+GEMINI_RPM = float(os.environ.get("GEMINI_RPM", "60"))
+GEMINI_RPM_OVERRIDES = {
+    m: float(v) for m, v in (
+        pair.split("=", 1) for pair in os.environ.get("GEMINI_RPM_OVERRIDES", "").split(",") if "=" in pair)}
+GEMINI_CONCURRENCY = int(os.environ.get("GEMINI_CONCURRENCY", "4"))
+GEMINI_MAX_CONCURRENCY = int(os.environ.get("GEMINI_MAX_CONCURRENCY", "16"))
+GEMINI_QUEUE_TIMEOUT = float(os.environ.get("GEMINI_QUEUE_TIMEOUT", "300"))
+
+# HTTP status / gRPC status ที่ลองใหม่ได้ — ที่เหลือ (400 / 403 / 404 ...) ลองใหม่ก็ได้ผลเดิม
+RETRYABLE_HTTP = {408, 429, 500, 502, 503, 504}
+RETRYABLE_STATUS = {"RESOURCE_EXHAUSTED", "UNAVAILABLE", "INTERNAL", "DEADLINE_EXCEEDED", "ABORTED"}
+# overload = model รับไม่ไหว → นับเข้า circuit breaker
+OVERLOAD_HTTP = {429, 503}
+OVERLOAD_STATUS = {"RESOURCE_EXHAUSTED", "UNAVAILABLE"}
+
+# adaptive polling ของ Files API: เริ่มถี่แล้วค่อยห่างขึ้น
+POLL_INITIAL = 0.5
+POLL_FACTOR = 1.5
+POLL_MAX = 5.0
+
+_GRANULARITY = 256 * 1024
+# Files API เก็บไฟล์ 48 ชม. — ถ้า response ไม่บอกเวลาหมดอายุ ใช้ค่านี้ (เผื่อขอบ 1 ชม.)
+_DEFAULT_LIFETIME = 47 * 3600
+
+
+_limiters = {}
+_limiters_lock = threading.Lock()
+
+
+def limiter(api_key, model):
+    """AdaptiveLimiter ของ (API key, model) — สร้างครั้งแรกที่ใช้"""
+    k = (hashlib.sha256(api_key.encode()).hexdigest()[:12], model)
+    with _limiters_lock:
+        lim = _limiters.get(k)
+        if lim is None:
+            lim = _limiters[k] = AdaptiveLimiter(
+                GEMINI_RPM_OVERRIDES.get(model, GEMINI_RPM),
+                initial=min(GEMINI_CONCURRENCY, GEMINI_MAX_CONCURRENCY), maximum=GEMINI_MAX_CONCURRENCY)
+        return lim
+
+
+def limiter_status():
+    with _limiters_lock:
+        return {f"{key_id}:{model}": lim.status() for (key_id, model), lim in _limiters.items()}
+
+
+class _Slot:
+    """with limiter slot — ปล่อย slot พร้อมผลลัพธ์ (ok / overload) ให้ AIMD"""
+
+    def __init__(self, api_key, model):
+        self.lim = limiter(api_key, model)
+        self.outcome = None
+        self.retry_after = None
+        self._released = False
+        self._lock = threading.Lock()
+
+    def __enter__(self):
+        if not self.lim.acquire(timeout=GEMINI_QUEUE_TIMEOUT):
+            raise GeminiError(f"Gemini limiter queue timeout ({GEMINI_QUEUE_TIMEOUT:.0f}s)")
+        return self
+
+    def release(self):
+        """คืน slot (ครั้งเดียว) — hedge ตัวแพ้คืนได้ทันทีที่ผู้ชนะตอบ ไม่ต้องรอ HTTP ของตัวเองจบ"""
+        with self._lock:
+            if self._released:
+                return
+            self._released = True
+        self.lim.release(self.outcome, self.retry_after)
+
+    def __exit__(self, *exc):
+        self.release()
+        return False
+
+
+class _Cancel:
+    """ยกเลิก attempt ที่แพ้ hedge — คืน limiter slot ทันที และไม่บันทึก latency/ผลของมันเข้า metrics"""
+
+    def __init__(self):
+        self.cancelled = False
+        self._slot = None
+        self._lock = threading.Lock()
+
+    def attach(self, slot):
+        """ผูก slot ของ attempt — False ถ้าถูกยกเลิกไปก่อนได้ slot (ไม่ต้องยิง request แล้ว)"""
+        with self._lock:
+            self._slot = slot
+            cancelled = self.cancelled
+        if cancelled:
+            slot.release()
+        return not cancelled
+
+    def cancel(self):
+        with self._lock:
+            self.cancelled = True
+            slot = self._slot
+        if slot:
+            slot.release()
+
+
+class _Cancelled(Exception):
+    pass
+
+
+class GeminiError(Exception):
+    def __init__(self, message, status=None, code=None, retryable=False, overloaded=False, retry_after=None):
+        super().__init__(message)
+        self.status = status            # gRPC status เช่น UNAVAILABLE
+        self.code = code                # HTTP status
+        self.retryable = retryable
+        self.overloaded = overloaded
+        self.retry_after = retry_after
+
+
+def classify(code, data):
+    """HTTP status + body → GeminiError (None ถ้าสำเร็จ)"""
+    err = data.get("error") if isinstance(data, dict) else None
+    if code == 200 and not err:
+        return None
+    err = err or {}
+    code = err.get("code") or code
+    status = err.get("status")
+    message = err.get("message") or f"HTTP {code}"
+    retry_after = None
+    for detail in err.get("details") or []:
+        # google.rpc.RetryInfo {"retryDelay": "12s"}
+        delay = detail.get("retryDelay") if isinstance(detail, dict) else None
+        if isinstance(delay, str) and delay.endswith("s"):
+            try:
+                retry_after = float(delay[:-1])
+            except ValueError:
+                pass
+    return GeminiError(
+        f"Gemini error {code} {status or ''}: {message}".replace("  ", " "),
+        status=status, code=code,
+        retryable=code in RETRYABLE_HTTP or status in RETRYABLE_STATUS,
+        overloaded=code in OVERLOAD_HTTP or status in OVERLOAD_STATUS,
+        retry_after=retry_after)
+
+
+def _retry_after(resp):
+    """วินาทีที่ต้องรอจาก 429: header Retry-After หรือ RetryInfo ใน body (แบบเดียวกับ classify) — None ถ้าไม่บอก"""
+    header = resp.headers.get("Retry-After")
+    if header:
+        try:
+            return max(0.0, float(header))
+        except ValueError:
+            pass
+    try:
+        data = resp.json()
+    except ValueError:
+        return None
+    err = classify(resp.status_code, data)
+    return err.retry_after if err else None
+
+
+def response_text(data):
+    """ข้อความของ candidate แรก"""
+    return data.get("candidates", [{}])[0].get("content", {}).get("parts", [{}])[0].get("text", "")
+
+
+def require_text(data):
+    """validate ของ call ที่ต้องได้ข้อความ — candidate ว่าง/โดน block → ValueError (retry / hedge ไม่นับว่าชนะ)"""
+    if not response_text(data).strip():
+        reason = (data.get("candidates") or [{}])[0].get("finishReason") or \
+            (data.get("promptFeedback") or {}).get("blockReason") or "empty"
+        raise ValueError(f"no text in response ({reason})")
+    return data
+
+
+def backoff(attempt, base=GEMINI_BACKOFF_BASE, cap=GEMINI_BACKOFF_MAX):
+    """exponential backoff แบบ full jitter — กันทุกงานตื่นมายิงพร้อมกัน"""
+    return random.uniform(0, min(cap, base * (2 ** attempt)))
+
+
+class CircuitBreaker:
+    """
+    ต่อ model: overload ติดกัน threshold ครั้ง → เปิด (ข้าม model นี้) เป็นเวลา cooldown
+    พ้น cooldown → half-open ให้ลองได้ 1 request ถ้าสำเร็จปิด ถ้าล้มเปิดใหม่
+    """
+
+    def __init__(self, threshold=GEMINI_BREAKER_THRESHOLD, cooldown=GEMINI_BREAKER_COOLDOWN):
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.failures = 0
+        self.open_until = 0.0
+        self.trial = False
+        self.opened = 0
+
+    def allow(self, now):
+        if self.failures < self.threshold:
+            return True
+        if now < self.open_until or self.trial:
+            return False
+        self.trial = True
+        return True
+
+    def success(self):
+        self.failures = 0
+        self.trial = False
+
+    def failure(self, now):
+        self.failures += 1
+        self.trial = False
+        if self.failures >= self.threshold:
+            if now >= self.open_until:
+                self.opened += 1
+            self.open_until = now + self.cooldown
+
+    def settle(self, now):
+        """error ที่ไม่ใช่ overload — ถ้าเป็น request ทดลองตอน half-open นับเป็นล้ม (ไม่ให้ trial ค้างตลอดไป)"""
+        if self.trial:
+            self.failure(now)
+
+    def state(self, now):
+        if self.failures < self.threshold:
+            return "closed"
+        return "open" if now < self.open_until else "half-open"
+
+
+class _Metrics:
+    def __init__(self):
+        self.calls = 0
+        self.attempts = 0
+        self.failures = 0
+        self.latencies = deque(maxlen=200)      # วินาทีของ attempt ที่สำเร็จ
+
+    def view(self):
+        lat = sorted(self.latencies)
+
+        def pct(p):
+            return round(lat[min(len(lat) - 1, int(p * len(lat)))], 2) if lat else None
+        return {"calls": self.calls, "attempts": self.attempts, "failures": self.failures,
+                "p50": pct(0.5), "p95": pct(0.95)}
+
+
+class Client:
+    def __init__(self, session=None, max_attempts=GEMINI_MAX_ATTEMPTS, fallbacks=None):
+        self.session = session or http_clients.gemini
+        self.max_attempts = max(1, max_attempts)
+        self.fallbacks = GEMINI_FALLBACK_MODELS if fallbacks is None else fallbacks
+        self._breakers = {}
+        self._metrics = {}          # (purpose, model) → _Metrics
+        self._lock = threading.Lock()
+        self.hedge_enabled = GEMINI_HEDGE
+        self._hedge_pool = ThreadPoolExecutor(max_workers=16, thread_name_prefix="gemini-hedge")
+        self.hedge_stats = {"hedged": 0, "wins": {}, "saved_s": 0.0, "loser_failed": 0, "cancelled": 0}
+
+    def _breaker(self, model):
+        b = self._breakers.get(model)
+        if b is None:
+            b = self._breakers[model] = CircuitBreaker()
+        return b
+
+    def _metric(self, purpose, model):
+        m = self._metrics.get((purpose, model))
+        if m is None:
+            m = self._metrics[(purpose, model)] = _Metrics()
+        return m
+
+    def chain(self, model):
+        """model + fallback ตามลำดับ"""
+        out = [model]
+        while out[-1] in self.fallbacks and self.fallbacks[out[-1]] not in out:
+            out.append(self.fallbacks[out[-1]])
+        return out
+
+    def _pick(self, chain, skip):
+        """model แรกใน chain ที่ breaker ยอมให้ใช้ (ถ้าทุกตัวเปิดอยู่ ใช้ตัวสุดท้าย)"""
+        now = time.monotonic()
+        with self._lock:
+            for m in chain[skip:]:
+                if self._breaker(m).allow(now):
+                    return m
+        return chain[-1]
+
+    def generate(self, model, body, api_key, timeout=60, purpose="generate", validate=None, fallback=True,
+                 hedge=False):
+        """
+        POST models/{model}:generateContent พร้อม retry / backoff / fallback
+        validate(data) → ค่าที่ต้องการ (raise ValueError/KeyError/IndexError = response ใช้ไม่ได้ → retry)
+        hedge=True → ถ้า model หลักตอบช้ากว่า percentile ของ latency ล่าสุด ยิงซ้ำไป fallback (ดู GEMINI_HEDGE)
+                     ต้องมี validate ด้วย (ไม่งั้น HTTP 200 ที่ candidate ว่างก็ "ชนะ" ได้) — ไม่มีจะไม่ hedge
+        return (ค่าจาก validate หรือ response JSON, model ที่ตอบ)
+        """
+        chain = self.chain(model) if fallback else [model]
+        skip = 0            # ตำแหน่งใน chain ที่ call นี้ escalate มาแล้ว
+        overloads = 0
+        last_err = None
+        with self._lock:
+            self._metric(purpose, model).calls += 1
+        for attempt in range(self.max_attempts):
+            m = self._pick(chain, skip)
+            alt = self._hedge_target(chain, m) if hedge and validate and self.hedge_enabled else None
+            if alt:
+                result, err, m = self._hedged(m, alt, body, api_key, timeout, purpose, validate)
+            else:
+                result, err, _dt = self._attempt(m, body, api_key, timeout, purpose, validate)
+            if err is None:
+                if attempt:
+                    print(f"[GEMINI] {purpose} ok on {m} after {attempt + 1} attempts")
+                return result, m
+
+            last_err = err
+            if not err.retryable:
+                raise err
+            if err.overloaded:
+                overloads += 1
+                # model นี้ overload 2 ครั้งใน call เดียว → ขยับไป fallback สำหรับ call นี้
+                if overloads >= 2 and chain.index(m) + 1 < len(chain):
+                    skip = chain.index(m) + 1
+                    overloads = 0
+                    print(f"[GEMINI] {purpose}: fallback {m} → {chain[skip]}")
+            if attempt + 1 < self.max_attempts:
+                delay = err.retry_after if err.retry_after is not None else backoff(attempt)
+                print(f"[GEMINI] {purpose} on {m}: {err} — retry in {delay:.1f}s ({attempt + 1}/{self.max_attempts})")
+                time.sleep(min(delay, GEMINI_BACKOFF_MAX))
+        raise last_err
+
+    def _attempt(self, m, body, api_key, timeout, purpose, validate, cancel=None):
+        """
+        request เดียว → (result, GeminiError หรือ None, วินาที) พร้อมอัปเดต metrics / breaker
+        cancel: _Cancel ของ hedge — ถูกยกเลิกแล้วคืน slot ทันที, ผลที่มาทีหลังอัปเดตแค่ breaker
+        """
+        result, err, dt = None, None, 0.0
+        try:
+            with _Slot(api_key, m) as slot:
+                t0 = time.monotonic()
+                try:
+                    if cancel and not cancel.attach(slot):
+                        raise _Cancelled()
+                    resp = self.session.post(f"{API_BASE}/v1beta/models/{m}:generateContent?key={api_key}",
+                                             json=body, timeout=timeout)
+                    try:
+                        data = resp.json()
+                    except ValueError:
+                        data = {}
+                    err = classify(resp.status_code, data)
+                    if err is None:
+                        result = validate(data) if validate else data
+                except http_requests.RequestException as e:
+                    err = GeminiError(f"Gemini request error: {e}", retryable=True,
+                                      overloaded=isinstance(e, http_requests.Timeout))
+                except (ValueError, KeyError, IndexError, TypeError) as e:
+                    err = GeminiError(f"Gemini invalid response: {e!r}", retryable=True)
+                except _Cancelled:
+                    err = GeminiError("Gemini hedge attempt cancelled")
+                except Exception as e:
+                    err = GeminiError(f"Gemini request failed: {e!r}")
+                dt = time.monotonic() - t0
+                if err is None:
+                    slot.outcome = "ok"
+                elif err.overloaded:
+                    slot.outcome, slot.retry_after = "overload", err.retry_after
+        except GeminiError as e:
+            # limiter queue timeout — ไม่ได้ยิง request แต่ถ้าเป็น trial ของ breaker ก็ต้องปิด trial
+            err = e
+
+        with self._lock:
+            breaker = self._breaker(m)
+            if cancel and cancel.cancelled:
+                # ตัวแพ้ hedge — latency ของมันไม่ใช่ latency ที่ผู้ใช้เห็น; แค่ปิด trial ของ breaker (ถ้ามี)
+                if err is None:
+                    breaker.success()
+                elif err.overloaded:
+                    breaker.failure(time.monotonic())
+                else:
+                    breaker.settle(time.monotonic())
+                return result, err, dt
+            metric = self._metric(purpose, m)
+            metric.attempts += 1
+            if err is None:
+                metric.latencies.append(dt)
+                breaker.success()
+            else:
+                metric.failures += 1
+                if err.overloaded:
+                    breaker.failure(time.monotonic())
+                else:
+                    breaker.settle(time.monotonic())
+        return result, err, dt
+
+    def stream(self, model, body, api_key, timeout=60, purpose="stream"):
+        """
+        streamGenerateContent (SSE) → yield response chunk (dict) ทีละ event
+        retry ได้เฉพาะก่อนได้ event แรก — หลังจากนั้น error จะ raise ให้ caller (ส่งต่อไปแล้วถอยไม่ได้)
+        """
+        with self._lock:
+            self._metric(purpose, model).calls += 1
+        last_err = None
+        for attempt in range(self.max_attempts):
+            started = False
+            with _Slot(api_key, model) as slot:
+                t0 = time.monotonic()
+                err = None
+                try:
+                    resp = self.session.post(
+                        f"{API_BASE}/v1beta/models/{model}:streamGenerateContent?alt=sse&key={api_key}",
+                        json=body, timeout=timeout, stream=True)
+                    try:
+                        if resp.status_code != 200:
+                            try:
+                                data = resp.json()
+                            except ValueError:
+                                data = {}
+                            err = classify(resp.status_code, data) or GeminiError(f"HTTP {resp.status_code}")
+                        else:
+                            for line in resp.iter_lines():
+                                if not line.startswith(b"data:"):
+                                    continue
+                                try:
+                                    event = json.loads(line[5:])
+                                except ValueError as e:
+                                    # event เสีย — นับเป็น error ของ attempt (metrics / retry ก่อน event แรก)
+                                    err = GeminiError(f"Gemini invalid stream event: {e}", retryable=True)
+                                    break
+                                err = classify(200, event)
+                                if err:
+                                    break
+                                if not started:
+                                    started = True
+                                    with self._lock:
+                                        self._metric(purpose, model).latencies.append(time.monotonic() - t0)
+                                yield event
+                    finally:
+                        resp.close()
+                except http_requests.RequestException as e:
+                    err = GeminiError(f"Gemini stream error: {e}", retryable=True,
+                                      overloaded=isinstance(e, http_requests.Timeout))
+                with self._lock:
+                    metric = self._metric(purpose, model)
+                    metric.attempts += 1
+                    if err:
+                        metric.failures += 1
+                        if err.overloaded:
+                            self._breaker(model).failure(time.monotonic())
+                        else:
+                            self._breaker(model).settle(time.monotonic())
+                    else:
+                        self._breaker(model).success()
+                if err is None:
+                    slot.outcome = "ok"
+                    return
+                if err.overloaded:
+                    slot.outcome, slot.retry_after = "overload", err.retry_after
+            last_err = err
+            if started or not err.retryable:
+                raise err
+            if attempt + 1 < self.max_attempts:
+                delay = err.retry_after if err.retry_after is not None else backoff(attempt)
+                print(f"[GEMINI] {purpose} stream on {model}: {err} — retry in {delay:.1f}s")
+                time.sleep(min(delay, GEMINI_BACKOFF_MAX))
+        raise last_err
+
+    # ── hedging ──
+
+    def _hedge_target(self, chain, m):
+        """fallback ตัวถัดไปของ m ที่ breaker ยังยอมให้ใช้ (None = ไม่มีอะไรให้ hedge)"""
+        i = chain.index(m) if m in chain else len(chain)
+        now = time.monotonic()
+        with self._lock:
+            for alt in chain[i + 1:]:
+                if self._breaker(alt).state(now) == "closed":
+                    return alt
+        return None
+
+    def hedge_delay(self, purpose, m):
+        """รอ model หลักนานเท่าไหร่ก่อนยิง hedge — percentile ของ latency ล่าสุด (default ถ้าข้อมูลยังน้อย)"""
+        with self._lock:
+            lat = sorted(self._metric(purpose, m).latencies)
+        if len(lat) < GEMINI_HEDGE_MIN_SAMPLES:
+            return GEMINI_HEDGE_DELAY
+        return lat[min(len(lat) - 1, int(GEMINI_HEDGE_PERCENTILE * len(lat)))]
+
+    def _hedged(self, m, alt, body, api_key, timeout, purpose, validate):
+        """
+        ยิง m ก่อน — ถ้าไม่ตอบภายใน hedge_delay ยิง alt ด้วย แล้วเอาผลที่ valid ตัวแรก
+        ตัวที่แพ้ถูกยกเลิก: คืน limiter slot ทันที (ไม่กิน concurrency ของงานถัดไปจน timeout)
+        และไม่ retry ต่อ — ผลที่มาทีหลังใช้แค่คำนวณเวลาที่ประหยัดได้
+        return (result, err, model ที่ใช้ผล)
+        """
+        t0 = time.monotonic()
+        cancels = {m: _Cancel(), alt: _Cancel()}
+        primary = self._hedge_pool.submit(self._attempt, m, body, api_key, timeout, purpose, validate, cancels[m])
+        delay = self.hedge_delay(purpose, m)
+        done, _ = wait([primary], timeout=delay)
+        if done:
+            result, err, _dt = primary.result()
+            return result, err, m
+
+        print(f"[GEMINI] {purpose}: {m} slower than {delay:.1f}s, hedging to {alt}")
+        secondary = self._hedge_pool.submit(self._attempt, alt, body, api_key, timeout, purpose, validate,
+                                            cancels[alt])
+        with self._lock:
+            self.hedge_stats["hedged"] += 1
+        racers = {primary: m, secondary: alt}
+        pending = set(racers)
+        errors = {}
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for fut in done:
+                result, err, _dt = fut.result()
+                if err is not None:
+                    errors[racers[fut]] = err
+                    continue
+                won_at = time.monotonic() - t0
+                winner = racers[fut]
+                with self._lock:
+                    self.hedge_stats["wins"][winner] = self.hedge_stats["wins"].get(winner, 0) + 1
+                for loser in pending:
+                    cancels[racers[loser]].cancel()
+                    loser.add_done_callback(self._loser_done(won_at, t0))
+                return result, None, winner
+        # ทั้งคู่ล้ม — ใช้ error ของ model หลัก (ให้ retry loop ตัดสินใจต่อ)
+        return None, errors.get(m) or errors[alt], m
+
+    def _loser_done(self, won_at, t0):
+        def _cb(fut):
+            _result, err, _dt = fut.result()
+            with self._lock:
+                self.hedge_stats["cancelled"] += 1
+                if err is None:
+                    # ถ้าไม่ hedge ต้องรอถึงตอนที่ตัวแพ้ตอบ
+                    self.hedge_stats["saved_s"] += max(0.0, (time.monotonic() - t0) - won_at)
+                else:
+                    self.hedge_stats["loser_failed"] += 1
+        return _cb
+
+    def status(self):
+        now = time.monotonic()
+        with self._lock:
+            return {
+                "breakers": {m: {"state": b.state(now), "failures": b.failures, "opened": b.opened}
+                             for m, b in self._breakers.items()},
+                "calls": {f"{purpose}:{m}": metric.view() for (purpose, m), metric in self._metrics.items()},
+                "limiters": limiter_status(),
+                "hedge": dict(self.hedge_stats, enabled=self.hedge_enabled,
+                              saved_s=round(self.hedge_stats["saved_s"], 1), wins=dict(self.hedge_stats["wins"])),
+            }
+
+
+def video_parts(file_uri):
+    """content parts ของวิดีโอที่อัปโหลดไว้บน Files API"""
+    return [{"file_data": {"mime_type": "video/mp4", "file_uri": file_uri}}]
+
+
+def storyboard_parts(frames, video_duration):
+    """storyboard — เฟรมตัวแทน [(t, jpeg bytes)] ส่ง inline ใน request เดียว ไม่ต้องอัปโหลดไฟล์"""
+    parts = [{"text": f"ภาพต่อไปนี้คือเฟรมตัวอย่างเรียงตามเวลาจากวิดีโอสินค้ายาว {video_duration:.1f} วินาที "
+                      f"ให้มองเป็นวิดีโอเดียวกัน"}]
+    for t, jpeg in frames:
+        parts.append({"text": f"[{t:.1f}s]"})
+        parts.append({"inline_data": {"mime_type": "image/jpeg", "data": base64.b64encode(jpeg).decode()}})
+    return parts
+
+
+class GeminiFile:
+    def __init__(self, api_key, sha256, name, uri, expires_at):
+        self.api_key = api_key
+        self.sha256 = sha256
+        self.name = name            # files/xxxx
+        self.uri = uri
+        self.expires_at = expires_at
+        self.refs = 0
+        self.delete_timer = None
+
+
+def _expires_at(info):
+    raw = info.get("expirationTime")
+    if raw:
+        try:
+            # "2025-01-01T00:00:00.123456789Z" — ตัดเศษวินาทีทิ้ง (fromisoformat ไม่รับ nanosecond)
+            ts = datetime.datetime.strptime(raw.split(".")[0].rstrip("Z"), "%Y-%m-%dT%H:%M:%S")
+            return ts.replace(tzinfo=datetime.timezone.utc).timestamp() - 3600
+        except ValueError:
+            pass
+    return time.time() + _DEFAULT_LIFETIME
+
+
+class _Source:
+    """อ่าน chunk จาก path หรือ bytes แบบ random access (ใช้ตอน resume จาก offset)"""
+
+    def __init__(self, src):
+        if isinstance(src, (bytes, bytearray, memoryview)):
+            self._data, self._file = memoryview(src), None
+            self.size = len(self._data)
+        else:
+            self._data, self._file = None, open(src, "rb")
+            self.size = os.fstat(self._file.fileno()).st_size
+
+    def read(self, offset, n):
+        if self._data is not None:
+            return bytes(self._data[offset:offset + n])
+        self._file.seek(offset)
+        return self._file.read(n)
+
+    def close(self):
+        if self._file:
+            self._file.close()
+
+
+def _sha256_of(src):
+    h = hashlib.sha256()
+    if isinstance(src, (bytes, bytearray, memoryview)):
+        h.update(src)
+    else:
+        with open(src, "rb") as f:
+            for chunk in iter(lambda: f.read(1024 * 1024), b""):
+                h.update(chunk)
+    return h.hexdigest()
+
+
+class FileManager:
+    def __init__(self, session=None, chunk_size=GEMINI_UPLOAD_CHUNK, retries=GEMINI_UPLOAD_RETRIES,
+                 grace=GEMINI_FILE_GRACE):
+        self.session = session or http_clients.gemini
+        # resumable upload ต้องส่ง chunk เป็นทวีคูณของ 256 KB (ยกเว้น chunk สุดท้าย)
+        self.chunk_size = max(_GRANULARITY, chunk_size // _GRANULARITY * _GRANULARITY)
+        self.retries = max(1, retries)
+        self.grace = grace
+        self._files = {}        # (api_key, sha256) → GeminiFile
+        self._inflight = {}     # (api_key, sha256) → Future
+        self._lock = threading.Lock()
+        self.stats = {"uploads": 0, "reused": 0, "chunks": 0, "chunk_retries": 0,
+                      "bytes_sent": 0, "deleted": 0, "polls": 0}
+
+    # ── public ──
+
+    def upload(self, api_key, src, sha256=None, mime_type="video/mp4", display_name=None):
+        """
+        อัปโหลด src (path หรือ bytes) — ถ้าเนื้อหาเดียวกันเคยอัปโหลดและยังไม่หมดอายุ ใช้ไฟล์เดิม
+        return GeminiFile (ถือ reference ไว้ — เรียก release() เมื่อจบงาน)
+        """
+        sha256 = sha256 or _sha256_of(src)
+        k = (api_key, sha256)
+        while True:
+            with self._lock:
+                f = self._files.get(k)
+                if f and f.expires_at > time.time():
+                    self._acquire(f)
+                    self.stats["reused"] += 1
+                    print(f"[GEMINI] Reusing {f.name} (sha256={sha256[:12]})")
+                    return f
+                fut = self._inflight.get(k)
+                owner = fut is None
+                if owner:
+                    fut = self._inflight[k] = Future()
+            if not owner:
+                # อีกงานกำลังอัปโหลดเนื้อหาเดียวกัน — รอแล้วใช้ผลเดียวกัน
+                try:
+                    fut.result()
+                except Exception:
+                    pass
+                continue
+            break
+
+        try:
+            # upload ต่อคิว limiter ของ Files API — ไฟล์ใหญ่หลายงานพร้อมกันไม่แย่ง bandwidth/quota กันเอง
+            with _Slot(api_key, "files") as slot:
+                try:
+                    info = self._upload_resumable(api_key, src, mime_type, display_name or sha256[:16])
+                    slot.outcome = "ok"
+                except GeminiError as e:
+                    if e.overloaded:
+                        slot.outcome, slot.retry_after = "overload", e.retry_after
+                    raise
+        except BaseException as e:
+            with self._lock:
+                self._inflight.pop(k, None)
+            fut.set_exception(e)
+            raise
+        f = GeminiFile(api_key, sha256, info["name"], info["uri"], _expires_at(info))
+        with self._lock:
+            self._files[k] = f
+            self._acquire(f)
+            self._inflight.pop(k, None)
+            self.stats["uploads"] += 1
+        fut.set_result(f)
+        return f
+
+    def lookup(self, api_key, sha256):
+        """ไฟล์ที่อัปโหลดไว้แล้วของเนื้อหานี้ (ถือ reference ให้) หรือ None — ใช้ก่อนเตรียมไฟล์ที่แพง"""
+        with self._lock:
+            f = self._files.get((api_key, sha256))
+            if f and f.expires_at > time.time():
+                self._acquire(f)
+                self.stats["reused"] += 1
+                print(f"[GEMINI] Reusing {f.name} (sha256={sha256[:12]})")
+                return f
+        return None
+
+    def forget(self, f):
+        """ไฟล์ใช้ไม่ได้แล้ว (เช่น FAILED / 404) — ครั้งหน้าจะอัปโหลดใหม่"""
+        with self._lock:
+            if self._files.get((f.api_key, f.sha256)) is f:
+                del self._files[(f.api_key, f.sha256)]
+
+    def wait(self, f, max_wait=120, interval=None):
+        """
+        รอให้ไฟล์ ACTIVE — return True ถ้าพร้อม, False ถ้าเกินเวลา
+        interval=None → adaptive (เริ่ม 0.5s แล้วห่างขึ้นจนถึง 5s), FAILED → raise GeminiError
+        """
+        deadline = time.monotonic() + max_wait
+        delay = interval or POLL_INITIAL
+        polls = 0
+        t0 = time.monotonic()
+        while True:
+            r = self.session.get(f"{API_BASE}/v1beta/{f.name}?key={f.api_key}", timeout=15)
+            polls += 1
+            if r.status_code == 404:
+                self.forget(f)
+                raise GeminiError(f"Gemini file {f.name} not found", code=404)
+            info = r.json()
+            state = info.get("state")
+            if state == "ACTIVE":
+                with self._lock:
+                    self.stats["polls"] += polls
+                print(f"[GEMINI] {f.name} ACTIVE after {time.monotonic() - t0:.1f}s ({polls} polls)")
+                return True
+            if state == "FAILED":
+                # ไฟล์ประมวลผลไม่ผ่าน — ครั้งหน้าต้องอัปโหลดใหม่ ไม่ใช่รอต่อ
+                self.forget(f)
+                reason = (info.get("error") or {}).get("message", "")
+                raise GeminiError(f"Gemini file {f.name} FAILED: {reason}")
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return False
+            time.sleep(min(delay, remaining))
+            if interval is None:
+                delay = min(POLL_MAX, delay * POLL_FACTOR)
+
+    def release(self, f):
+        """จบงานที่ใช้ไฟล์นี้ — ไม่มีใครใช้ต่อภายใน grace period → ลบออกจาก Gemini"""
+        with self._lock:
+            f.refs = max(0, f.refs - 1)
+            if f.refs == 0 and f.delete_timer is None:
+                f.delete_timer = threading.Timer(self.grace, self._expire, args=(f,))
+                f.delete_timer.daemon = True
+                f.delete_timer.start()
+
+    def delete(self, f):
+        self.forget(f)
+        try:
+            r = self.session.delete(f"{API_BASE}/v1beta/{f.name}?key={f.api_key}", timeout=15)
+            if r.status_code in (200, 204, 404):
+                with self._lock:
+                    self.stats["deleted"] += 1
+            else:
+                print(f"[GEMINI] Delete {f.name} failed: {r.status_code}")
+        except Exception as e:
+            print(f"[GEMINI] Delete {f.name} error: {e}")
+
+    def status(self):
+        with self._lock:
+            return dict(self.stats, files=len(self._files),
+                        in_use=sum(1 for f in self._files.values() if f.refs))
+
+    # ── internal ──
+
+    def _acquire(self, f):
+        f.refs += 1
+        if f.delete_timer is not None:
+            f.delete_timer.cancel()
+            f.delete_timer = None
+
+    def _expire(self, f):
+        with self._lock:
+            if f.refs or f.delete_timer is None:
+                return
+            f.delete_timer = None
+        self.delete(f)
+
+    def _upload_resumable(self, api_key, src, mime_type, display_name):
+        source = _Source(src)
+        try:
+            start = self.session.post(f"{API_BASE}/upload/v1beta/files?key={api_key}", json={
+                "file": {"display_name": display_name},
+            }, headers={
+                "X-Goog-Upload-Protocol": "resumable",
+                "X-Goog-Upload-Command": "start",
+                "X-Goog-Upload-Header-Content-Length": str(source.size),
+                "X-Goog-Upload-Header-Content-Type": mime_type,
+            }, timeout=30)
+            upload_url = start.headers.get("X-Goog-Upload-URL")
+            if not upload_url:
+                try:
+                    data = start.json()
+                except ValueError:
+                    data = {}
+                err = classify(start.status_code, data) or GeminiError(f"HTTP {start.status_code}")
+                raise GeminiError(f"Gemini upload start failed: {err}", status=err.status, code=err.code,
+                                  retryable=err.retryable, overloaded=err.overloaded, retry_after=err.retry_after)
+
+            offset = 0
+            while True:
+                chunk = source.read(offset, self.chunk_size)
+                last = offset + len(chunk) >= source.size
+                for attempt in range(self.retries):
+                    retry_after = None
+                    try:
+                        resp = self.session.post(upload_url, data=chunk, headers={
+                            "X-Goog-Upload-Command": "upload, finalize" if last else "upload",
+                            "X-Goog-Upload-Offset": str(offset),
+                        }, timeout=(10, 120))
+                        if resp.status_code < 500 and resp.status_code != 429:
+                            break
+                        err = Exception(f"chunk upload {resp.status_code}")
+                        if resp.status_code == 429:
+                            retry_after = _retry_after(resp)
+                    except Exception as e:
+                        err = e
+                    with self._lock:
+                        self.stats["chunk_retries"] += 1
+                    delay = retry_after if retry_after is not None else min(2 ** attempt, 10)
+                    print(f"[GEMINI] Chunk @{offset} failed ({err}), retrying in {delay:.1f}s "
+                          f"({attempt + 1}/{self.retries})")
+                    time.sleep(min(delay, GEMINI_BACKOFF_MAX))
+                    done, received, info = self._query(upload_url)
+                    if done and info:
+                        return info
+                    if received is not None and received != offset:
+                        # server ได้ไปบางส่วนแล้ว — ส่งต่อจาก offset ที่ server ยืนยัน
+                        offset = received
+                        chunk = source.read(offset, self.chunk_size)
+                        last = offset + len(chunk) >= source.size
+                else:
+                    raise Exception(f"Gemini upload failed at offset {offset}: {err}")
+
+                with self._lock:
+                    self.stats["chunks"] += 1
+                    self.stats["bytes_sent"] += len(chunk)
+                if resp.status_code >= 400:
+                    raise Exception(f"Gemini upload failed: {resp.status_code} {resp.text[:200]}")
+                if last:
+                    data = resp.json()
+                    if "file" not in data:
+                        raise Exception(f"Gemini upload failed: {data}")
+                    print(f"[GEMINI] Uploaded {source.size/1024/1024:.1f} MB → {data['file']['name']}")
+                    return data["file"]
+                offset += len(chunk)
+        finally:
+            source.close()
+
+    def _query(self, upload_url):
+        """ถาม server ว่าได้รับไปกี่ byte แล้ว → (finalized?, received, file info)"""
+        try:
+            r = self.session.post(upload_url, headers={"X-Goog-Upload-Command": "query"}, timeout=15)
+            status = r.headers.get("X-Goog-Upload-Status", "")
+            if status == "final":
+                return True, None, r.json().get("file")
+            return False, int(r.headers.get("X-Goog-Upload-Size-Received", "0")), None
+        except Exception as e:
+            print(f"[GEMINI] Upload query error: {e}")
+            return False, None, None
+
+
+files = FileManager()
+client = Client()
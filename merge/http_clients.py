@@ -0,0 +1,101 @@
+"""
+HTTP client กลางของ container — 1 pooled keep-alive session ต่อ upstream
+
+  gemini   → generativelanguage.googleapis.com
+  telegram → api.telegram.org
+  worker   → Cloudflare Worker (r2-proxy / r2-upload / gallery / queue)
+  xhs      → xhslink.com / xiaohongshu.com
+  download → CDN วิดีโอต้นทาง (stream ลง disk)
+
+ขนาด pool อิงจำนวน worker ของ job executor และนับ connection ใหม่เทียบกับ
+connection ที่ใช้ซ้ำ (ดูได้ที่ /health)
+"""
+import threading
+
+import requests as http_requests
+from requests.adapters import HTTPAdapter
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+
+from jobs import PIPELINE_WORKERS
+
+# timeout default ต่อ upstream: (connect, read) — caller ส่ง timeout= เองได้เสมอ
+# pool: จำนวน keep-alive connection ต่อ host (ต่อ worker ของ executor)
+UPSTREAMS = {
+    "gemini":   {"timeout": (10, 60),  "pool_per_worker": 4},
+    "telegram": {"timeout": (5, 30),   "pool_per_worker": 2},
+    "worker":   {"timeout": (5, 120),  "pool_per_worker": 6},
+    "xhs":      {"timeout": (5, 15),   "pool_per_worker": 2},
+    "download": {"timeout": (10, 120), "pool_per_worker": 1},
+}
+
+_stats_lock = threading.Lock()
+_stats = {name: {"requests": 0, "new_connections": 0} for name in UPSTREAMS}
+
+
+def _count(name, key):
+    with _stats_lock:
+        _stats[name][key] += 1
+
+
+def _counting_pool(base, name):
+    class _Pool(base):
+        def _new_conn(self):
+            _count(name, "new_connections")
+            return super()._new_conn()
+    return _Pool
+
+
+class _CountingAdapter(HTTPAdapter):
+    def __init__(self, name, **kwargs):
+        self._name = name
+        super().__init__(**kwargs)
+
+    def init_poolmanager(self, *args, **kwargs):
+        super().init_poolmanager(*args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = {
+            "http": _counting_pool(HTTPConnectionPool, self._name),
+            "https": _counting_pool(HTTPSConnectionPool, self._name),
+        }
+
+    def send(self, request, **kwargs):
+        _count(self._name, "requests")
+        return super().send(request, **kwargs)
+
+
+class _Session(http_requests.Session):
+    """Session ที่ใส่ timeout default ของ upstream ให้ถ้า caller ไม่ได้ระบุ"""
+    def __init__(self, default_timeout):
+        super().__init__()
+        self._default_timeout = default_timeout
+
+    def request(self, method, url, **kwargs):
+        if kwargs.get("timeout") is None:
+            kwargs["timeout"] = self._default_timeout
+        return super().request(method, url, **kwargs)
+
+
+def _make_session(name, cfg):
+    s = _Session(cfg["timeout"])
+    size = max(4, cfg["pool_per_worker"] * PIPELINE_WORKERS)
+    adapter = _CountingAdapter(name, pool_connections=4, pool_maxsize=size, pool_block=False)
+    s.mount("https://", adapter)
+    s.mount("http://", adapter)
+    return s
+
+
+_sessions = {name: _make_session(name, cfg) for name, cfg in UPSTREAMS.items()}
+
+gemini = _sessions["gemini"]
+telegram = _sessions["telegram"]
+worker = _sessions["worker"]
+xhs = _sessions["xhs"]
+download = _sessions["download"]
+
+
+def stats():
+    """จำนวน request / connection ใหม่ / ครั้งที่ใช้ connection ซ้ำ ต่อ upstream"""
+    with _stats_lock:
+        out = {}
+        for name, st in _stats.items():
+            out[name] = dict(st, reused=max(0, st["requests"] - st["new_connections"]))
+        return out
@@ -0,0 +1,187 @@
+"""
+Job executor สำหรับ /pipeline — worker จำนวนจำกัด + คิวรอแบบมีขอบเขต + registry สถานะงาน
+
+ENV:
+  PIPELINE_WORKERS     จำนวนงานที่รันพร้อมกัน (default 2)
+  PIPELINE_QUEUE_SIZE  จำนวนงานที่รอในคิวได้สูงสุด (default 0 = ไม่จำกัด รับทุกงานเข้าคิว)
+                       ตั้ง > 0 แล้วคิวเต็มจะตอบ 429 + Retry-After — Worker (worker/src/pipeline.ts)
+                       ยังถือว่า non-OK ทุกแบบคืองานล้มเหลว อย่าเปิดจนกว่า Worker จะ retry ตาม Retry-After
+  PIPELINE_HISTORY     จำนวนงานที่จบแล้วที่เก็บไว้ให้ GET /jobs ดู (default 100)
+"""
+import os
+import queue
+import threading
+import time
+from collections import OrderedDict
+
+PIPELINE_WORKERS = int(os.environ.get("PIPELINE_WORKERS", "2"))
+PIPELINE_QUEUE_SIZE = int(os.environ.get("PIPELINE_QUEUE_SIZE", "0"))
+PIPELINE_HISTORY = int(os.environ.get("PIPELINE_HISTORY", "100"))
+
+# ใช้ประมาณ Retry-After ก่อนมีสถิติงานจริง
+DEFAULT_JOB_SECONDS = 120
+
+
+def _iso(ts):
+    return time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime(ts)) if ts else None
+
+
+class QueueFull(Exception):
+    """คิวเต็ม (เฉพาะเมื่อตั้ง queue_size > 0) — caller ควรตอบ 429 พร้อม Retry-After"""
+    def __init__(self, retry_after):
+        super().__init__(f"Pipeline queue full, retry after {retry_after}s")
+        self.retry_after = retry_after
+
+
+class JobExecutor:
+    def __init__(self, workers=PIPELINE_WORKERS, queue_size=PIPELINE_QUEUE_SIZE, history=PIPELINE_HISTORY):
+        self.workers = workers
+        self.queue_size = queue_size
+        self.history = history
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._jobs = OrderedDict()
+        self._pending = []          # video_id ตามลำดับคิว (ใช้คำนวณ queue position)
+        self._lock = threading.Lock()
+        self._running = 0
+        self._durations = []        # เวลางานล่าสุด ใช้ประมาณ Retry-After
+        self._threads = []
+
+    def start(self):
+        with self._lock:
+            if self._threads:
+                return
+            for i in range(self.workers):
+                t = threading.Thread(target=self._worker, name=f"pipeline-worker-{i}", daemon=True)
+                t.start()
+                self._threads.append(t)
+
+    def submit(self, job_id, fn, *args):
+        """ใส่งานเข้าคิว — raise QueueFull ถ้าคิวเต็ม"""
+        self.start()
+        with self._lock:
+            existing = self._jobs.get(job_id)
+            if existing and existing["state"] in ("queued", "running"):
+                # Worker retry ของงานที่ยังอยู่ในระบบ — ไม่ต้องรันซ้ำ
+                return self._view(existing)
+            job = {
+                "id": job_id,
+                "state": "queued",
+                "step": None,
+                "stage": None,
+                "error": None,
+                "queuedAt": time.time(),
+                "startedAt": None,
+                "finishedAt": None,
+            }
+            try:
+                self._queue.put_nowait((job_id, fn, args))
+            except queue.Full:
+                raise QueueFull(self._retry_after())
+            self._jobs[job_id] = job
+            self._jobs.move_to_end(job_id)
+            self._pending.append(job_id)
+            self._trim()
+        return self.get(job_id)
+
+    def set_stage(self, job_id, step, stage):
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job:
+                job["step"] = step
+                job["stage"] = stage
+
+    def set_timings(self, job_id, stages):
+        """เวลาแต่ละ stage ของ pipeline (wall / serial / saved)"""
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job:
+                job["stages"] = list(stages)
+
+    def annotate(self, job_id, **fields):
+        """แนบข้อมูลเพิ่มให้ job (เช่น cache hit/miss ต่อ stage) — แสดงใน /jobs"""
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job:
+                job.update(fields)
+
+    def _worker(self):
+        while True:
+            job_id, fn, args = self._queue.get()
+            with self._lock:
+                if job_id in self._pending:
+                    self._pending.remove(job_id)
+                job = self._jobs.get(job_id)
+                if job:
+                    job["state"] = "running"
+                    job["startedAt"] = time.time()
+                self._running += 1
+            try:
+                fn(*args)
+                state, error = "done", None
+            except Exception as e:
+                print(f"[JOBS] Job {job_id} crashed: {e}")
+                state, error = "failed", str(e)[:200]
+            finally:
+                with self._lock:
+                    self._running -= 1
+                    job = self._jobs.get(job_id)
+                    if job:
+                        if job["state"] == "running":
+                            job["state"] = state
+                            job["error"] = error
+                        job["finishedAt"] = time.time()
+                        if job["startedAt"]:
+                            self._durations = (self._durations + [job["finishedAt"] - job["startedAt"]])[-20:]
+                self._queue.task_done()
+
+    def mark_failed(self, job_id, error):
+        """ให้งานที่จับ exception เองรายงานว่า fail (run_pipeline_bg ไม่ raise ออกมา)"""
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job:
+                job["state"] = "failed"
+                job["error"] = str(error)[:200]
+
+    def _retry_after(self):
+        avg = sum(self._durations) / len(self._durations) if self._durations else DEFAULT_JOB_SECONDS
+        # งานในคิวทั้งหมดต้องไหลผ่าน worker ก่อนจะมีที่ว่าง
+        waves = (len(self._pending) + self._running) / max(self.workers, 1)
+        return max(5, int(avg * max(waves, 1) / 2))
+
+    def _trim(self):
+        finished = [k for k, j in self._jobs.items() if j["state"] in ("done", "failed")]
+        for k in finished[:max(0, len(finished) - self.history)]:
+            del self._jobs[k]
+
+    def _view(self, job):
+        out = dict(job)
+        out["queuedAt"] = _iso(job["queuedAt"])
+        out["startedAt"] = _iso(job["startedAt"])
+        out["finishedAt"] = _iso(job["finishedAt"])
+        out["queuePosition"] = self._pending.index(job["id"]) + 1 if job["id"] in self._pending else None
+        return out
+
+    def get(self, job_id):
+        with self._lock:
+            job = self._jobs.get(job_id)
+            return self._view(job) if job else None
+
+    def list(self):
+        with self._lock:
+            return [self._view(j) for j in self._jobs.values()]
+
+    def load(self):
+        """สถานะโหลดสำหรับ /health — ให้ Worker ตัดสินใจส่งงานหรือรอ"""
+        with self._lock:
+            queued = len(self._pending)
+            bounded = self.queue_size > 0
+            return {
+                "workers": self.workers,
+                "running": self._running,
+                "queued": queued,
+                "queue_size": self.queue_size,
+                # queue_size 0 = ไม่จำกัด → free_slots เป็น None
+                "free_slots": (max(0, self.workers - self._running) + max(0, self.queue_size - queued)
+                               if bounded else None),
+                "accepting": queued < self.queue_size or not bounded,
+            }
@@ -0,0 +1,468 @@
+"""
+FFmpeg merge engine — ffmpeg process เดียวต่อ 1 งาน
+
+PCM (s16le ทาง stdin) → pad/trim ใน filter graph → (burn ASS) → MP4
+และ thumbnail WebP เป็น output ที่สองจาก decode เดียวกัน
+ใช้ร่วมกันทั้ง /merge และ pipeline
+
+burn ซับแบบแบ่ง segment (MERGE_SEGMENTS > 1): ตัดวิดีโอที่ keyframe (stream copy) → burn ASS
+ทุก segment พร้อมกัน (เลื่อนเวลาซับตามจุดเริ่มของ segment) → ต่อด้วย concat demuxer แบบ copy
+แล้ว encode เสียงพากย์ + mux รอบเดียว; ล้มเมื่อไหร่ → กลับไป burn แบบ process เดียว
+
+ENV:
+  ANALYSIS_PROXY  profile ของวิดีโอย่อที่ส่งให้ Gemini วิเคราะห์ "ด้านสั้น:fps:bitrate"
+                  (default "360:2:150k", "off" = ส่งไฟล์ต้นฉบับ)
+  STORYBOARD_SCENE  threshold ของ scene change ตอนเลือกเฟรม storyboard (default 0.3)
+  MERGE_SEGMENTS  จำนวน segment ตอน burn ซับ (default 0 = process เดียว, "auto" = จำนวน CPU)
+  MERGE_SEGMENT_MIN_SECONDS  ความยาวขั้นต่ำต่อ segment — คลิปสั้นได้ segment น้อยลง (default 4)
+"""
+import glob
+import json
+import os
+import re
+import subprocess
+import tempfile
+import threading
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+THUMB_FILTER = "scale=270:480:force_original_aspect_ratio=increase,crop=270:480"
+
+ANALYSIS_PROXY = os.environ.get("ANALYSIS_PROXY", "360:2:150k")
+STORYBOARD_SCENE = float(os.environ.get("STORYBOARD_SCENE", "0.3"))
+MERGE_SEGMENTS = os.environ.get("MERGE_SEGMENTS", "0")
+MERGE_SEGMENT_MIN_SECONDS = float(os.environ.get("MERGE_SEGMENT_MIN_SECONDS", "4"))
+
+
+def probe(path):
+    """ffprobe ครั้งเดียว → (duration, width, height) — ค่า default เหมือนเดิมถ้าอ่านไม่ได้"""
+    r = subprocess.run([
+        "ffprobe", "-v", "error",
+        "-select_streams", "v:0",
+        "-show_entries", "format=duration:stream=width,height",
+        "-of", "json", path
+    ], capture_output=True, text=True)
+    try:
+        info = json.loads(r.stdout or "{}")
+    except ValueError:
+        info = {}
+    fmt = info.get("format") or {}
+    streams = info.get("streams") or [{}]
+    try:
+        duration = float(fmt.get("duration"))
+    except (TypeError, ValueError):
+        duration = None
+    width = streams[0].get("width") or 1080
+    height = streams[0].get("height") or 1920
+    return duration, int(width), int(height)
+
+
+def pcm_duration(pcm, sample_rate=24000):
+    """ความยาว PCM s16le mono (วินาที) — ไม่ต้อง ffprobe"""
+    return len(pcm) / 2.0 / sample_rate
+
+
+def _escape_filter_path(path):
+    return path.replace("\\", "\\\\").replace(":", "\\:").replace("'", "\\'")
+
+
+def _burn_filter(ass_path, fontsdir=None):
+    vf = f"ass={_escape_filter_path(ass_path)}"
+    if fontsdir:
+        vf += f":fontsdir={_escape_filter_path(fontsdir)}"
+    return vf
+
+
+def build_merge_cmd(video_path, output_path, duration, sample_rate=24000,
+                    ass_path=None, fontsdir=None, thumb_path=None, preset="fast", input_args=()):
+    """
+    สร้าง ffmpeg command ของ merge engine (แยกออกมาเพื่อ debug/benchmark ได้)
+    input_args: option หน้า -i ของวิดีโอ (เช่น ["-f", "concat", "-safe", "0"] ตอนต่อ segment)
+    """
+    dur = f"{duration:.3f}"
+    graph = [f"[1:a]apad=whole_dur={dur},atrim=end={dur}[a]"]
+
+    if ass_path:
+        vf = _burn_filter(ass_path, fontsdir)
+        if thumb_path:
+            graph.append(f"[0:v]{vf},split=2[v][vt]")
+        else:
+            graph.append(f"[0:v]{vf}[v]")
+        video_map, video_codec = "[v]", ["-c:v", "libx264", "-preset", preset]
+    else:
+        # ไม่มีซับ → stream copy วิดีโอ, decode เฉพาะไว้ทำ thumbnail
+        if thumb_path:
+            graph.append("[0:v]null[vt]")
+        video_map, video_codec = "0:v:0", ["-c:v", "copy"]
+
+    if thumb_path:
+        graph.append(f"[vt]trim=start=0.1,setpts=PTS-STARTPTS,{THUMB_FILTER}[th]")
+
+    cmd = [
+        "ffmpeg", "-y", "-nostats", "-progress", "pipe:1",
+        *input_args, "-i", video_path,
+        "-f", "s16le", "-ar", str(sample_rate), "-ac", "1", "-i", "pipe:0",
+        "-filter_complex", ";".join(graph),
+        "-map", video_map, "-map", "[a]",
+        *video_codec, "-c:a", "aac",
+        "-t", dur, output_path,
+    ]
+    if thumb_path:
+        cmd += ["-map", "[th]", "-frames:v", "1", "-q:v", "80", thumb_path]
+    return cmd
+
+
+def _run(cmd, pcm=None, on_progress=None, what="merge"):
+    """
+    รัน ffmpeg ที่รายงาน -progress ทาง stdout — ส่ง pcm ทาง stdin (ถ้ามี)
+    raise Exception ถ้า ffmpeg fail
+    """
+    p = subprocess.Popen(cmd, stdin=subprocess.PIPE if pcm is not None else subprocess.DEVNULL,
+                         stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+
+    # เขียน PCM ใน thread แยก — กัน deadlock ระหว่าง stdin กับ progress pipe
+    feed_error = []
+
+    def _feed():
+        try:
+            if isinstance(pcm, (bytes, bytearray, memoryview)):
+                p.stdin.write(pcm)
+            else:
+                for chunk in pcm:
+                    p.stdin.write(chunk)
+                    p.stdin.flush()
+        except (BrokenPipeError, OSError):
+            pass
+        except Exception as e:
+            # แหล่งเสียงล้มกลางทาง (เช่น TTS stream) — หยุด ffmpeg ไม่ให้ได้ไฟล์เสียงขาด
+            feed_error.append(e)
+            p.kill()
+        finally:
+            try:
+                p.stdin.close()
+            except OSError:
+                pass
+
+    stderr_tail = []
+
+    def _drain_stderr():
+        for line in p.stderr:
+            stderr_tail.append(line)
+            del stderr_tail[:-40]
+
+    threads = [threading.Thread(target=_drain_stderr, daemon=True)]
+    if pcm is not None:
+        threads.append(threading.Thread(target=_feed, daemon=True))
+    for t in threads:
+        t.start()
+
+    for raw in p.stdout:
+        line = raw.decode("utf-8", "replace").strip()
+        if on_progress and line.startswith("out_time_us="):
+            us_val = line.split("=", 1)[1]
+            if us_val.isdigit():
+                try:
+                    on_progress(int(us_val) / 1000000.0)
+                except Exception:
+                    pass
+
+    p.wait()
+    for t in threads:
+        t.join(timeout=5)
+    if feed_error:
+        raise feed_error[0]
+    if p.returncode != 0:
+        tail = b"".join(stderr_tail).decode("utf-8", "replace")
+        raise Exception(f"FFmpeg {what} failed ({p.returncode}): {tail[-300:]}")
+
+
+def segment_count(duration, spec=None):
+    """MERGE_SEGMENTS → จำนวน segment ของคลิปนี้ (1 = burn ด้วย process เดียว)"""
+    spec = str(MERGE_SEGMENTS if spec is None else spec).strip().lower()
+    try:
+        n = (os.cpu_count() or 1) if spec == "auto" else int(spec or 0)
+    except ValueError:
+        print(f"[MERGE] Invalid MERGE_SEGMENTS={spec!r}, burning in a single process")
+        return 1
+    if duration and MERGE_SEGMENT_MIN_SECONDS > 0:
+        n = min(n, int(duration // MERGE_SEGMENT_MIN_SECONDS))
+    return max(1, n)
+
+
+def keyframes(video_path):
+    """เวลา keyframe ของวิดีโอ (วินาที เรียงแล้ว) — อ่าน flag ของ packet ไม่ต้อง decode"""
+    r = subprocess.run([
+        "ffprobe", "-v", "error",
+        "-select_streams", "v:0",
+        "-show_entries", "packet=pts_time,flags",
+        "-of", "csv=p=0", video_path
+    ], capture_output=True, text=True)
+    times = set()
+    for line in r.stdout.splitlines():
+        pts, _, flags = line.partition(",")
+        if "K" not in flags:
+            continue
+        try:
+            times.add(float(pts))
+        except ValueError:
+            pass
+    return sorted(times)
+
+
+def plan_cuts(keys, duration, n):
+    """เลือก keyframe ที่ใกล้จุดแบ่งเท่าๆ กัน n ส่วนที่สุด → จุดตัด (ไม่รวม 0) — GOP ยาวอาจได้น้อยกว่า n-1"""
+    cuts = []
+    min_len = min(MERGE_SEGMENT_MIN_SECONDS, duration / n) / 2
+    for k in range(1, n):
+        target = duration * k / n
+        prev = cuts[-1] if cuts else 0.0
+        options = [t for t in keys if t - prev >= min_len and duration - t >= min_len]
+        if not options:
+            break
+        cuts.append(min(options, key=lambda t: abs(t - target)))
+    return cuts
+
+
+def split_at_keyframes(video_path, out_dir, cuts):
+    """
+    ตัดวิดีโอ (เฉพาะภาพ, stream copy) ตรง keyframe → [(path, start, end)]
+    start/end อ่านจาก segment list ของ ffmpeg — เวลาจริงในคลิปต้นฉบับ ใช้เลื่อนเวลาซับ
+    """
+    list_path = os.path.join(out_dir, "split.csv")
+    # ลบ 1ms กันเวลาที่ปัดทศนิยมเกิน pts จริง (ไม่งั้น segment muxer ไปตัดที่ keyframe ถัดไป)
+    times = ",".join(f"{max(t - 0.001, 0):.6f}" for t in cuts)
+    r = subprocess.run([
+        "ffmpeg", "-y", "-v", "error",
+        "-i", video_path,
+        "-map", "0:v:0", "-c", "copy",
+        "-f", "segment", "-segment_times", times, "-reset_timestamps", "1",
+        "-segment_list", list_path, "-segment_list_type", "csv",
+        os.path.join(out_dir, "src_%03d.mp4"),
+    ], capture_output=True, text=True)
+    if r.returncode != 0:
+        raise Exception(f"FFmpeg split failed ({r.returncode}): {r.stderr[-300:]}")
+    parts = []
+    with open(list_path) as f:
+        for line in f:
+            name, start, end = line.strip().rsplit(",", 2)
+            parts.append((os.path.join(out_dir, name), float(start), float(end)))
+    return parts
+
+
+def build_burn_cmd(segment_path, output_path, offset, ass_path, fontsdir=None,
+                   thumb_path=None, preset="fast", threads=0):
+    """
+    ffmpeg command ของการ burn ซับ 1 segment (ภาพอย่างเดียว)
+    offset: เวลาเริ่มของ segment ในคลิปต้นฉบับ — เลื่อน PTS ให้ ass เห็นเวลาเดิม แล้วค่อยเริ่ม 0 ใหม่
+    """
+    vf = f"setpts=PTS+{offset:.6f}/TB,{_burn_filter(ass_path, fontsdir)},setpts=PTS-STARTPTS"
+    if thumb_path:
+        graph = (f"[0:v]{vf},split=2[v][vt];"
+                 f"[vt]trim=start=0.1,setpts=PTS-STARTPTS,{THUMB_FILTER}[th]")
+    else:
+        graph = f"[0:v]{vf}[v]"
+    cmd = [
+        "ffmpeg", "-y", "-nostats", "-progress", "pipe:1",
+        "-i", segment_path,
+        "-filter_complex", graph,
+        "-map", "[v]", "-an",
+        "-c:v", "libx264", "-preset", preset,
+    ]
+    if threads:
+        cmd += ["-threads", str(threads)]
+    cmd.append(output_path)
+    if thumb_path:
+        cmd += ["-map", "[th]", "-frames:v", "1", "-q:v", "80", thumb_path]
+    return cmd
+
+
+def merge_segmented(video_path, pcm, output_path, duration, segments, sample_rate=24000,
+                    ass_path=None, fontsdir=None, thumb_path=None, on_progress=None):
+    """
+    burn ซับแบบขนาน: ตัดที่ keyframe → burn ทุก segment พร้อมกัน → concat (copy) + เสียงพากย์
+    return จำนวน segment ที่ใช้จริง (1 = GOP ยาวเกินจะแบ่ง → ทำแบบ process เดียวแทน)
+    raise Exception ถ้า ffmpeg fail
+    """
+    cuts = plan_cuts(keyframes(video_path), duration, segments)
+    if not cuts:
+        merge(video_path, pcm, output_path, duration, sample_rate, ass_path=ass_path,
+              fontsdir=fontsdir, thumb_path=thumb_path, on_progress=on_progress, segments=1)
+        return 1
+
+    with tempfile.TemporaryDirectory(prefix="burn_", dir=os.path.dirname(output_path) or None) as tmp:
+        parts = split_at_keyframes(video_path, tmp, cuts)
+        threads = max(1, (os.cpu_count() or 1) // len(parts))
+        print(f"[MERGE] Burning subtitles in {len(parts)} segments "
+              f"({', '.join(f'{end - start:.1f}' for _p, start, end in parts)}s)")
+
+        # progress รวม = ผลรวมวินาทีที่แต่ละ segment encode ไปแล้ว — worker แค่จดไว้,
+        # thread ที่รอผลเป็นคนเรียก on_progress (ProgressWriter มีคนเขียนคนเดียว)
+        done = [0.0] * len(parts)
+        lock = threading.Lock()
+
+        def burn(k):
+            path, start, end = parts[k]
+
+            def seg_progress(seconds):
+                with lock:
+                    done[k] = min(seconds, end - start)
+
+            out = os.path.join(tmp, f"burn_{k:03d}.mp4")
+            _run(build_burn_cmd(path, out, start, ass_path, fontsdir,
+                                thumb_path=thumb_path if k == 0 else None, threads=threads),
+                 on_progress=seg_progress, what=f"burn segment {k}")
+            return out
+
+        outs = [None] * len(parts)
+        with ThreadPoolExecutor(max_workers=len(parts), thread_name_prefix="burn") as pool:
+            futures = {pool.submit(burn, k): k for k in range(len(parts))}
+            pending, reported = set(futures), 0.0
+            while pending:
+                finished, pending = wait(pending, timeout=0.5, return_when=FIRST_COMPLETED)
+                for fut in finished:
+                    outs[futures[fut]] = fut.result()
+                with lock:
+                    total = sum(done)
+                if on_progress and total > reported:
+                    reported = total
+                    on_progress(total)
+
+        list_path = os.path.join(tmp, "concat.txt")
+        with open(list_path, "w") as f:
+            f.writelines(f"file '{path}'\n" for path in outs)
+        _run(build_merge_cmd(list_path, output_path, duration, sample_rate,
+                             input_args=["-f", "concat", "-safe", "0"]),
+             pcm=pcm, what="concat")
+    if on_progress:
+        on_progress(duration)
+    return len(parts)
+
+
+def merge(video_path, pcm, output_path, duration, sample_rate=24000,
+          ass_path=None, fontsdir=None, thumb_path=None, on_progress=None, segments=None):
+    """
+    รัน merge engine — ffmpeg process เดียว (หรือ burn แบบแบ่ง segment ถ้า MERGE_SEGMENTS > 1)
+
+    pcm: bytes/memoryview PCM s16le mono (ส่งทาง stdin ไม่ต้องเขียน audio.raw/wav)
+         หรือ iterable ของ chunk (เช่น streaming TTS) — ffmpeg encode ไปพร้อมกับที่เสียงทยอยมา
+    on_progress(seconds): เรียกเมื่อ ffmpeg encode ไปได้กี่วินาที
+    segments: จำนวน segment ตอน burn ซับ (None = ตาม MERGE_SEGMENTS)
+    raise Exception ถ้า ffmpeg fail
+    """
+    if ass_path and isinstance(pcm, (bytes, bytearray, memoryview)):
+        segments = segment_count(duration) if segments is None else segments
+        if segments > 1:
+            try:
+                merge_segmented(video_path, pcm, output_path, duration, segments, sample_rate,
+                                ass_path=ass_path, fontsdir=fontsdir, thumb_path=thumb_path,
+                                on_progress=on_progress)
+                return
+            except Exception as e:
+                print(f"[MERGE] Segmented burn failed ({e}), falling back to single process")
+
+    cmd = build_merge_cmd(video_path, output_path, duration, sample_rate,
+                          ass_path=ass_path, fontsdir=fontsdir, thumb_path=thumb_path)
+    _run(cmd, pcm=pcm, on_progress=on_progress)
+
+
+def analysis_profile(spec=None):
+    """
+    "360:2:150k" → {"short_side": 360, "fps": 2.0, "bitrate": "150k", "name": "360:2:150k"}
+    "off" / "original" / "" → None (ส่งไฟล์ต้นฉบับ)
+    """
+    spec = (ANALYSIS_PROXY if spec is None else spec).strip().lower()
+    if spec in ("", "off", "original", "0"):
+        return None
+    parts = spec.split(":")
+    if len(parts) != 3:
+        raise ValueError(f"invalid analysis proxy profile: {spec!r} (expected short_side:fps:bitrate)")
+    return {"short_side": int(parts[0]), "fps": float(parts[1]), "bitrate": parts[2], "name": spec}
+
+
+def build_proxy_cmd(video_path, output_path, profile):
+    """
+    ffmpeg command ของ analysis proxy — วิดีโอเล็ก fps ต่ำ ไม่มีเสียง
+    Gemini ใช้แค่ดูว่าสินค้าหน้าตาเป็นยังไง (สุ่มเฟรมราว 1 fps อยู่แล้ว)
+    """
+    side = profile["short_side"]
+    fps = profile["fps"]
+    br = profile["bitrate"]
+    return [
+        "ffmpeg", "-y", "-v", "error",
+        "-i", video_path,
+        # ด้านสั้น = side (แนวตั้ง 1080x1920 → 360x640) และให้หาร 2 ลงตัวสำหรับ x264
+        "-vf", f"fps={fps:g},scale={side}:{side}:force_original_aspect_ratio=increase:force_divisible_by=2",
+        "-an",
+        "-c:v", "libx264", "-preset", "veryfast",
+        "-b:v", br, "-maxrate", br, "-bufsize", br,
+        "-g", str(max(1, int(fps * 10))),
+        "-movflags", "+faststart",
+        output_path,
+    ]
+
+
+def make_analysis_proxy(video_path, output_path, profile):
+    """สร้าง analysis proxy — raise Exception ถ้า ffmpeg fail"""
+    r = subprocess.run(build_proxy_cmd(video_path, output_path, profile), capture_output=True, text=True)
+    if r.returncode != 0:
+        raise Exception(f"FFmpeg proxy failed ({r.returncode}): {r.stderr[-300:]}")
+    return output_path
+
+
+_PTS_TIME_RE = re.compile(r"pts_time:\s*([0-9.]+)")
+
+
+def _grab_frames(video_path, out_dir, prefix, vf, max_frames):
+    """ffmpeg เขียน JPEG ตาม filter vf → [(t, path)] (เวลาจาก showinfo)"""
+    pattern = os.path.join(out_dir, f"{prefix}_%03d.jpg")
+    r = subprocess.run([
+        "ffmpeg", "-y", "-v", "info", "-nostats",
+        "-i", video_path, "-an",
+        "-vf", f"{vf},showinfo",
+        "-fps_mode", "vfr", "-frames:v", str(max_frames), "-q:v", "5",
+        pattern,
+    ], capture_output=True, text=True)
+    if r.returncode != 0:
+        raise Exception(f"FFmpeg storyboard failed ({r.returncode}): {r.stderr[-300:]}")
+    times = [float(t) for t in _PTS_TIME_RE.findall(r.stderr)]
+    paths = sorted(glob.glob(os.path.join(out_dir, f"{prefix}_*.jpg")))
+    return list(zip(times, paths))
+
+
+def _spread(items, n):
+    """เลือก n ตัวกระจายเท่าๆ กันจาก list ที่เรียงตามเวลาแล้ว (เก็บตัวแรกไว้เสมอ)"""
+    if len(items) <= n:
+        return list(items)
+    step = (len(items) - 1) / (n - 1) if n > 1 else 0
+    return [items[round(i * step)] for i in range(n)]
+
+
+def extract_storyboard(video_path, out_dir, n=8, duration=None, short_side=384, scene=None):
+    """
+    เลือก n เฟรมที่เป็นตัวแทนของวิดีโอด้วย scene change → JPEG เล็กๆ
+    ฉากเปลี่ยนน้อยกว่า n → เติมด้วยเฟรมที่เว้นระยะเท่าๆ กันตลอดคลิป
+
+    return [(t วินาที, jpeg bytes)] เรียงตามเวลา
+    """
+    scene = STORYBOARD_SCENE if scene is None else scene
+    scale = f"scale={short_side}:{short_side}:force_original_aspect_ratio=increase:force_divisible_by=2"
+    # ลด fps ก่อนคำนวณ scene score — เร็วกว่า decode เทียบทุกเฟรม และพอสำหรับจับฉากเปลี่ยน
+    frames = _grab_frames(video_path, out_dir, "scene",
+                          f"fps=4,{scale},select='eq(n,0)+gt(scene,{scene})'", n * 4)
+    frames = _spread(frames, n)
+
+    if len(frames) < n and duration:
+        uniform = _grab_frames(video_path, out_dir, "grid", f"fps={n / duration:.4f},{scale}", n)
+        # เติมเฟรมที่ห่างจากเฟรมที่มีอยู่มากที่สุดก่อน
+        min_gap = duration / (n * 2)
+        for t, path in sorted(uniform, key=lambda f: -min((abs(f[0] - t2) for t2, _ in frames), default=duration)):
+            if len(frames) >= n:
+                break
+            if all(abs(t - t2) >= min_gap for t2, _ in frames):
+                frames.append((t, path))
+        frames.sort()
+
+    out = []
+    for t, path in frames:
+        with open(path, "rb") as f:
+            out.append((t, f.read()))
+    return out
@@ -0,0 +1,98 @@
+"""
+Progress record ของงาน (_processing/{id}.json) ที่ container ถือไว้ใน memory
+
+pipeline thread เรียก update() ได้บ่อยแค่ไหนก็ได้ — ไม่บล็อก ไม่ยิง network
+writer thread ต่องานจะรวม update แล้ว flush ไป R2 อย่างมาก 1 ครั้งต่อ interval
+(flush ทันทีเมื่อขึ้น stage ใหม่ หรือ close) ถ้า flush ช้า state ระหว่างทางจะถูกข้ามไป
+เขียนแค่ state ล่าสุด
+
+ENV:
+  PROGRESS_FLUSH_INTERVAL  วินาทีขั้นต่ำระหว่าง flush (default 3)
+"""
+import os
+import threading
+import time
+
+PROGRESS_FLUSH_INTERVAL = float(os.environ.get("PROGRESS_FLUSH_INTERVAL", "3"))
+
+
+def _now():
+    return time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime())
+
+
+class ProgressWriter:
+    def __init__(self, record, flush_fn, interval=PROGRESS_FLUSH_INTERVAL):
+        """
+        record: state เริ่มต้น (เช่น record ที่ Worker สร้างไว้)
+        flush_fn(record_dict): เขียน record ไปปลายทาง — เรียกจาก writer thread เท่านั้น
+        """
+        self._record = dict(record)
+        self._flush_fn = flush_fn
+        self._interval = interval
+        self._cond = threading.Condition()
+        self._version = 0
+        self._flushed_version = 0
+        self._urgent = False
+        self._closed = False
+        self._last_flush = 0.0
+        self.flushes = 0
+        self.updates = 0
+        self._thread = threading.Thread(target=self._run, name="progress-writer", daemon=True)
+        self._thread.start()
+
+    def update(self, flush_now=False, **fields):
+        """แก้ record ใน memory — flush_now=True เมื่อขึ้น stage ใหม่ (ไม่รอ interval)"""
+        with self._cond:
+            if self._closed:
+                return
+            self._record.update(fields)
+            self._record["updatedAt"] = _now()
+            self._version += 1
+            self.updates += 1
+            if flush_now:
+                self._urgent = True
+            self._cond.notify()
+
+    def get(self):
+        with self._cond:
+            return dict(self._record)
+
+    def close(self, flush=True, timeout=15):
+        """หยุด writer — flush=True เขียน state สุดท้ายก่อนจบ"""
+        with self._cond:
+            if self._closed:
+                return
+            self._closed = True
+            if flush and self._version != self._flushed_version:
+                self._urgent = True
+            else:
+                self._flushed_version = self._version
+            self._cond.notify()
+        self._thread.join(timeout)
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while True:
+                    pending = self._version != self._flushed_version
+                    if self._closed and not pending:
+                        return
+                    if pending:
+                        wait = 0 if self._urgent else self._last_flush + self._interval - time.time()
+                        if wait <= 0:
+                            break
+                        self._cond.wait(wait)
+                    else:
+                        self._cond.wait()
+                snapshot = dict(self._record)
+                version = self._version
+                self._urgent = False
+            try:
+                self._flush_fn(snapshot)
+                self.flushes += 1
+            except Exception as e:
+                print(f"[PROGRESS] Flush error: {e}")
+            with self._cond:
+                self._last_flush = time.time()
+                if self._flushed_version < version:
+                    self._flushed_version = version
@@ -0,0 +1,165 @@
+"""
+Rate limit primitives ที่ใช้ร่วมกันทั้ง container
+"""
+import threading
+import time
+
+
+class TokenBucket:
+    """
+    Token bucket แบบ thread-safe
+
+    rate: token ต่อวินาที, burst: จำนวน token สูงสุดที่สะสมได้
+    penalize(seconds): ห้ามใช้จนกว่าจะพ้นเวลา (เช่น retry_after จาก 429)
+    """
+
+    def __init__(self, rate, burst):
+        self.rate = float(rate)
+        self.burst = float(burst)
+        self._tokens = float(burst)
+        self._updated = time.monotonic()
+        self._blocked_until = 0.0
+        self._lock = threading.Lock()
+
+    def _refill(self, now):
+        self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def delay(self, n=1):
+        """ต้องรออีกกี่วินาทีถึงจะได้ n token (0 = ได้เลย) — ไม่ตัด token"""
+        with self._lock:
+            now = time.monotonic()
+            self._refill(now)
+            wait = max(0.0, self._blocked_until - now)
+            if self._tokens < n:
+                wait = max(wait, (n - self._tokens) / self.rate)
+            return wait
+
+    def try_acquire(self, n=1):
+        with self._lock:
+            now = time.monotonic()
+            self._refill(now)
+            if now < self._blocked_until or self._tokens < n:
+                return False
+            self._tokens -= n
+            return True
+
+    def acquire(self, n=1, timeout=None):
+        """บล็อกจนได้ token — คืน False ถ้าเกิน timeout"""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while not self.try_acquire(n):
+            wait = self.delay(n) or 0.01
+            if deadline is not None:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return False
+                wait = min(wait, remaining)
+            time.sleep(wait)
+        return True
+
+    def refund(self, n=1):
+        with self._lock:
+            self._tokens = min(self.burst, self._tokens + n)
+
+    def penalize(self, seconds):
+        with self._lock:
+            self._blocked_until = max(self._blocked_until, time.monotonic() + seconds)
+            self._tokens = 0.0
+
+
+def acquire_all(buckets, timeout=None):
+    """ได้ token จากทุก bucket พร้อมกัน (ไม่ตัดบาง bucket ทิ้งไว้ถ้าอีกอันยังไม่พร้อม)"""
+    deadline = None if timeout is None else time.monotonic() + timeout
+    while True:
+        wait = max(b.delay() for b in buckets)
+        if wait <= 0:
+            taken = []
+            for b in buckets:
+                if not b.try_acquire():
+                    break
+                taken.append(b)
+            else:
+                return True
+            # แพ้ race กับ thread อื่น — คืน token ที่ตัดไปแล้ว
+            for b in taken:
+                b.refund()
+            wait = 0.01
+        if deadline is not None:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return False
+            wait = min(wait, remaining)
+        time.sleep(wait)
+
+
+class AdaptiveLimiter:
+    """
+    จำกัด request ต่อนาที (token bucket) + จำนวน request ที่ค้างพร้อมกันแบบ AIMD
+
+    - สำเร็จ → เพิ่ม limit ทีละ 1/limit (ครบ limit request สำเร็จ ≈ +1)
+    - overload (429/503) → ลด limit × beta ทันที (ไม่เกิน 1 ครั้งต่อ cooldown กันลดซ้ำจาก request ชุดเดียวกัน)
+      และหยุดปล่อย request ตาม retry_after ถ้ามี
+    """
+
+    def __init__(self, rpm, initial=4, minimum=1, maximum=16, beta=0.5, cooldown=2.0):
+        self.bucket = TokenBucket(rpm / 60.0, max(1.0, min(rpm / 60.0 * 5, rpm)))
+        self.rpm = rpm
+        self.limit = float(initial)
+        self.minimum = minimum
+        self.maximum = maximum
+        self.beta = beta
+        self.cooldown = cooldown
+        self.inflight = 0
+        self.waiting = 0
+        self._last_decrease = 0.0
+        self._cond = threading.Condition()
+        self.stats = {"acquired": 0, "increases": 0, "decreases": 0, "wait_s": 0.0, "timeouts": 0}
+
+    def acquire(self, timeout=None):
+        """รอจนได้ทั้ง slot และ token — คืน False ถ้าเกิน timeout"""
+        t0 = time.monotonic()
+        deadline = None if timeout is None else t0 + timeout
+        with self._cond:
+            self.waiting += 1
+            try:
+                while self.inflight >= int(self.limit):
+                    remaining = None if deadline is None else deadline - time.monotonic()
+                    if remaining is not None and remaining <= 0:
+                        self.stats["timeouts"] += 1
+                        return False
+                    self._cond.wait(remaining)
+                self.inflight += 1
+            finally:
+                self.waiting -= 1
+        remaining = None if deadline is None else max(0.0, deadline - time.monotonic())
+        if not self.bucket.acquire(timeout=remaining):
+            self.release(None)
+            with self._cond:
+                self.stats["timeouts"] += 1
+            return False
+        with self._cond:
+            self.stats["acquired"] += 1
+            self.stats["wait_s"] += time.monotonic() - t0
+        return True
+
+    def release(self, outcome, retry_after=None):
+        """outcome: "ok" / "overload" / None (error อื่น — ไม่ปรับ limit)"""
+        with self._cond:
+            self.inflight = max(0, self.inflight - 1)
+            now = time.monotonic()
+            if outcome == "ok":
+                if self.limit < self.maximum:
+                    self.limit = min(self.maximum, self.limit + 1.0 / self.limit)
+                    self.stats["increases"] += 1
+            elif outcome == "overload" and now - self._last_decrease >= self.cooldown:
+                self.limit = max(self.minimum, self.limit * self.beta)
+                self._last_decrease = now
+                self.stats["decreases"] += 1
+            self._cond.notify_all()
+        if outcome == "overload" and retry_after:
+            self.bucket.penalize(retry_after)
+
+    def status(self):
+        with self._cond:
+            return dict(self.stats, wait_s=round(self.stats["wait_s"], 1), limit=round(self.limit, 2),
+                        inflight=self.inflight, waiting=self.waiting, rpm=self.rpm)
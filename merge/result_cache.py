@@ -0,0 +1,265 @@
+"""
+Content-addressed result cache ของ pipeline
+
+key ของแต่ละ stage = SHA-256 ของ input ทั้งหมดที่มีผลกับผลลัพธ์ เช่น
+  script → sha256(source) + model + prompt
+  tts    → sha256(script) + tts model + voice
+  srt    → sha256(pcm) + sha256(script) + whisper model + subtitle model
+  final  → sha256(source) + sha256(pcm) + sha256(srt)
+
+tier 1: disk ในเครื่อง (LRU ตามขนาดรวม)
+tier 2: remote (optional) เช่น R2 ผ่าน Worker proxy — hit จาก remote จะถูก copy ลง disk
+
+ENV:
+  RESULT_CACHE_DIR        (default /tmp/dubbing-cache, ว่าง = ปิด cache)
+  RESULT_CACHE_MAX_BYTES  (default 2 GB)
+  RESULT_CACHE_R2         "1" = เปิด tier R2 ผ่าน Worker (default ปิด)
+  RESULT_CACHE_MP4        "1" = เก็บ MP4 สุดท้ายด้วย (default ปิด)
+"""
+import hashlib
+import os
+import shutil
+import threading
+import time
+from collections import OrderedDict
+
+RESULT_CACHE_DIR = os.environ.get("RESULT_CACHE_DIR", "/tmp/dubbing-cache")
+RESULT_CACHE_MAX_BYTES = int(os.environ.get("RESULT_CACHE_MAX_BYTES", str(2 * 1024 ** 3)))
+RESULT_CACHE_R2 = os.environ.get("RESULT_CACHE_R2", "") == "1"
+RESULT_CACHE_MP4 = os.environ.get("RESULT_CACHE_MP4", "") == "1"
+
+
+def key(*parts):
+    """รวม input ของ stage เป็น cache key (hex sha256)"""
+    h = hashlib.sha256()
+    for p in parts:
+        if isinstance(p, str):
+            p = p.encode("utf-8")
+        elif not isinstance(p, (bytes, bytearray, memoryview)):
+            p = repr(p).encode("utf-8")
+        h.update(len(p).to_bytes(8, "big"))
+        h.update(p)
+    return h.hexdigest()
+
+
+def sha256(data):
+    if isinstance(data, str):
+        data = data.encode("utf-8")
+    return hashlib.sha256(data).hexdigest()
+
+
+class DiskTier:
+    """ไฟล์ละ entry ใน {root}/{stage}/{key} — evict ตัวที่ใช้ล่าสุดนานที่สุดเมื่อเกิน max_bytes"""
+
+    def __init__(self, root, max_bytes):
+        self.root = root
+        self.max_bytes = max_bytes
+        self._lru = OrderedDict()     # path → size (เรียงจากเก่า → ใหม่)
+        self._total = 0
+        self._lock = threading.Lock()
+        os.makedirs(root, exist_ok=True)
+        self._scan()
+
+    def _scan(self):
+        entries = []
+        for dirpath, _dirs, files in os.walk(self.root):
+            for name in files:
+                if name.endswith(".tmp"):
+                    continue
+                path = os.path.join(dirpath, name)
+                try:
+                    st = os.stat(path)
+                except OSError:
+                    continue
+                entries.append((st.st_mtime, path, st.st_size))
+        for _mtime, path, size in sorted(entries):
+            self._lru[path] = size
+            self._total += size
+
+    def _path(self, stage, k):
+        return os.path.join(self.root, stage, k)
+
+    def get_path(self, stage, k):
+        path = self._path(stage, k)
+        with self._lock:
+            if path not in self._lru:
+                return None
+            self._lru.move_to_end(path)
+        try:
+            os.utime(path)
+        except OSError:
+            with self._lock:
+                self._total -= self._lru.pop(path, 0)
+            return None
+        return path
+
+    def put_file(self, stage, k, src_path):
+        path = self._path(stage, k)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp = f"{path}.{threading.get_ident()}.tmp"
+        shutil.copyfile(src_path, tmp)
+        os.replace(tmp, path)
+        self._add(path)
+
+    def put_bytes(self, stage, k, data):
+        path = self._path(stage, k)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp = f"{path}.{threading.get_ident()}.tmp"
+        with open(tmp, "wb") as f:
+            f.write(data)
+        os.replace(tmp, path)
+        self._add(path)
+
+    def _add(self, path):
+        size = os.path.getsize(path)
+        with self._lock:
+            self._total += size - self._lru.pop(path, 0)
+            self._lru[path] = size
+            while self._total > self.max_bytes and len(self._lru) > 1:
+                old, old_size = self._lru.popitem(last=False)
+                self._total -= old_size
+                try:
+                    os.remove(old)
+                except OSError:
+                    pass
+
+    def usage(self):
+        with self._lock:
+            return {"entries": len(self._lru), "bytes": self._total, "max_bytes": self.max_bytes}
+
+
+class WorkerR2Tier:
+    """Remote tier บน R2 ผ่าน Worker /api/r2-proxy (GET) และ /api/r2-upload (PUT) — key อยู่ใต้ _cache/"""
+
+    def __init__(self, worker_url, token, session):
+        self.worker_url = worker_url
+        self.token = token
+        self.session = session
+
+    def fetch(self, stage, k, dest_path):
+        resp = self.session.get(f"{self.worker_url}/api/r2-proxy/_cache/{stage}/{k}",
+                                headers={"x-auth-token": self.token}, stream=True, timeout=60)
+        try:
+            if resp.status_code != 200:
+                return False
+            with open(dest_path, "wb") as f:
+                for chunk in resp.iter_content(chunk_size=1024 * 1024):
+                    f.write(chunk)
+            return True
+        finally:
+            resp.close()
+
+    def store(self, stage, k, src_path):
+        with open(src_path, "rb") as f:
+            resp = self.session.put(f"{self.worker_url}/api/r2-upload/_cache/{stage}/{k}", data=f, headers={
+                "x-auth-token": self.token,
+                "content-type": "application/octet-stream",
+            }, timeout=120)
+        if resp.status_code not in (200, 201):
+            raise Exception(f"R2 cache upload failed: {resp.status_code}")
+
+
+class JobCache:
+    """มุมมอง cache ของงานเดียว — disk tier ร่วมกันทั้ง container, remote tier ต่องาน, นับ hit/miss ต่อ stage"""
+
+    def __init__(self, disk, remote=None):
+        self.disk = disk
+        self.remote = remote
+        self.report = {}
+
+    def _count(self, stage, hit):
+        st = self.report.setdefault(stage, {"hits": 0, "misses": 0})
+        st["hits" if hit else "misses"] += 1
+
+    def get_path(self, stage, k):
+        """path ของ entry บน disk (ดึงจาก remote ถ้าจำเป็น) หรือ None"""
+        if self.disk is None:
+            return None
+        path = self.disk.get_path(stage, k)
+        if path is None and self.remote is not None:
+            tmp = os.path.join(self.disk.root, f"{stage}-{k}.{threading.get_ident()}.tmp")
+            try:
+                if self.remote.fetch(stage, k, tmp):
+                    self.disk.put_file(stage, k, tmp)
+                    path = self.disk.get_path(stage, k)
+            except Exception as e:
+                print(f"[CACHE] Remote fetch error ({stage}): {e}")
+            finally:
+                if os.path.exists(tmp):
+                    os.remove(tmp)
+        self._count(stage, path is not None)
+        return path
+
+    def get_bytes(self, stage, k):
+        path = self.get_path(stage, k)
+        if path is None:
+            return None
+        try:
+            with open(path, "rb") as f:
+                return f.read()
+        except OSError:
+            # ถูก evict ไประหว่างทาง — นับเป็น miss ของ caller
+            return None
+
+    def get_text(self, stage, k):
+        data = self.get_bytes(stage, k)
+        return data.decode("utf-8") if data is not None else None
+
+    def put_bytes(self, stage, k, data):
+        if self.disk is None:
+            return
+        if isinstance(data, str):
+            data = data.encode("utf-8")
+        try:
+            self.disk.put_bytes(stage, k, data)
+            self._push(stage, k)
+        except Exception as e:
+            print(f"[CACHE] Store error ({stage}): {e}")
+
+    def put_file(self, stage, k, src_path):
+        if self.disk is None:
+            return
+        try:
+            self.disk.put_file(stage, k, src_path)
+            self._push(stage, k)
+        except Exception as e:
+            print(f"[CACHE] Store error ({stage}): {e}")
+
+    def _push(self, stage, k):
+        """copy ขึ้น remote tier ใน background — ไม่ขวาง pipeline"""
+        if self.remote is None:
+            return
+        path = self.disk.get_path(stage, k)
+        if not path:
+            return
+
+        def _run():
+            try:
+                self.remote.store(stage, k, path)
+            except Exception as e:
+                print(f"[CACHE] Remote store error ({stage}): {e}")
+        threading.Thread(target=_run, daemon=True).start()
+
+    def summary(self):
+        return " ".join(f"{stage}={st['hits']}/{st['hits'] + st['misses']}" for stage, st in self.report.items())
+
+
+_disk = None
+_disk_lock = threading.Lock()
+
+
+def disk_tier():
+    """disk tier ตัวเดียวของ container (None ถ้าปิด cache)"""
+    global _disk
+    if not RESULT_CACHE_DIR:
+        return None
+    with _disk_lock:
+        if _disk is None:
+            t0 = time.time()
+            _disk = DiskTier(RESULT_CACHE_DIR, RESULT_CACHE_MAX_BYTES)
+            print(f"[CACHE] Disk tier {RESULT_CACHE_DIR}: {_disk.usage()['entries']} entries ({time.time() - t0:.2f}s)")
+        return _disk
+
+
+def for_job(remote=None):
+    return JobCache(disk_tier(), remote if RESULT_CACHE_R2 else None)
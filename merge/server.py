@@ -10,15 +10,35 @@ import tempfile
 import subprocess
 import json
 import re
-import threading
-import requests as http_requests
-from flask import Flask, request, jsonify, send_file
+import time
+from concurrent.futures import ThreadPoolExecutor
+import align
+import gemini
+import http_clients
+import jobs
+import media
+import progress as progress_mod
+import result_cache
+import spool
+import telegram_status as tg_status
+import thaiseg
+import transcribe
+import tts
+import xhs
+from flask import Flask, Response, request, jsonify, send_file
 from flask_cors import CORS
 
 app = Flask(__name__)
 CORS(app)
 
 
+# โหลด Whisper model ครั้งเดียวตอน container start (background) — ใช้ซ้ำทุกงาน
+transcribe.preload()
+
+# Executor ของ /pipeline — จำกัดจำนวนงาน Whisper/libx264 ที่รันพร้อมกัน
+executor = jobs.JobExecutor()
+
+
 @app.route("/health", methods=["GET"])
 def health():
     """Health check — Container class ใช้เช็คว่า container พร้อมรับงาน"""
@@ -33,157 +53,219 @@ def health():
         "status": "ok" if ffmpeg_ok else "error",
         "service": "dubbing-merge-container",
         "ffmpeg": ffmpeg_ok,
+        "whisper": transcribe.status(),
+        "jobs": executor.load(),
+        "xhs": xhs.resolver.status(),
+        "gemini_files": gemini.files.status(),
+        "gemini": gemini.client.status(),
+        "cache": result_cache.disk_tier().usage() if result_cache.disk_tier() else None,
+        "telegram": tg_status.scheduler.status(),
+        "http": http_clients.stats(),
     })
 
 
+@app.route("/jobs", methods=["GET"])
+def list_jobs():
+    """รายการงาน pipeline ทั้งหมด (queued / running / done / failed)"""
+    return jsonify({"jobs": executor.list(), "load": executor.load()})
+
+
+@app.route("/jobs/<video_id>", methods=["GET"])
+def get_job(video_id):
+    """สถานะงานเดียว: state, stage, queuePosition, startedAt, finishedAt"""
+    job = executor.get(video_id)
+    if not job:
+        return jsonify({"error": "job not found"}), 404
+    return jsonify(job)
+
+
 @app.route("/merge", methods=["POST"])
 def merge():
     """
-    รับ video URL + audio base64 → ffmpeg merge → ส่ง merged video กลับ
-
-    Request JSON:
-      - video_url: URL ของ video ให้ container ดาวน์โหลดเอง
-      - audio_base64: base64 encoded PCM s16le 24kHz mono
-      - sample_rate: (optional, default 24000)
-
-    Response JSON: { video_base64, thumb_base64, duration, ... }
+    รับ video URL + audio PCM → ffmpeg merge → ส่ง merged video กลับ
+
+    Request (เลือกได้ 3 แบบ):
+      - JSON (legacy): { video_url, audio_base64, sample_rate? }
+      - multipart/form-data: fields video_url, sample_rate? + file part "audio" (PCM s16le mono)
+      - raw body PCM (application/octet-stream): ?video_url=...&sample_rate=...
+
+    Response — เลือกด้วย ?response= (หรือ field "response"):
+      - json:      { video_base64, thumb_base64, duration, ... } — default ของ request แบบ JSON
+      - multipart: multipart/mixed แบบ stream: metadata JSON + video/mp4 + image/webp
+                   — default ของ request แบบ binary
+      - upload:    PUT ผลลัพธ์ไปที่ video_put_url / thumb_put_url ที่ caller ส่งมา
+                   (+ upload_headers) แล้วตอบแค่ metadata JSON
     """
+    tmpdir = tempfile.mkdtemp(prefix="merge_")
+    streaming = False
     try:
-        data = request.get_json()
-        if not data:
-            return jsonify({"error": "JSON body required"}), 400
-
-        video_url = data.get("video_url")
-        audio_base64 = data.get("audio_base64")
-        sample_rate = int(data.get("sample_rate", 24000))
+        try:
+            req = _parse_merge_request()
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
 
-        if not video_url or not audio_base64:
-            return jsonify({"error": "video_url and audio_base64 required"}), 400
+        video_url = req["video_url"]
+        # ดาวน์โหลด video จาก URL
+        print(f"[MERGE] Downloading video from: {video_url[:80]}...")
+        video_path = os.path.join(tmpdir, "video.mp4")
+        try:
+            src = spool.download(video_url, video_path, timeout=60, session=http_clients.download)
+        except Exception as e:
+            return jsonify({"error": f"Failed to download video: {e}"}), 400
+        print(f"[MERGE] Downloaded video: {src.size / 1024 / 1024:.1f} MB")
 
-        with tempfile.TemporaryDirectory() as tmpdir:
-            # ดาวน์โหลด video จาก URL
-            print(f"[MERGE] Downloading video from: {video_url[:80]}...")
-            video_resp = http_requests.get(video_url, timeout=60)
-            if video_resp.status_code != 200:
-                return jsonify({"error": f"Failed to download video: {video_resp.status_code}"}), 400
+        duration, _vw, _vh = media.probe(video_path)
+        if duration is None:
+            duration = 10.0
 
-            video_path = os.path.join(tmpdir, "video.mp4")
-            with open(video_path, "wb") as f:
-                f.write(video_resp.content)
-            print(f"[MERGE] Downloaded video: {len(video_resp.content) / 1024 / 1024:.1f} MB")
-
-            # ดึง video duration ด้วย ffprobe
-            probe = subprocess.run([
-                "ffprobe", "-v", "error", "-show_entries", "format=duration",
-                "-of", "default=noprint_wrappers=1:nokey=1", video_path
-            ], capture_output=True, text=True)
-            duration = float(probe.stdout.strip()) if probe.stdout.strip() else 10.0
-
-            # Decode audio base64 → raw PCM
-            raw_audio = os.path.join(tmpdir, "audio.raw")
-            wav_audio = os.path.join(tmpdir, "audio.wav")
-            with open(raw_audio, "wb") as f:
-                f.write(base64.b64decode(audio_base64))
-
-            # แปลง raw PCM → WAV
-            subprocess.run([
-                "ffmpeg", "-y", "-f", "s16le", "-ar", str(sample_rate), "-ac", "1",
-                "-i", raw_audio, wav_audio
-            ], check=True, capture_output=True)
-
-            # ดึง audio duration
-            ap = subprocess.run([
-                "ffprobe", "-v", "error", "-show_entries", "format=duration",
-                "-of", "default=noprint_wrappers=1:nokey=1", wav_audio
-            ], capture_output=True, text=True)
-            audio_dur = float(ap.stdout.strip()) if ap.stdout.strip() else 0
-
-            # ปรับ audio ให้ตรงกับ video duration
-            adjusted = os.path.join(tmpdir, "audio_adj.wav")
-            diff = duration - audio_dur
-            if abs(diff) < 0.5:
-                adjusted = wav_audio
-            elif diff > 0:
-                # Audio สั้นกว่า video → pad silence
-                subprocess.run([
-                    "ffmpeg", "-y", "-i", wav_audio,
-                    "-af", f"apad=pad_dur={diff}", adjusted
-                ], capture_output=True)
-            else:
-                # Audio ยาวกว่า video → trim
-                subprocess.run([
-                    "ffmpeg", "-y", "-i", wav_audio,
-                    "-t", str(duration), adjusted
-                ], capture_output=True)
-
-            # Merge video + audio
-            output_path = os.path.join(tmpdir, "output.mp4")
-            mr = subprocess.run([
-                "ffmpeg", "-y", "-i", video_path, "-i", adjusted,
-                "-c:v", "copy", "-c:a", "aac",
-                "-map", "0:v:0", "-map", "1:a:0",
-                "-t", str(duration), output_path
-            ], capture_output=True, text=True)
-            if mr.returncode != 0:
-                return jsonify({"error": f"FFmpeg merge failed: {mr.stderr[:300]}"}), 500
-
-            # ดึง output duration
-            op = subprocess.run([
-                "ffprobe", "-v", "error", "-show_entries", "format=duration",
-                "-of", "default=noprint_wrappers=1:nokey=1", output_path
-            ], capture_output=True, text=True)
-            out_dur = float(op.stdout.strip()) if op.stdout.strip() else duration
-
-            # สร้าง thumbnail
-            thumb_path = os.path.join(tmpdir, "thumb.webp")
-            subprocess.run([
-                "ffmpeg", "-y", "-i", output_path, "-vframes", "1", "-ss", "0.1",
-                "-vf", "scale=270:480:force_original_aspect_ratio=increase,crop=270:480",
-                "-q:v", "80", thumb_path
-            ], capture_output=True)
-
-            # อ่าน output video
-            with open(output_path, "rb") as f:
-                video_bytes = f.read()
-
-            # อ่าน thumbnail (ถ้ามี)
-            thumb_bytes = None
-            if os.path.exists(thumb_path) and os.path.getsize(thumb_path) > 0:
-                with open(thumb_path, "rb") as f:
-                    thumb_bytes = f.read()
-
-            # ส่งผลลัพธ์เป็น JSON + base64 encoded video/thumb
-            result = {
-                "success": True,
-                "duration": out_dur,
-                "video_duration": duration,
-                "video_size": len(video_bytes),
-                "video_base64": base64.b64encode(video_bytes).decode("ascii"),
-            }
-            if thumb_bytes:
-                result["thumb_base64"] = base64.b64encode(thumb_bytes).decode("ascii")
-
-            return jsonify(result)
+        # Merge video + audio + thumbnail ใน ffmpeg process เดียว
+        output_path = os.path.join(tmpdir, "output.mp4")
+        thumb_path = os.path.join(tmpdir, "thumb.webp")
+        try:
+            media.merge(video_path, req["pcm"], output_path, duration,
+                        sample_rate=req["sample_rate"], thumb_path=thumb_path)
+        except Exception as e:
+            return jsonify({"error": str(e)[:300]}), 500
+        if not (os.path.exists(thumb_path) and os.path.getsize(thumb_path) > 0):
+            thumb_path = None
+
+        meta = {
+            "success": True,
+            "duration": duration,
+            "video_duration": duration,
+            "video_size": os.path.getsize(output_path),
+        }
+        if thumb_path:
+            meta["thumb_size"] = os.path.getsize(thumb_path)
+
+        mode = req["response"]
+        if mode == "upload":
+            _put_file(req["video_put_url"], output_path, "video/mp4", req["upload_headers"])
+            meta["video_uploaded"] = True
+            if thumb_path and req.get("thumb_put_url"):
+                _put_file(req["thumb_put_url"], thumb_path, "image/webp", req["upload_headers"])
+                meta["thumb_uploaded"] = True
+            return jsonify(meta)
+
+        if mode == "multipart":
+            streaming = True
+            return _multipart_response(meta, [
+                ("video/mp4", "video.mp4", output_path),
+                ("image/webp", "thumb.webp", thumb_path),
+            ], cleanup_dir=tmpdir)
+
+        # Legacy: JSON + base64 encoded video/thumb
+        with open(output_path, "rb") as f:
+            meta["video_base64"] = base64.b64encode(f.read()).decode("ascii")
+        if thumb_path:
+            with open(thumb_path, "rb") as f:
+                meta["thumb_base64"] = base64.b64encode(f.read()).decode("ascii")
+        return jsonify(meta)
 
     except Exception as e:
         import traceback
         print(f"[MERGE] Error: {e}\n{traceback.format_exc()}")
         return jsonify({"error": str(e)}), 500
+    finally:
+        if not streaming:
+            import shutil
+            shutil.rmtree(tmpdir, ignore_errors=True)
 
 
-# ==================== XHS Video Resolver ====================
+def _parse_merge_request():
+    """อ่าน /merge request ทั้ง 3 รูปแบบ → dict เดียวกัน (raise ValueError ถ้าข้อมูลไม่ครบ)"""
+    ctype = (request.content_type or "").split(";")[0].strip().lower()
+    if ctype == "application/json":
+        data = request.get_json(silent=True)
+        if not data:
+            raise ValueError("JSON body required")
+        audio_base64 = data.get("audio_base64")
+        pcm = base64.b64decode(audio_base64) if audio_base64 else None
+        fields = data
+        default_mode = "json"
+    elif ctype == "multipart/form-data":
+        audio = request.files.get("audio")
+        pcm = audio.read() if audio else None
+        fields = request.form
+        default_mode = "multipart"
+    else:
+        pcm = request.get_data() or None
+        fields = request.args
+        default_mode = "multipart"
+
+    video_url = fields.get("video_url") or request.args.get("video_url")
+    if not video_url or not pcm:
+        raise ValueError("video_url and audio required")
+
+    mode = request.args.get("response") or fields.get("response") or default_mode
+    if mode not in ("json", "multipart", "upload"):
+        raise ValueError(f"unknown response mode: {mode}")
+
+    upload_headers = fields.get("upload_headers") or {}
+    if isinstance(upload_headers, str):
+        upload_headers = json.loads(upload_headers)
+    if mode == "upload" and not fields.get("video_put_url"):
+        raise ValueError("video_put_url required for response=upload")
+
+    return {
+        "video_url": video_url,
+        "pcm": pcm,
+        "sample_rate": int(fields.get("sample_rate") or request.args.get("sample_rate") or 24000),
+        "response": mode,
+        "video_put_url": fields.get("video_put_url"),
+        "thumb_put_url": fields.get("thumb_put_url"),
+        "upload_headers": upload_headers,
+    }
+
+
+def _put_file(url, path, content_type, headers=None):
+    """PUT ไฟล์ไปปลายทางที่ caller กำหนด (เช่น presigned URL / Worker r2-upload) แบบ stream"""
+    h = dict(headers or {})
+    h["content-type"] = content_type
+    with open(path, "rb") as f:
+        resp = http_clients.download.put(url, data=f, headers=h, timeout=120)
+    if resp.status_code not in (200, 201, 204):
+        raise Exception(f"Upload to destination failed: {resp.status_code} {resp.text[:200]}")
+
+
+def _multipart_response(meta, parts, cleanup_dir=None, chunk_size=256 * 1024):
+    """
+    Response แบบ multipart/mixed ที่ stream จาก disk ทีละ chunk
+    part แรกเป็น metadata JSON ตามด้วยไฟล์ (ข้าม part ที่ path เป็น None)
+    """
+    import uuid
+    boundary = f"merge-{uuid.uuid4().hex}"
+
+    def _head(content_type, filename=None, length=None):
+        h = f"--{boundary}\r\nContent-Type: {content_type}\r\n"
+        if filename:
+            h += f'Content-Disposition: attachment; filename="{filename}"\r\n'
+        if length is not None:
+            h += f"Content-Length: {length}\r\n"
+        return (h + "\r\n").encode()
+
+    def generate():
+        body = json.dumps(meta).encode()
+        yield _head("application/json", length=len(body)) + body + b"\r\n"
+        for content_type, filename, path in parts:
+            if not path:
+                continue
+            yield _head(content_type, filename, os.path.getsize(path))
+            with open(path, "rb") as f:
+                for chunk in iter(lambda: f.read(chunk_size), b""):
+                    yield chunk
+            yield b"\r\n"
+        yield f"--{boundary}--\r\n".encode()
+
+    resp = Response(generate(), mimetype=f"multipart/mixed; boundary={boundary}")
+    if cleanup_dir:
+        import shutil
+        # ลบ tmpdir หลังส่งครบ (หรือ client ตัดการเชื่อมต่อ)
+        resp.call_on_close(lambda: shutil.rmtree(cleanup_dir, ignore_errors=True))
+    return resp
 
-XHS_HEADERS = {
-    # Desktop UA เพื่อให้ได้ clean URL เหมือน Playwright
-    "User-Agent": "Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36",
-    "Accept": "text/html,application/xhtml+xml,application/xml;q=0.9,image/avif,image/webp,image/apng,*/*;q=0.8",
-    "Accept-Language": "zh-CN,zh;q=0.9,en;q=0.8",
-    "Cache-Control": "max-age=0",
-    "Sec-Ch-Ua": '"Not_A Brand";v="8", "Chromium";v="120", "Google Chrome";v="120"',
-    "Sec-Ch-Ua-Mobile": "?0",
-    "Sec-Ch-Ua-Platform": '"macOS"',
-}
 
+# ==================== XHS Video Resolver ====================
 
 @app.route("/xhs/resolve", methods=["POST"])
 def xhs_resolve():
@@ -199,45 +281,8 @@ def xhs_resolve():
         if not url:
             return jsonify({"error": "url required"}), 400
 
-        print(f"[XHS] Resolving: {url}")
-
-        # Follow redirects เพื่อได้ URL จริง
-        session = http_requests.Session()
-        resp = session.get(url, headers=XHS_HEADERS, allow_redirects=True, timeout=15)
-        final_url = resp.url
-        html = resp.text
-        print(f"[XHS] Final URL: {final_url}")
-
-        # หา video URL จาก HTML
-        video_url = None
-
-        # Pattern 1: masterUrl (H264 stream - usually clean)
-        # มองหา "masterUrl":"http..." ใน JSON
-        master_matches = re.finditer(r'"masterUrl"\s*:\s*"([^"]+)"', html)
-        for m in master_matches:
-            url_cand = m.group(1).replace("\\u002F", "/")
-            if "sns-video" in url_cand:
-                video_url = url_cand
-                print(f"[XHS] Found via masterUrl (Priority): {video_url}")
-                break
-
-        # Pattern 2: originVideoKey (Backup)
+        video_url = xhs.resolver.resolve(url)
         if not video_url:
-            json_match = re.search(r'"originVideoKey"\s*:\s*"([^"]+)"', html)
-            if json_match:
-                key = json_match.group(1)
-                video_url = f"https://sns-video-bd.xhscdn.com/{key}"
-                print(f"[XHS] Found via originVideoKey: {video_url}")
-
-        # Pattern 3: video src / url
-        if not video_url:
-            video_match = re.search(r'"url"\s*:\s*"(https?://sns-video[^"]+)"', html)
-            if video_match:
-                video_url = video_match.group(1).replace("\\u002F", "/")
-                print(f"[XHS] Found via url pattern: {video_url}")
-
-        if not video_url:
-            print(f"[XHS] No video found in HTML (length={len(html)})")
             return jsonify({"error": "ไม่พบวิดีโอใน XHS link นี้"}), 404
 
         return jsonify({"video_url": video_url})
@@ -248,61 +293,53 @@ def xhs_resolve():
         return jsonify({"error": str(e)}), 500
 
 
+XHS_BATCH_MAX = 50
+
+
+@app.route("/xhs/resolve/batch", methods=["POST"])
+def xhs_resolve_batch():
+    """
+    resolve หลาย XHS URL พร้อมกัน
+
+    Request JSON: {"urls": ["https://xhslink.com/...", ...]}
+    Response JSON: {"results": [{"url": ..., "video_url": ...} | {"url": ..., "error": ...}]}
+    """
+    data = request.get_json(silent=True) or {}
+    urls = data.get("urls")
+    if not isinstance(urls, list) or not urls or not all(isinstance(u, str) and u for u in urls):
+        return jsonify({"error": "urls required"}), 400
+    if len(urls) > XHS_BATCH_MAX:
+        return jsonify({"error": f"too many urls (max {XHS_BATCH_MAX})"}), 400
+    return jsonify({"results": xhs.resolver.resolve_many(urls)})
 
 
 # ==================== Full Pipeline (async background) ====================
 
 def send_telegram(token, method, payload):
-    url = f"https://api.telegram.org/bot{token}/{method}"
-    resp = http_requests.post(url, json=payload, timeout=30)
-    return resp.json()
+    """เรียก Bot API ผ่าน scheduler กลาง (budget ต่อ bot/chat + retry_after)"""
+    return tg_status.scheduler.call(token, method, payload)
 
 def edit_status(token, chat_id, msg_id, text):
     if not msg_id:
         return
-    send_telegram(token, "editMessageText", {
-        "chat_id": chat_id,
-        "message_id": msg_id,
-        "text": text,
-        "parse_mode": "HTML",
-    })
+    tg_status.scheduler.edit(token, chat_id, msg_id, text, parse_mode="HTML")
 
 class DotAnimator:
-    """Animate จุดท้ายข้อความ . → .. → ... วนเป็นรอบ ทุก 1.5 วินาที"""
+    """Animate จุดท้ายข้อความ . → .. → ... ผ่าน StatusScheduler ตัวเดียวของทั้ง container (ไม่มี thread ต่องาน)"""
     def __init__(self, token, chat_id, msg_id):
         self.token = token
         self.chat_id = chat_id
         self.msg_id = msg_id
-        self._base_text = ""
-        self._stop = threading.Event()
-        self._thread = None
 
     def start(self, base_text):
         """เริ่ม animate — base_text ควรลงท้ายด้วยข้อความ step ปัจจุบัน (ไม่ต้องใส่จุด)"""
         if not self.msg_id:
             return
-        self.stop()
-        self._base_text = base_text
-        self._stop.clear()
-        self._thread = threading.Thread(target=self._run, daemon=True)
-        self._thread.start()
-
-    def _run(self):
-        dots = [".", "..", "..."]
-        i = 0
-        while not self._stop.is_set():
-            text = self._base_text + dots[i % 3]
-            try:
-                edit_status(self.token, self.chat_id, self.msg_id, text)
-            except:
-                pass
-            i += 1
-            self._stop.wait(1.5)
+        tg_status.scheduler.animate(self.token, self.chat_id, self.msg_id, base_text)
 
     def stop(self):
-        if self._thread and self._thread.is_alive():
-            self._stop.set()
-            self._thread.join(timeout=3)
+        if self.msg_id:
+            tg_status.scheduler.stop(self.token, self.chat_id, self.msg_id)
 
 def run_pipeline_bg(payload):
     """รัน full pipeline ใน background thread — ไม่มี time limit"""
@@ -318,23 +355,24 @@ def run_pipeline_bg(payload):
     import uuid, time
     video_id = payload.get("video_id") or uuid.uuid4().hex[:8]
 
+    progress = progress_mod.ProgressWriter(
+        _load_processing_record(worker_url, token, video_id),
+        lambda record: _r2_put(worker_url, token, f"_processing/{video_id}.json",
+                               json.dumps(record).encode(), "application/json"))
+
     def _update_step(step, step_name):
-        """อัปเดตสถานะ step ใน R2 _processing queue"""
-        try:
-            url = f"{worker_url}/api/r2-proxy/_processing/{video_id}.json"
-            get_req = http_requests.get(url, headers={'x-auth-token': token}, timeout=10)
-            if get_req.status_code == 200:
-                data = get_req.json()
-            else:
-                data = {"id": video_id, "status": "processing", "createdAt": time.strftime("%Y-%m-%dT%H:%M:%SZ")}
-            data["step"] = step
-            data["stepName"] = step_name
-            data["updatedAt"] = time.strftime("%Y-%m-%dT%H:%M:%SZ")
-            _r2_put(worker_url, token, f"_processing/{video_id}.json", json.dumps(data).encode(), "application/json")
-        except Exception as e:
-            print(f"[PIPELINE] Step update error: {e}")
+        """อัปเดตสถานะ step ใน R2 _processing queue (ผ่าน ProgressWriter — ไม่บล็อก)"""
+        executor.set_stage(video_id, step, step_name)
+        prev = progress.get().get("step")
+        # ขึ้น stage ใหม่ → flush ทันที, ความคืบหน้าย่อยใน stage เดิม → รวมตาม interval
+        new_stage = prev is None or int(step) != int(prev)
+        progress.update(flush_now=new_stage, step=step, stepName=step_name)
 
     anim = DotAnimator(token, chat_id, msg_id)
+    workdir = tempfile.mkdtemp(prefix=f"job_{video_id}_")
+    clock = _StageClock(video_id)
+    gemini_files = []
+    cache = result_cache.for_job(result_cache.WorkerR2Tier(worker_url, token, http_clients.worker))
 
     try:
         # ── Step 1: ดาวน์โหลดวิดีโอ ──
@@ -342,117 +380,172 @@ def run_pipeline_bg(payload):
         anim.start("📥 กำลังดาวน์โหลดวิดีโอ")
 
         print(f"[PIPELINE] Downloading: {video_url[:80]}")
-        vr = http_requests.get(video_url, stream=True, timeout=120)
-        if vr.status_code != 200:
-            raise Exception(f"Download failed: {vr.status_code}")
-        
-        total_size = int(vr.headers.get('content-length', 0))
-        video_bytes = bytearray()
-        last_pct = 0
-        for chunk in vr.iter_content(chunk_size=1024*1024):
-            if chunk:
-                video_bytes.extend(chunk)
-                if total_size > 0:
-                    pct = len(video_bytes) / total_size
-                    # Only update every 10% or strictly to reduce R2 spam
-                    if pct - last_pct > 0.1 or pct == 1.0:
-                        _update_step(1.0 + (pct * 0.9), f"📥 กำลังดาวน์โหลดวิดีโอ... ({len(video_bytes)/1024/1024:.1f}MB)")
-                        last_pct = pct
-
-        video_bytes = bytes(video_bytes)
-        print(f"[PIPELINE] Downloaded: {len(video_bytes)/1024/1024:.1f} MB")
-
-        # อัพโหลด original ไป R2 ผ่าน Worker proxy
-        _r2_put(worker_url, token,
-                f"videos/{video_id}_original.mp4", video_bytes, "video/mp4")
+        # stream ลงไฟล์ในเครื่อง — merge ใช้ไฟล์นี้ตรงๆ ไม่ต้องดาวน์โหลดซ้ำจาก R2
+        source_path = os.path.join(workdir, "source.mp4")
+        last_pct = [0]
+
+        def on_download(received, total_size):
+            if total_size > 0:
+                pct = received / total_size
+                # Only update every 10% or strictly to reduce R2 spam
+                if pct - last_pct[0] > 0.1 or pct == 1.0:
+                    _update_step(1.0 + (pct * 0.9), f"📥 กำลังดาวน์โหลดวิดีโอ... ({received/1024/1024:.1f}MB)")
+                    last_pct[0] = pct
+
+        source = spool.download(video_url, source_path, timeout=120, on_progress=on_download,
+                                session=http_clients.download)
+        print(f"[PIPELINE] Downloaded: {source.size/1024/1024:.1f} MB (sha256={source.sha256[:12]})")
+
+        # อัพโหลด original ไป R2 ผ่าน Worker proxy — upload-only, รันคู่ขนานไม่ขวาง merge
+        original_upload = clock.background(
+            _r2_put_file, worker_url, token,
+            f"videos/{video_id}_original.mp4", source.path, "video/mp4")
 
         # ── Step 2: Gemini upload + analyze ──
         _update_step(2, "🔍 อัปโหลดวิดีโอไป Gemini...")
         anim.start("📥 ดาวน์โหลดวิดีโอ ✅\n🔍 กำลังวิเคราะห์วิดีโอ")
 
-        gemini_uri = _gemini_upload(video_bytes, api_key)
-        _update_step(2.3, "🔍 รอ Gemini ประมวลผลวิดีโอ...")
-        gemini_uri = _gemini_wait(gemini_uri, api_key)
-
-        import tempfile
-        import os
-        with tempfile.NamedTemporaryFile(suffix=".mp4", delete=False) as tf:
-            tf.write(video_bytes)
-            tmp_video_path = tf.name
-            
-        try:
-            probe = subprocess.run([
-                "ffprobe", "-v", "error", "-show_entries", "format=duration",
-                "-of", "default=noprint_wrappers=1:nokey=1", tmp_video_path
-            ], capture_output=True, text=True)
-            duration = float(probe.stdout.strip()) if probe.stdout.strip() else 15.0
-        except Exception as e:
-            print(f"[PIPELINE] Error getting duration: {e}")
+        # วิดีโอเดิม + model + prompt เดิม → ใช้ script เดิมได้เลย ไม่ต้องอัปโหลดไป Gemini
+        # (hash ตัว template ของ prompt — ความยาววิดีโอผูกกับ sha256 ของ source อยู่แล้ว)
+        # Gemini ดูแค่ว่าสินค้าหน้าตาเป็นยังไง → ส่งวิดีโอย่อ (analysis proxy) แทนต้นฉบับ
+        # หรือ storyboard mode: ส่งเฟรมตัวแทน inline ไม่ต้องอัปโหลด/รอ ACTIVE เลย
+        analysis_mode = payload.get("analysis_mode") or ANALYSIS_MODE
+        proxy_profile = media.analysis_profile(payload.get("analysis_proxy"))
+        proxy_name = proxy_profile["name"] if proxy_profile else "original"
+        analysis_name = f"storyboard:{STORYBOARD_FRAMES}" if analysis_mode == "storyboard" else proxy_name
+        script_key = result_cache.key(source.sha256, model, result_cache.sha256(_script_prompt(0.0)), analysis_name)
+        cached_script = cache.get_text("script", script_key)
+
+        def gemini_ingest():
+            # resumable upload + ใช้ไฟล์เดิมถ้าวิดีโอนี้เพิ่งอัปโหลดไป (retry / ส่งซ้ำ)
+            content_key = source.sha256 if not proxy_profile else result_cache.key(source.sha256, proxy_name)
+            gfile = gemini.files.lookup(api_key, content_key)
+            if gfile is None:
+                upload_path = source.path
+                if proxy_profile:
+                    try:
+                        t0 = time.time()
+                        upload_path = media.make_analysis_proxy(
+                            source.path, os.path.join(workdir, "analysis.mp4"), proxy_profile)
+                        print(f"[PIPELINE] Analysis proxy {proxy_name}: {source.size/1024/1024:.1f} MB → "
+                              f"{os.path.getsize(upload_path)/1024/1024:.2f} MB ({time.time() - t0:.1f}s)")
+                    except Exception as e:
+                        # ย่อไม่ได้ → ส่งต้นฉบับแทน (ช้ากว่าแต่งานไม่ล้ม)
+                        print(f"[PIPELINE] Analysis proxy error, uploading original: {e}")
+                        upload_path, content_key = source.path, source.sha256
+                gfile = gemini.files.upload(api_key, upload_path, sha256=content_key)
+            gemini_files.append(gfile)
+            _update_step(2.3, "🔍 รอ Gemini ประมวลผลวิดีโอ...")
+            return gemini.video_parts(_gemini_wait(gfile))
+
+        def storyboard_ingest():
+            frames_dir = os.path.join(workdir, "storyboard")
+            os.makedirs(frames_dir, exist_ok=True)
+            video_duration = media.probe(source_path)[0] or 15.0
+            try:
+                frames = media.extract_storyboard(source_path, frames_dir, n=STORYBOARD_FRAMES,
+                                                  duration=video_duration)
+            except Exception as e:
+                print(f"[PIPELINE] Storyboard error: {e}")
+                frames = []
+            if not frames:
+                # ดึงเฟรมไม่ได้ → กลับไปใช้ Files API
+                return gemini_ingest()
+            kb = sum(len(jpeg) for _t, jpeg in frames) / 1024
+            print(f"[PIPELINE] Storyboard: {len(frames)} frames, {kb:.0f} KB inline")
+            return gemini.storyboard_parts(frames, video_duration)
+
+        # ffprobe ไม่ต้องรอ Gemini — รันพร้อมกัน
+        analyze = {"probe": (media.probe, source_path)}
+        if cached_script is None:
+            analyze["gemini"] = (storyboard_ingest if analysis_mode == "storyboard" else gemini_ingest,)
+        ingest = clock.parallel("analyze", analyze)
+        duration, _vw, _vh = ingest["probe"]
+        if duration is None:
+            print("[PIPELINE] Error getting duration, using 15s")
             duration = 15.0
-        finally:
-            os.remove(tmp_video_path)
 
         _update_step(2.7, "🔍 สร้างบทพากย์จาก AI...")
-        script, title, category = _gemini_script(gemini_uri, api_key, model, duration)
+        if cached_script is not None:
+            cached = json.loads(cached_script)
+            script, title, category = cached["script"], cached["title"], cached["category"]
+            print(f"[CACHE] Script hit ({script_key[:12]})")
+        else:
+            script, title, category = _gemini_script(ingest["gemini"], api_key, model, duration)
+            cache.put_bytes("script", script_key, json.dumps(
+                {"script": script, "title": title, "category": category}, ensure_ascii=False))
         print(f"[PIPELINE] Script ({len(script)} chars): {script[:60]}")
 
         # ── Step 3: TTS ──
         _update_step(3, "🎙 กำลังสร้างเสียงพากย์ไทย...")
         anim.start("📥 ดาวน์โหลดวิดีโอ ✅\n🔍 วิเคราะห์วิดีโอ ✅\n🎙 กำลังสร้างเสียงพากย์")
 
-        audio_b64 = _gemini_tts(script, api_key)
-        _update_step(3.5, "🎙 ได้เสียงพากย์แล้ว กำลังเตรียมรวม...")
-        print(f"[PIPELINE] TTS: {len(audio_b64)//1024} KB base64")
+        # "subtitles": false → ไม่ต้องรอเสียงครบก่อนแกะซับ ใช้ streaming TTS ต่อเข้า ffmpeg ได้เลย (TTS_STREAM, เปิดอยู่)
+        # งานที่มีซับ (ค่า default ของ Worker) ยังสังเคราะห์ครบก่อน — align/Whisper ต้องใช้ PCM ทั้งก้อน
+        subtitles = payload.get("subtitles", True) is not False
+        tts_key = result_cache.key(result_cache.sha256(script), tts.cache_tag())
+        pcm = cache.get_bytes("tts", tts_key)
+        cached_segments = cache.get_text("tts_segments", tts_key) if pcm is not None else None
+        stream_tts = cached_segments is None and not subtitles and tts.TTS_STREAM
+        if stream_tts:
+            segments = []
+        elif cached_segments is None:
+            # แบ่งเป็นประโยคแล้วสังเคราะห์พร้อมกัน — รอแค่ท่อนที่ช้าที่สุด
+            pcm, segments = tts.synthesize(script, api_key)
+            cache.put_bytes("tts", tts_key, pcm)
+            cache.put_bytes("tts_segments", tts_key, json.dumps(segments, ensure_ascii=False))
+        else:
+            segments = [tts.Segment(*seg) for seg in json.loads(cached_segments)]
+            print(f"[CACHE] TTS hit ({tts_key[:12]})")
+        if not stream_tts:
+            _update_step(3.5, "🎙 ได้เสียงพากย์แล้ว กำลังเตรียมรวม...")
+            print(f"[PIPELINE] TTS: {len(pcm)//1024} KB PCM, {len(segments)} segments")
 
         # ── Step 4: FFmpeg merge ──
         _update_step(4, "🎬 กำลังรวมเสียง+วิดีโอ...")
         anim.start("📥 ดาวน์โหลดวิดีโอ ✅\n🔍 วิเคราะห์วิดีโอ ✅\n🎙 สร้างเสียงพากย์ ✅\n🎬 กำลังรวมวิดีโอ")
 
-        original_url = f"{r2_public_url}/videos/{video_id}_original.mp4"
-
         def update_progress(text, step_num=None):
-            try:
-                import datetime
-                url_get = f"{worker_url}/api/r2-proxy/_processing/{video_id}.json"
-                req = http_requests.get(url_get, headers={'x-auth-token': token}, timeout=5)
-                if req.status_code == 200:
-                    data = req.json()
-                    data["stepName"] = text
-                    if step_num:
-                        data["step"] = step_num
-                    data["updatedAt"] = datetime.datetime.utcnow().isoformat() + "Z"
-                    _r2_put(worker_url, token, f"_processing/{video_id}.json", json.dumps(data).encode(), "application/json")
-            except:
-                pass
-
-        merged_bytes, thumb_bytes, duration = _ffmpeg_merge(original_url, audio_b64, script, api_key, progress_cb=update_progress)
-        print(f"[PIPELINE] Merged: {len(merged_bytes)/1024/1024:.1f} MB, {duration:.1f}s")
-
-        # ── Step 5: อัพโหลด ──
+            if step_num:
+                _update_step(step_num, text)
+            else:
+                progress.update(stepName=text)
+
+        if stream_tts:
+            merged_path, thumb_path, duration, pcm = _stream_merge(source_path, script, api_key,
+                                                                   progress_cb=update_progress, out_dir=workdir)
+            cache.put_bytes("tts", tts_key, pcm)
+            cache.put_bytes("tts_segments", tts_key, json.dumps(
+                [tts.Segment(0.0, len(pcm) / 2 / tts.SAMPLE_RATE, script)], ensure_ascii=False))
+        else:
+            merged_path, thumb_path, duration = _ffmpeg_merge(source_path, pcm, script if subtitles else None,
+                                                              progress_cb=update_progress, out_dir=workdir,
+                                                              cache=cache, source_sha256=source.sha256,
+                                                              segments=segments)
+        print(f"[PIPELINE] Merged: {os.path.getsize(merged_path)/1024/1024:.1f} MB, {duration:.1f}s")
+
+        # ── Step 5: อัพโหลด + เช็คลิงก์ Shopee ที่รออยู่ (พร้อมกัน) ──
         _update_step(5, "📤 อัพโหลดผลลัพธ์")
 
-        _r2_put(worker_url, token,
-                f"videos/{video_id}.mp4", merged_bytes, "video/mp4")
         public_url = f"{r2_public_url}/videos/{video_id}.mp4"
-
-        thumb_url = ""
-        if thumb_bytes:
-            _r2_put(worker_url, token,
-                    f"videos/{video_id}_thumb.webp", thumb_bytes, "image/webp")
-            thumb_url = f"{r2_public_url}/videos/{video_id}_thumb.webp"
-
-        # ── Step 6: เช็คลิงก์ Shopee ที่รออยู่ และบันทึก metadata ──
+        thumb_url = f"{r2_public_url}/videos/{video_id}_thumb.webp" if thumb_path else ""
+        uploads = {
+            "video": (_r2_put_file, worker_url, token, f"videos/{video_id}.mp4", merged_path, "video/mp4"),
+            "shopee": (_take_waiting_shopee, worker_url, token, chat_id),
+        }
+        if thumb_path:
+            uploads["thumb"] = (_r2_put_file, worker_url, token,
+                                f"videos/{video_id}_thumb.webp", thumb_path, "image/webp")
+        uploaded = clock.parallel("upload", uploads)
+        shopee_link_data = uploaded["shopee"]
+
+        _, err = clock.join("original_upload", original_upload)
+        if err:
+            # original เป็นแค่สำเนาเก็บไว้ — ไม่ทำให้งานที่ merge เสร็จแล้วล้ม
+            print(f"[PIPELINE] Original upload error: {err}")
+
+        # ── Step 6: บันทึก metadata ──
         import datetime
-        shopee_link_data = None
-        try:
-            get_req = http_requests.get(f"{worker_url}/api/r2-proxy/_waiting_shopee/{chat_id}.json", headers={'x-auth-token': token}, timeout=15)
-            if get_req.status_code == 200:
-                shopee_link_data = get_req.json().get("shopeeLink")
-                # ลบทิ้งทันทีหลังใช้
-                http_requests.delete(f"{worker_url}/api/r2-proxy/_waiting_shopee/{chat_id}.json", headers={'x-auth-token': token}, timeout=15)
-        except Exception as e:
-            print(f"[PIPELINE] Error fetching waiting shopee: {e}")
-
         metadata = {
             "id": video_id, "script": script, "title": title,
             "category": category, "duration": duration,
@@ -464,49 +557,45 @@ def run_pipeline_bg(payload):
         if shopee_link_data:
             metadata["shopeeLink"] = shopee_link_data
 
-        _r2_put(worker_url, token,
-                f"videos/{video_id}.json",
-                json.dumps(metadata, ensure_ascii=False).encode(), "application/json")
-
         pending = {"videoId": video_id, "publicUrl": public_url, "msgId": msg_id}
-        _r2_put(worker_url, token,
-                f"_pending_shopee/{chat_id}.json",
-                json.dumps(pending).encode(), "application/json")
-
-        # ── Step 7: เสร็จ! ──
         anim.stop()
-        edit_status(token, chat_id, msg_id,
-            "📥 รับวิดีโอ ✅\n🔍 วิเคราะห์วิดีโอ ✅\n🎙 สร้างเสียงพากย์ ✅\n🎬 รวมวิดีโอ ✅")
-
-
-
-
-        send_telegram(token, "sendMessage", {
-            "chat_id": chat_id,
-            "text": "✅ สร้างวิดีโอสำเร็จ! ดูได้ที่คลังวิดีโอ",
-            "reply_markup": {
-                "inline_keyboard": [[
-                    {"text": "🎥 เปิดคลังวิดีโอ", "web_app": {"url": "https://dubbing-chearb-webapp.pages.dev?tab=gallery"}}
-                ]]
-            }
+        clock.parallel("publish", {
+            "metadata": (_r2_put, worker_url, token, f"videos/{video_id}.json",
+                         json.dumps(metadata, ensure_ascii=False).encode(), "application/json"),
+            "pending_shopee": (_r2_put, worker_url, token, f"_pending_shopee/{chat_id}.json",
+                               json.dumps(pending).encode(), "application/json"),
+            "status": (edit_status, token, chat_id, msg_id,
+                       "📥 รับวิดีโอ ✅\n🔍 วิเคราะห์วิดีโอ ✅\n🎙 สร้างเสียงพากย์ ✅\n🎬 รวมวิดีโอ ✅"),
         })
 
-        # ลบ queue _processing
-        try:
-            http_requests.delete(f"{worker_url}/api/r2-proxy/_processing/{video_id}.json", headers={'x-auth-token': token}, timeout=15)
-        except Exception as e:
-            print(f"[PIPELINE] Error deleting processing state: {e}")
-
-        # อัปเดต Gallery cache เพื่อให้วิดีโอใหม่โผล่ทันที
-        try:
-            http_requests.post(f"{worker_url}/api/gallery/refresh/{video_id}", headers={'x-auth-token': token}, timeout=15)
-            print(f"[PIPELINE] Gallery cache refreshed for {video_id}")
-        except Exception as e:
-            print(f"[PIPELINE] Gallery refresh error: {e}")
+        # ── Step 7: เสร็จ! แจ้งผู้ใช้ + ลบ queue _processing + อัปเดต Gallery cache ──
+        # record จะถูกลบ — หยุด writer ก่อน กัน PUT ที่ค้างอยู่สร้างไฟล์กลับมา
+        progress.close(flush=False)
+        print(f"[PIPELINE] Progress: {progress.updates} updates → {progress.flushes} writes")
+        clock.parallel("finish", {
+            "notify": (send_telegram, token, "sendMessage", {
+                "chat_id": chat_id,
+                "text": "✅ สร้างวิดีโอสำเร็จ! ดูได้ที่คลังวิดีโอ",
+                "reply_markup": {
+                    "inline_keyboard": [[
+                        {"text": "🎥 เปิดคลังวิดีโอ", "web_app": {"url": "https://dubbing-chearb-webapp.pages.dev?tab=gallery"}}
+                    ]]
+                }
+            }),
+            "processing": (_delete_processing, worker_url, token, video_id),
+            "gallery": (_refresh_gallery, worker_url, token, video_id),
+        })
 
+        executor.set_timings(video_id, clock.stages)
+        executor.annotate(video_id, cache=cache.report)
+        print(f"[PIPELINE] Cache hits: {cache.summary() or '-'}")
+        print(f"[PIPELINE] Overlap saved {clock.saved():.1f}s in total")
         print(f"[PIPELINE] Done! videoId={video_id}")
 
     except Exception as e:
+        executor.mark_failed(video_id, e)
+        executor.set_timings(video_id, clock.stages)
+        executor.annotate(video_id, cache=cache.report)
         if anim:
             anim.stop()
         import traceback
@@ -524,29 +613,83 @@ def run_pipeline_bg(payload):
             })
 
         # อัปเดตสถานะเป็น failed ในคิวแทนการลบ
-        try:
-            url = f"{worker_url}/api/r2-proxy/_processing/{video_id}.json"
-            get_req = http_requests.get(url, headers={'x-auth-token': token}, timeout=15)
-            if get_req.status_code == 200:
-                data = get_req.json()
-                data["status"] = "failed"
-                data["error"] = str(e)[:200]
-                _r2_put(worker_url, token, f"_processing/{video_id}.json", json.dumps(data).encode(), "application/json")
-        except Exception as e2:
-            print(f"[PIPELINE] Error updating failed status: {e2}")
+        progress.update(flush_now=True, status="failed", error=str(e)[:200])
+        progress.close()
 
         # ไม่ว่าจะ fail ก็ให้เช็คคิวถัดไป
         try:
-            http_requests.post(f"{worker_url}/api/queue/next", headers={'x-auth-token': token}, timeout=15)
+            http_clients.worker.post(f"{worker_url}/api/queue/next", headers={'x-auth-token': token}, timeout=15)
         except Exception as e3:
             print(f"[PIPELINE] Queue next error: {e3}")
 
+    finally:
+        # ไม่ใช้ไฟล์บน Gemini แล้ว — ลบเมื่อพ้น grace period (retry ภายในช่วงนั้นใช้ไฟล์เดิม)
+        for gfile in gemini_files:
+            gemini.files.release(gfile)
+        import shutil
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+# Thread pool สำหรับ I/O ที่ไม่ขึ้นต่อกันใน pipeline (upload / metadata / Telegram)
+_io_pool = ThreadPoolExecutor(max_workers=int(os.environ.get("PIPELINE_IO_THREADS", "16")),
+                              thread_name_prefix="pipeline-io")
+
+
+def _timed(fn, *args):
+    t0 = time.time()
+    try:
+        return fn(*args), None, time.time() - t0
+    except Exception as e:
+        return None, e, time.time() - t0
+
+
+class _StageClock:
+    """วัดเวลาแต่ละ stage และเวลาที่ประหยัดได้จากการรันคู่ขนาน (รวมเวลางานย่อย − wall time)"""
+    def __init__(self, video_id):
+        self.video_id = video_id
+        self.stages = []
+
+    def background(self, fn, *args):
+        """เริ่มงานที่ไม่มีใครรอผลทันที — join() ทีหลัง"""
+        return _io_pool.submit(_timed, fn, *args)
+
+    def join(self, stage, future):
+        """รอ background task → (result, error); ส่วนที่รันซ้อนกับงานอื่นนับเป็นเวลาที่ประหยัด"""
+        t0 = time.time()
+        result, err, spent = future.result()
+        self._record(stage, time.time() - t0, spent)
+        return result, err
+
+    def parallel(self, stage, tasks):
+        """รัน tasks (name → (fn, *args)) พร้อมกัน → dict name → result; raise error แรกหลังทุกงานจบ"""
+        t0 = time.time()
+        futures = {name: _io_pool.submit(_timed, *task) for name, task in tasks.items()}
+        results, first_err, serial = {}, None, 0.0
+        for name, f in futures.items():
+            result, err, spent = f.result()
+            serial += spent
+            results[name] = result
+            if err is not None and first_err is None:
+                first_err = err
+        self._record(stage, time.time() - t0, serial)
+        if first_err is not None:
+            raise first_err
+        return results
+
+    def _record(self, stage, wall, serial):
+        saved = max(0.0, serial - wall)
+        self.stages.append({"stage": stage, "wall": round(wall, 2),
+                            "serial": round(serial, 2), "saved": round(saved, 2)})
+        print(f"[PIPELINE] Stage {stage}: {wall:.1f}s (serial {serial:.1f}s, saved {saved:.1f}s)")
+
+    def saved(self):
+        return sum(st["saved"] for st in self.stages)
 
 
 def _r2_put(worker_url, token, key, data, content_type):
     """อัพโหลดไฟล์ไป R2 ผ่าน Worker /api/r2-upload proxy"""
     url = f"{worker_url}/api/r2-upload/{key}"
-    resp = http_requests.put(url, data=data, headers={
+    resp = http_clients.worker.put(url, data=data, headers={
         "x-auth-token": token,
         "content-type": content_type,
     }, timeout=120)
@@ -554,35 +697,62 @@ def _r2_put(worker_url, token, key, data, content_type):
         raise Exception(f"R2 upload failed: {resp.status_code} {resp.text[:200]}")
 
 
-def _gemini_upload(video_bytes, api_key):
-    """Upload video ไป Gemini Files API"""
-    resp = http_requests.post(
-        f"https://generativelanguage.googleapis.com/upload/v1beta/files?uploadType=media&key={api_key}",
-        data=video_bytes,
-        headers={"Content-Type": "video/mp4", "X-Goog-Upload-Protocol": "raw"},
-        timeout=120,
-    )
-    data = resp.json()
-    return data["file"]["uri"]
+def _load_processing_record(worker_url, token, video_id):
+    """อ่าน _processing/{id}.json ที่ Worker สร้างไว้ครั้งเดียวตอนเริ่มงาน (เก็บ createdAt, retryCount ฯลฯ)"""
+    try:
+        url = f"{worker_url}/api/r2-proxy/_processing/{video_id}.json"
+        get_req = http_clients.worker.get(url, headers={'x-auth-token': token}, timeout=10)
+        if get_req.status_code == 200:
+            return get_req.json()
+    except Exception as e:
+        print(f"[PIPELINE] Processing record load error: {e}")
+    return {"id": video_id, "status": "processing", "createdAt": time.strftime("%Y-%m-%dT%H:%M:%SZ")}
+
+
+def _take_waiting_shopee(worker_url, token, chat_id):
+    """ดึงลิงก์ Shopee ที่ผู้ใช้ส่งมารอไว้ แล้วลบทิ้งทันทีหลังใช้ — error ไม่ทำให้งานล้ม"""
+    try:
+        get_req = http_clients.worker.get(f"{worker_url}/api/r2-proxy/_waiting_shopee/{chat_id}.json", headers={'x-auth-token': token}, timeout=15)
+        if get_req.status_code == 200:
+            link = get_req.json().get("shopeeLink")
+            http_clients.worker.delete(f"{worker_url}/api/r2-proxy/_waiting_shopee/{chat_id}.json", headers={'x-auth-token': token}, timeout=15)
+            return link
+    except Exception as e:
+        print(f"[PIPELINE] Error fetching waiting shopee: {e}")
+    return None
+
+
+def _delete_processing(worker_url, token, video_id):
+    """ลบ queue _processing"""
+    try:
+        http_clients.worker.delete(f"{worker_url}/api/r2-proxy/_processing/{video_id}.json", headers={'x-auth-token': token}, timeout=15)
+    except Exception as e:
+        print(f"[PIPELINE] Error deleting processing state: {e}")
+
+
+def _refresh_gallery(worker_url, token, video_id):
+    """อัปเดต Gallery cache เพื่อให้วิดีโอใหม่โผล่ทันที"""
+    try:
+        http_clients.worker.post(f"{worker_url}/api/gallery/refresh/{video_id}", headers={'x-auth-token': token}, timeout=15)
+        print(f"[PIPELINE] Gallery cache refreshed for {video_id}")
+    except Exception as e:
+        print(f"[PIPELINE] Gallery refresh error: {e}")
+
+
+def _r2_put_file(worker_url, token, key, path, content_type):
+    """อัพโหลดไฟล์ไป R2 แบบ stream จาก disk (ไม่โหลดทั้งไฟล์เข้า memory)"""
+    with open(path, "rb") as f:
+        _r2_put(worker_url, token, key, f, content_type)
 
 
-def _gemini_wait(file_uri, api_key, max_wait=120):
+def _gemini_wait(gfile, max_wait=120):
     """รอให้ Gemini ประมวลผลวิดีโอเสร็จ"""
-    import time
-    file_name = file_uri.split("/files/")[-1]
-    for _ in range(max_wait // 5):
-        r = http_requests.get(
-            f"https://generativelanguage.googleapis.com/v1beta/files/{file_name}?key={api_key}",
-            timeout=15
-        ).json()
-        if r.get("state") == "ACTIVE":
-            return file_uri
-        time.sleep(5)
-    return file_uri
-
-
-def _gemini_script(file_uri, api_key, model, video_duration=15.0):
-    """สร้าง script ภาษาไทยจากวิดีโอ — ปรับความยาว script ตามความยาววิดีโอ"""
+    gemini.files.wait(gfile, max_wait=max_wait)
+    return gfile.uri
+
+
+def _script_prompt(video_duration):
+    """prompt สร้าง script — ปรับความยาว script ตามความยาววิดีโอ"""
     # คำนวณความยาว script ที่เหมาะสม (~10 ตัวอักษร/วินาที สำหรับภาษาไทย TTS)
     max_chars = min(int(video_duration * 10), 800)
     min_chars = max(int(video_duration * 7), 80)
@@ -610,39 +780,26 @@ def _gemini_script(file_uri, api_key, model, video_duration=15.0):
   "title": "แคปชั่นสั้นแซ่บๆ ดึงดูดคนกด",
   "category": "หมวดหมู่ (เครื่องมือช่าง/อาหาร/เครื่องครัว/ของใช้ในบ้าน/เฟอร์นิเจอร์/บิวตี้/แฟชั่น/อิเล็กทรอนิกส์/สุขภาพ/กีฬา/สัตว์เลี้ยง/ยานยนต์/อื่นๆ)"
 }}"""
+    return prompt
 
-    import time
-    for attempt in range(5):
-        try:
-            resp = http_requests.post(
-                f"https://generativelanguage.googleapis.com/v1beta/models/{model}:generateContent?key={api_key}",
-                json={"contents": [{"parts": [
-                    {"file_data": {"mime_type": "video/mp4", "file_uri": file_uri}},
-                    {"text": prompt}
-                ]}]},
-                timeout=60,
-            ).json()
-
-            if resp.get("error"):
-                err_msg = resp['error'].get('message', '')
-                if "high demand" in err_msg.lower() or "503" in str(err_msg):
-                    print(f"[PIPELINE] Gemini high demand, retrying... ({attempt+1}/5)")
-                    time.sleep(5)
-                    if attempt >= 2 and model == "gemini-3-flash-preview":
-                        model = "gemini-2.0-flash"
-                        print(f"[PIPELINE] Fallback to {model}")
-                    continue
-                raise Exception(f"Gemini error: {err_msg}")
-            break
-        except Exception as e:
-            if attempt < 4 and "Gemini error" not in str(e):
-                time.sleep(5)
-                continue
-            raise
 
-    text = resp.get("candidates", [{}])[0].get("content", {}).get("parts", [{}])[0].get("text", "")
+# วิธีให้ Gemini ดูวิดีโอ: "file" = อัปโหลด Files API (analysis proxy), "storyboard" = เฟรม inline
+# เลือกต่องานได้ด้วย payload["analysis_mode"]
+ANALYSIS_MODE = os.environ.get("ANALYSIS_MODE", "file")
+STORYBOARD_FRAMES = int(os.environ.get("STORYBOARD_FRAMES", "8"))
+
+
+def _gemini_script(video_parts, api_key, model, video_duration=15.0):
+    """สร้าง script ภาษาไทยจากวิดีโอ (gemini.video_parts หรือ gemini.storyboard_parts) — ปรับความยาวตามความยาววิดีโอ"""
+    prompt = _script_prompt(video_duration)
+
+    data, used_model = gemini.client.generate(
+        model, {"contents": [{"parts": video_parts + [{"text": prompt}]}]}, api_key,
+        timeout=60, purpose="script", validate=gemini.require_text, hedge=True)
+
+    text = gemini.response_text(data)
     text = text.replace("```json", "").replace("```", "").strip()
-    print(f"[PIPELINE] Gemini raw: {text[:100]}")
+    print(f"[PIPELINE] Gemini raw ({used_model}): {text[:100]}")
 
     try:
         parsed = json.loads(text)
@@ -654,259 +811,184 @@ def _gemini_script(file_uri, api_key, model, video_duration=15.0):
         return (m.group(1) if m else text[:200]), (t.group(1) if t else ""), (c.group(1) if c else "อื่นๆ")
 
 
-def _gemini_tts(script, api_key):
-    """สร้างเสียงพากย์จาก script"""
-    import time
-    for attempt in range(5):
-        try:
-            resp = http_requests.post(
-                f"https://generativelanguage.googleapis.com/v1beta/models/gemini-2.5-flash-preview-tts:generateContent?key={api_key}",
-                json={
-                    "contents": [{"parts": [{"text": script}]}],
-                    "generationConfig": {
-                        "responseModalities": ["AUDIO"],
-                        "speechConfig": {"voiceConfig": {"prebuiltVoiceConfig": {"voiceName": "Puck"}}}
-                    }
-                },
-                timeout=60,
-            ).json()
-
-            if resp.get("error"):
-                err_msg = resp['error'].get('message', '')
-                if "high demand" in err_msg.lower() or "503" in str(err_msg):
-                    print(f"[PIPELINE] TTS high demand, retrying... ({attempt+1}/5)")
-                    time.sleep(5)
-                    continue
-                raise Exception(f"TTS error: {err_msg}")
-            
-            return resp["candidates"][0]["content"]["parts"][0]["inlineData"]["data"]
-        except Exception as e:
-            if attempt < 4 and "TTS error" not in str(e):
-                time.sleep(5)
-                continue
-            raise
-
-    return resp["candidates"][0]["content"]["parts"][0]["inlineData"]["data"]
+# วิธีหาเวลาซับ: "align" = forced alignment ของ script กับเสียง TTS (align.py, ไม่ต้องถอดเสียง)
+#               "whisper" = เวลาของคำจาก Whisper
+# ทั้งสองแบบจัด block ด้วย thaiseg (ตัดคำไทย ข้อความตรง script) — ไม่ต้องส่งให้ Gemini แก้
+# align ยังเป็น opt-in: วัดไว้แค่กับเสียงสังเคราะห์ (scripts/fixtures/align) ยังไม่ได้เทียบกับ Whisper บนเสียง TTS จริง
+SUBTITLE_ENGINE = os.environ.get("SUBTITLE_ENGINE", "whisper")
 
 
-def _ffmpeg_merge(video_url, audio_b64, script=None, api_key=None, progress_cb=None):
-    """FFmpeg merge — เหมือน /merge endpoint เดิม แต่มีการใส่ซับด้วย Whisper + Gemini + MoviePy"""
+def _ffmpeg_merge(video_src, pcm, script=None, progress_cb=None, out_dir=None,
+                  cache=None, source_sha256=None, segments=None):
+    """
+    FFmpeg merge — ใส่ซับ (forced alignment หรือ Whisper ตาม SUBTITLE_ENGINE, จัด block ด้วย thaiseg)
+    แล้วรวมทุกอย่างใน ffmpeg process เดียว (media.merge)
+
+    video_src: path ของไฟล์ในเครื่อง (pipeline) หรือ URL ให้ดาวน์โหลด
+    pcm: เสียงพากย์ s16le mono 24kHz
+    out_dir: โฟลเดอร์ที่เขียน output.mp4 / thumb.webp (caller ลบเอง)
+    cache: result_cache.JobCache (optional) — cache ซับ (srt) และ MP4 สุดท้าย (ถ้าเปิด RESULT_CACHE_MP4)
+    segments: [tts.Segment] — จุดยึดของ align / timing หยาบใช้แทนเมื่อ Whisper ใช้ไม่ได้
+    return (output_path, thumb_path หรือ None, duration)
+    """
+    out_dir = out_dir or tempfile.mkdtemp(prefix="merge_")
     with tempfile.TemporaryDirectory() as tmpdir:
-        vr = http_requests.get(video_url, timeout=120)
-        video_path = os.path.join(tmpdir, "video.mp4")
-        with open(video_path, "wb") as f:
-            f.write(vr.content)
-
-        probe = subprocess.run([
-            "ffprobe", "-v", "error", "-show_entries", "format=duration",
-            "-of", "default=noprint_wrappers=1:nokey=1", video_path
-        ], capture_output=True, text=True)
-        duration = float(probe.stdout.strip()) if probe.stdout.strip() else 15.0
-
-        raw_audio = os.path.join(tmpdir, "audio.raw")
-        wav_audio = os.path.join(tmpdir, "audio.wav")
-        with open(raw_audio, "wb") as f:
-            f.write(base64.b64decode(audio_b64))
-        subprocess.run(["ffmpeg", "-y", "-f", "s16le", "-ar", "24000", "-ac", "1",
-                        "-i", raw_audio, wav_audio], check=True, capture_output=True)
-
-        ap = subprocess.run([
-            "ffprobe", "-v", "error", "-show_entries", "format=duration",
-            "-of", "default=noprint_wrappers=1:nokey=1", wav_audio
-        ], capture_output=True, text=True)
-        audio_dur = float(ap.stdout.strip()) if ap.stdout.strip() else 0
-
-        adjusted = os.path.join(tmpdir, "audio_adj.wav")
-        diff = duration - audio_dur
-        if abs(diff) < 0.5:
-            adjusted = wav_audio
-        elif diff > 0:
-            subprocess.run(["ffmpeg", "-y", "-i", wav_audio, "-af", f"apad=pad_dur={diff}", adjusted], capture_output=True)
+        if os.path.isfile(video_src):
+            video_path = video_src
         else:
-            subprocess.run(["ffmpeg", "-y", "-i", wav_audio, "-t", str(duration), adjusted], capture_output=True)
-
-        merged_nosub = os.path.join(tmpdir, "merged_nosub.mp4")
-        mr = subprocess.run([
-            "ffmpeg", "-y", "-i", video_path, "-i", adjusted,
-            "-c:v", "copy", "-c:a", "aac",
-            "-map", "0:v:0", "-map", "1:a:0", "-t", str(duration), merged_nosub
-        ], capture_output=True, text=True)
-        if mr.returncode != 0:
-            raise Exception(f"FFmpeg failed: {mr.stderr[:300]}")
-            
-        output_path = os.path.join(tmpdir, "output.mp4")
-        
-        if script and api_key:
+            video_path = os.path.join(tmpdir, "video.mp4")
+            spool.download(video_src, video_path, timeout=120, session=http_clients.download)
+
+        duration, vw, vh = media.probe(video_path)
+        if duration is None:
+            duration = 15.0
+
+        pcm_sha256 = result_cache.sha256(pcm)
+        output_path = os.path.join(out_dir, "output.mp4")
+        thumb_path = os.path.join(out_dir, "thumb.webp")
+        ass_path = None
+
+        srt_key = None
+        fixed_srt_content = None
+        engine_tag = (align.cache_tag() if SUBTITLE_ENGINE == "align"
+                      else f"{transcribe.WHISPER_MODEL}:{thaiseg.cache_tag()}")
+        if script and cache:
+            srt_key = result_cache.key(pcm_sha256, result_cache.sha256(script), engine_tag)
+            fixed_srt_content = cache.get_text("srt", srt_key)
+            if fixed_srt_content is not None:
+                print(f"[CACHE] Subtitle hit ({srt_key[:12]})")
+
+        if script and fixed_srt_content is None and SUBTITLE_ENGINE == "align":
+            # รู้ script อยู่แล้ว — หาแค่เวลาของแต่ละคำจากเสียงโดยตรง ข้อความตรง script 100%
             if progress_cb:
-                progress_cb("📝 กำลังวิเคราะห์และแกะเวลาเสียงพูด (Word Sync)...", 4.3)
-                
-            print("[PIPELINE] Transcribing with Whisper (Turbo model)...")
+                progress_cb("📝 กำลังจับเวลาซับกับเสียงพากย์...", 4.3)
+            t0 = time.time()
             try:
-                subprocess.run([
-                    "whisper-ctranslate2", adjusted,
-                    "--model", "turbo",
-                    "--language", "th",
-                    "--output_format", "srt",
-                    "--output_dir", tmpdir,
-                    "--compute_type", "int8",
-                    "--word_timestamps", "True",
-                    "--max_line_width", "20",
-                    "--max_line_count", "1"
-                ], check=True, timeout=300)  # 5 min timeout
-            except subprocess.TimeoutExpired:
-                raise Exception("Whisper transcription timed out (>300s)")
-            except subprocess.CalledProcessError as e:
-                raise Exception(f"Whisper failed: {e}")
-            
-            srt_name = os.path.splitext(os.path.basename(adjusted))[0] + ".srt"
-            srt_path = os.path.join(tmpdir, srt_name)
-            
-            with open(srt_path, "r", encoding="utf-8") as fs:
-                raw_srt_text = fs.read()
-                
+                fixed_srt_content = align.to_srt(pcm, script, segments=segments)
+                if "-->" not in fixed_srt_content:
+                    raise ValueError("no aligned words")
+                print(f"[PIPELINE] Aligned subtitles in {(time.time() - t0) * 1000:.0f}ms")
+                if srt_key:
+                    cache.put_bytes("srt", srt_key, fixed_srt_content)
+            except Exception as e:
+                # align ไม่ได้ (เช่นเสียงเงียบทั้งไฟล์) → ตกไปใช้ Whisper ด้านล่าง
+                print(f"[PIPELINE] Align error: {e}")
+
+        if script and fixed_srt_content is None:
             if progress_cb:
-                progress_cb("✨ กำลังแปลและจัดเรียงซับไตเติ้ล...", 4.6)
-                
-            print("[PIPELINE] Translating/Fixing SRT with Gemini...")
-            prompt = f"""คุณคือผู้เชี่ยวชาญด้านการตัดต่อ Subtitle วิดีโอสั้นสไตล์ TikTok/Reels แบบคำปังๆ เน้นขึ้นโชว์ทีละบรรทัดสั้นๆ
-นี่คือต้นฉบับบทพากย์ที่ถูกต้อง (Original Script):
-{script}
-
-และนี่คือไฟล์ SRT ที่ได้จากเสียงพูด:
-{raw_srt_text}
-
-คำสั่งบังคับ (สำคัญมากต้องทำตาม):
-1. แปลงข้อมูลเป็น SRT ใหม่ ให้เนื้อหาซับไตเติ้ลแสดงผล "ทีละ 1 บรรทัดเท่านั้น" ห้ามมีการขึ้นบรรทัดใหม่ ใน 1 block
-2. หั่นประโยคให้สั้น (กะประมาณไม่เกิน 15-20 ตัวอักษรต่อ 1 block SRT) เพื่อให้อ่านทันทีละจังหวะสั้นๆ
-3. เนื้อหาและคำศัพท์ต้องถูกต้อง 100% ตาม "Original Script" ห้ามมีคำผิดแหลมมา (แก้คำที่ Whisper แปลงมามั่วให้ถูกเป๊ะๆ)
-4. คุณต้อง "คำนวณแบ่งและสร้าง Timestamps ใหม่" โดยซอย block ยาวๆ ให้เป็น block สั้นๆ ตามสัดส่วนความยาวคำให้เนียนที่สุด โดยให้เวลาเริ่มและเวลาจบครอบคลุมตาม SRT ของเดิมอย่าให้ล้น
-5. เลี่ยงการตัดคำที่มีความหมายติดกัน (เช่น 'เชยระเบิด' ไม่ควรแยก 'เชย' กับ 'ระเบิด' ข้ามเวลา)
-6. ⚠️ ห้ามเอาข้อความสอง block หรือสองวรรคมาต่อกันแบบไม่มีเว้นวรรค เช่น "ดูความแบ๊วสิคะแม่ ขี่" หรือ "งอร้านสะดวกซื้อปาก" จะต้องแบ่งเป็นคำที่มีความหมายสมบูรณ์ "ดูความแบ๊วสิคะแม่", "ง้อร้านสะดวกซื้อปากซอย" 
-7. ตอบกลับมาแค่เนื้อหา SRT ล้วนๆ ห้ามตอบอย่างอื่น ห้ามมี markdown ```srt
-
-SRT ที่แก้ไขแล้ว:"""
-            import time
-            sub_model = "gemini-3-flash-preview"
-            for attempt in range(5):
-                try:
-                    gemini_resp = http_requests.post(
-                        f"https://generativelanguage.googleapis.com/v1beta/models/{sub_model}:generateContent?key={api_key}",
-                        json={"contents": [{"parts": [{"text": prompt}]}]},
-                        timeout=60,
-                    ).json()
-                    
-                    if gemini_resp.get("error"):
-                        err_msg = gemini_resp['error'].get('message', '')
-                        if "high demand" in err_msg.lower() or "503" in str(err_msg):
-                            print(f"[PIPELINE] Subtitle Gemini high demand, retrying... ({attempt+1}/5)")
-                            time.sleep(5)
-                            if attempt >= 2 and sub_model == "gemini-3-flash-preview":
-                                sub_model = "gemini-2.0-flash"
-                                print(f"[PIPELINE] Fallback subtitle model to {sub_model}")
-                            continue
-                        print(f"[PIPELINE] Gemini Subtitling error: {err_msg}")
-                        fixed_srt_content = raw_srt_text
-                        break
-                    else:
-                        fixed_srt_content = gemini_resp.get("candidates", [{}])[0].get("content", {}).get("parts", [{}])[0].get("text", "")
-                        fixed_srt_content = fixed_srt_content.replace("```srt", "").replace("```", "").strip()
-                        break
-                except Exception as e:
-                    if attempt < 4:
-                        time.sleep(5)
-                        continue
-                    print(f"[PIPELINE] Gemini Subtitle Exception: {e}")
-                    fixed_srt_content = raw_srt_text
-                    break
-                
-            with open(srt_path, "w", encoding="utf-8") as fs:
-                fs.write(fixed_srt_content)
-                
+                progress_cb("📝 กำลังวิเคราะห์และแกะเวลาเสียงพูด (Word Sync)...", 4.3)
+
+            # ถอดเฉพาะช่วงที่มีเสียงพูดของ PCM (ยังไม่ pad) แบ่ง chunk ถอดพร้อมกัน
+            print("[PIPELINE] Transcribing with Whisper (Turbo model, in-process)...")
+            try:
+                words = transcribe.transcribe_pcm(pcm, sample_rate=24000, language="th")
+            except Exception as e:
+                if not segments:
+                    raise Exception(f"Whisper failed: {e}")
+                # เวลาของแต่ละท่อน TTS หยาบกว่า แต่ยังได้ซับ — thaiseg ซอยต่อตามสัดส่วน
+                print(f"[PIPELINE] Whisper failed ({e}), using TTS segment timing")
+                words = [transcribe.Word(*seg) for seg in segments]
+
+            # ข้อความซับมาจาก script (ไม่ใช่คำที่ Whisper ได้ยิน) — Whisper ให้แค่เวลา
+            t0 = time.time()
+            fixed_srt_content = thaiseg.to_srt(script, words)
+            print(f"[PIPELINE] Subtitle blocks in {(time.time() - t0) * 1000:.0f}ms")
+            if srt_key:
+                cache.put_bytes("srt", srt_key, fixed_srt_content)
+
+        if fixed_srt_content is not None:
             ass_path = os.path.join(tmpdir, "subtitles.ass")
-            
-            vp = subprocess.run([
-                "ffprobe", "-v", "error", "-show_entries", "stream=width,height",
-                "-of", "csv=p=0:s=x", merged_nosub
-            ], capture_output=True, text=True)
-            res = vp.stdout.strip().split('x')
-            vw = int(res[0]) if len(res) == 2 else 1080
-            vh = int(res[1]) if len(res) == 2 else 1920
-            
-            _convert_to_ass(srt_path, ass_path, vw, vh)
-            
+            _convert_to_ass(fixed_srt_content, ass_path, vw, vh)
+
             print("[PIPELINE] Burning subtitles with FFmpeg Native...")
             if progress_cb:
                 progress_cb("🎬 กำลังเตรียมซับไตเติ้ล...", 4.8)
-            
-            # Use Native FFmpeg ASS plugin, pointing fontsdir to /app where font.ttf resides
-            import re
-            
-            cmd = [
-                "ffmpeg", "-y", "-i", merged_nosub,
-                "-progress", "-", "-nostats",
-                "-vf", f"ass={ass_path}:fontsdir=/app",
-                "-c:v", "libx264", "-c:a", "copy", "-preset", "fast", output_path
-            ]
-            
-            p = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True)
-            
-            last_pct = 0
-            for line in p.stdout:
-                line = line.strip()
-                if line.startswith("out_time_us="):
-                    try:
-                        us_val = line.split("=")[1]
-                        if us_val != "N/A":
-                            current_sec = int(us_val) / 1000000.0
-                            if duration > 0:
-                                pct = min(1.0, current_sec / duration)
-                                if pct - last_pct > 0.05 or pct == 1.0:
-                                    if progress_cb:
-                                        # Map 0..1 to 4.8..4.99
-                                        progress_cb(f"🎬 กำลังฝังซับไตเติ้ล ({current_sec:.1f}s / {duration:.1f}s)", 4.8 + (pct * 0.19))
-                                    last_pct = pct
-                    except Exception:
-                        pass
-                        
-            p.wait()
-            
-            if p.returncode != 0:
-                print(f"[PIPELINE] FFmpeg sub error: returncode {p.returncode}")
-                # Fallback on merge_nosub if subtitle burning fails completely
-                import shutil
-                shutil.move(merged_nosub, output_path)
-                
-        else:
-            import shutil
-            shutil.move(merged_nosub, output_path)
 
-        op = subprocess.run([
-            "ffprobe", "-v", "error", "-show_entries", "format=duration",
-            "-of", "default=noprint_wrappers=1:nokey=1", output_path
-        ], capture_output=True, text=True)
-        out_dur = float(op.stdout.strip()) if op.stdout.strip() else duration
+        final_key = None
+        if cache and result_cache.RESULT_CACHE_MP4 and source_sha256:
+            final_key = result_cache.key(source_sha256, pcm_sha256, result_cache.sha256(fixed_srt_content or ""))
+            cached_mp4 = cache.get_path("final", final_key)
+            cached_thumb = cache.get_path("thumb", final_key) if cached_mp4 else None
+            if cached_mp4:
+                print(f"[CACHE] Final MP4 hit ({final_key[:12]})")
+                import shutil
+                shutil.copyfile(cached_mp4, output_path)
+                if cached_thumb:
+                    shutil.copyfile(cached_thumb, thumb_path)
+                return output_path, thumb_path if cached_thumb else None, duration
+
+        last_pct = [0]
+
+        def on_progress(current_sec):
+            if not (progress_cb and ass_path and duration > 0):
+                return
+            pct = min(1.0, current_sec / duration)
+            if pct - last_pct[0] > 0.05 or pct == 1.0:
+                # Map 0..1 to 4.8..4.99
+                progress_cb(f"🎬 กำลังฝังซับไตเติ้ล ({current_sec:.1f}s / {duration:.1f}s)", 4.8 + (pct * 0.19))
+                last_pct[0] = pct
+
+        # Use Native FFmpeg ASS plugin, pointing fontsdir to /app where font.ttf resides
+        try:
+            media.merge(video_path, pcm, output_path, duration, sample_rate=24000,
+                        ass_path=ass_path, fontsdir="/app", thumb_path=thumb_path,
+                        on_progress=on_progress)
+        except Exception as e:
+            if not ass_path:
+                raise Exception(f"FFmpeg failed: {e}")
+            # Fallback: ฝังซับไม่สำเร็จ → ส่งวิดีโอไม่มีซับแทน
+            print(f"[PIPELINE] FFmpeg sub error: {e}")
+            media.merge(video_path, pcm, output_path, duration, sample_rate=24000,
+                        thumb_path=thumb_path)
+            final_key = None
 
-        thumb_path = os.path.join(tmpdir, "thumb.webp")
-        subprocess.run([
-            "ffmpeg", "-y", "-i", output_path, "-vframes", "1", "-ss", "0.1",
-            "-vf", "scale=270:480:force_original_aspect_ratio=increase,crop=270:480",
-            "-q:v", "80", thumb_path
-        ], capture_output=True)
+        if not (os.path.exists(thumb_path) and os.path.getsize(thumb_path) > 0):
+            thumb_path = None
 
-        with open(output_path, "rb") as f:
-            merged = f.read()
-        thumb = None
-        if os.path.exists(thumb_path) and os.path.getsize(thumb_path) > 0:
-            with open(thumb_path, "rb") as f:
-                thumb = f.read()
+        if final_key:
+            cache.put_file("final", final_key, output_path)
+            if thumb_path:
+                cache.put_file("thumb", final_key, thumb_path)
 
-        return merged, thumb, out_dur
+        return output_path, thumb_path, duration
 
 
-def _convert_to_ass(srt_file, ass_file, vw, vh):
-    with open(srt_file, 'r', encoding='utf-8') as f:
-        srt_content = f.read()
-    
+def _stream_merge(video_path, script, api_key, progress_cb=None, out_dir=None):
+    """
+    streaming TTS → ffmpeg stdin โดยตรง (งานที่ไม่ burn ซับ) — encode วิดีโอไปพร้อมกับที่เสียงทยอยมา
+    ไม่ต้องรอ TTS ครบก่อนเริ่ม merge; เสียงที่ได้เก็บไว้ลง cache ต่อ
+    return (output_path, thumb_path หรือ None, duration, pcm bytes)
+    """
+    out_dir = out_dir or tempfile.mkdtemp(prefix="merge_")
+    duration = media.probe(video_path)[0] or 15.0
+    output_path = os.path.join(out_dir, "output.mp4")
+    thumb_path = os.path.join(out_dir, "thumb.webp")
+    received = bytearray()
+    t0 = time.time()
+    first_audio = []
+    last_sec = [0.0]
+
+    def on_audio(seconds):
+        if not first_audio:
+            first_audio.append(time.time() - t0)
+            print(f"[PIPELINE] TTS stream: first audio after {first_audio[0]:.2f}s")
+        if progress_cb and seconds - last_sec[0] >= 2.0:
+            progress_cb(f"🎙 กำลังพากย์+รวมวิดีโอ ({seconds:.1f}s)", 4.5)
+            last_sec[0] = seconds
+
+    def chunks():
+        for chunk in tts.stream(script, api_key, on_audio=on_audio):
+            received.extend(chunk)
+            yield chunk
+
+    media.merge(video_path, chunks(), output_path, duration, sample_rate=tts.SAMPLE_RATE, thumb_path=thumb_path)
+    print(f"[PIPELINE] TTS stream + merge: {len(received)//1024} KB PCM, {time.time() - t0:.1f}s total")
+    if not (os.path.exists(thumb_path) and os.path.getsize(thumb_path) > 0):
+        thumb_path = None
+    return output_path, thumb_path, duration, bytes(received)
+
+
+def _convert_to_ass(srt_content, ass_file, vw, vh):
     font_size = int(vw * 0.115)
     if font_size < 50: font_size = 50
     
@@ -962,17 +1044,27 @@ Format: Layer, Start, End, Style, Name, MarginL, MarginR, MarginV, Effect, Text
 @app.route("/pipeline", methods=["POST"])
 def pipeline():
     """
-    รับงาน pipeline จาก Worker → รัน background thread → return ทันที
-    Worker ไม่ต้องรอ ไม่ติด time limit
+    รับงาน pipeline จาก Worker → เข้าคิว executor → return ทันที
+    Worker ไม่ต้องรอ ไม่ติด time limit — ถ้าคิวเต็มตอบ 429 + Retry-After
     """
     data = request.get_json()
     if not data or not data.get("token"):
         return jsonify({"error": "token required"}), 400
 
-    t = threading.Thread(target=run_pipeline_bg, args=(data,), daemon=True)
-    t.start()
-    print(f"[PIPELINE] Started background thread for chat_id={data.get('chat_id')}")
-    return jsonify({"status": "started"})
+    import uuid
+    if not data.get("video_id"):
+        data["video_id"] = uuid.uuid4().hex[:8]
+
+    try:
+        job = executor.submit(data["video_id"], run_pipeline_bg, data)
+    except jobs.QueueFull as e:
+        print(f"[PIPELINE] Queue full, rejecting chat_id={data.get('chat_id')}")
+        resp = jsonify({"error": "queue full", "retry_after": e.retry_after, "load": executor.load()})
+        resp.headers["Retry-After"] = str(e.retry_after)
+        return resp, 429
+
+    print(f"[PIPELINE] Queued job {job['id']} for chat_id={data.get('chat_id')} (position={job['queuePosition']})")
+    return jsonify({"status": "started" if job["state"] == "running" else "queued", "job": job})
 
 
 if __name__ == "__main__":
@@ -0,0 +1,51 @@
+"""
+Spooled download — stream ลง scratch file ทีละ chunk พร้อมคำนวณ SHA-256 ไปด้วย
+
+ใช้แทนการเก็บวิดีโอทั้งไฟล์ไว้ใน bytearray / resp.content
+RSS ต่องานจึงคงที่ (~1 chunk) ไม่โตตามขนาดวิดีโอ
+stage ถัดไปรับ path แล้วอ่านจากไฟล์เอง (ffmpeg, resumable upload อ่านทีละ chunk)
+"""
+import hashlib
+
+import requests as http_requests
+
+CHUNK_SIZE = 1024 * 1024
+
+
+class Spool:
+    """ไฟล์ที่ดาวน์โหลดแล้ว: path, size, sha256"""
+
+    def __init__(self, path, size, sha256):
+        self.path = path
+        self.size = size
+        self.sha256 = sha256
+
+
+def download(url, dest_path, timeout=120, headers=None, on_progress=None, session=None):
+    """
+    ดาวน์โหลด URL → dest_path แบบ stream
+
+    on_progress(received_bytes, total_bytes): total เป็น 0 ถ้า server ไม่ส่ง content-length
+    raise Exception ถ้า status != 200
+    """
+    getter = session.get if session is not None else http_requests.get
+    resp = getter(url, stream=True, timeout=timeout, headers=headers)
+    try:
+        if resp.status_code != 200:
+            raise Exception(f"Download failed: {resp.status_code}")
+        total = int(resp.headers.get("content-length", 0) or 0)
+        digest = hashlib.sha256()
+        received = 0
+        with open(dest_path, "wb") as f:
+            for chunk in resp.iter_content(chunk_size=CHUNK_SIZE):
+                if not chunk:
+                    continue
+                f.write(chunk)
+                digest.update(chunk)
+                received += len(chunk)
+                if on_progress:
+                    on_progress(received, total)
+        return Spool(dest_path, received, digest.hexdigest())
+    finally:
+        resp.close()
+
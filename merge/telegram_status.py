@@ -0,0 +1,197 @@
+"""
+Telegram status scheduler — thread เดียวดูแลข้อความสถานะ (animate . → .. → ...) ของทุกงาน
+
+- budget แบบ token bucket ต่อ bot token (global) และต่อ chat
+- เจอ 429 → เคารพ retry_after ของ Telegram (หยุดส่งเข้า chat นั้นตามเวลาที่บอก)
+- เฟรม animation คำนวณตอนจะส่งจริง — เฟรมที่ถูกแทนที่ไปแล้วจะไม่ถูกส่ง
+- ทุก request ใช้ pooled session ของ http_clients.telegram
+
+ENV:
+  TG_GLOBAL_RATE  ข้อความ/วินาที ต่อ bot token (default 25)
+  TG_CHAT_RATE    ข้อความ/วินาที ต่อ chat (default 1)
+  TG_FRAME_INTERVAL  วินาทีระหว่างเฟรม animation (default 1.5)
+"""
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import http_clients
+from ratelimit import TokenBucket, acquire_all
+
+TG_GLOBAL_RATE = float(os.environ.get("TG_GLOBAL_RATE", "25"))
+TG_CHAT_RATE = float(os.environ.get("TG_CHAT_RATE", "1"))
+TG_FRAME_INTERVAL = float(os.environ.get("TG_FRAME_INTERVAL", "1.5"))
+
+DOTS = [".", "..", "..."]
+
+
+class _Animation:
+    def __init__(self, token, chat_id, msg_id, base_text):
+        self.token = token
+        self.chat_id = chat_id
+        self.msg_id = msg_id
+        self.base_text = base_text
+        self.frame = 0
+        self.next_at = 0.0
+        self.last_text = None
+        self.idle = threading.Event()   # set = ไม่มี request ค้างอยู่
+        self.idle.set()
+
+
+class StatusScheduler:
+    def __init__(self, global_rate=TG_GLOBAL_RATE, chat_rate=TG_CHAT_RATE, interval=TG_FRAME_INTERVAL):
+        self.global_rate = global_rate
+        self.chat_rate = chat_rate
+        self.interval = interval
+        self._buckets = {}
+        self._anims = {}
+        self._cond = threading.Condition()
+        self._senders = ThreadPoolExecutor(max_workers=4, thread_name_prefix="tg-status")
+        self._thread = None
+        self.stats = {"sent": 0, "skipped": 0, "rate_limited": 0, "errors": 0}
+
+    # ── budget ──
+
+    def _bucket(self, key, rate):
+        with self._cond:
+            b = self._buckets.get(key)
+            if b is None:
+                b = self._buckets[key] = TokenBucket(rate, max(1.0, rate))
+            return b
+
+    def _budget(self, token, chat_id):
+        return [self._bucket(("bot", token), self.global_rate),
+                self._bucket(("chat", token, chat_id), self.chat_rate)]
+
+    # ── HTTP ──
+
+    def call(self, token, method, payload, timeout=30, max_wait=60):
+        """เรียก Bot API แบบ synchronous ผ่าน budget เดียวกัน — คืน JSON response"""
+        chat_id = payload.get("chat_id")
+        buckets = self._budget(token, chat_id)
+        deadline = time.monotonic() + max_wait
+        while True:
+            if not acquire_all(buckets, timeout=max(0.0, deadline - time.monotonic())):
+                # รอ budget เกิน max_wait — ไม่ส่ง (ส่งไปก็เกิน rate ที่ตั้งไว้) คืน response แบบ Bot API ที่ ok=False
+                self.stats["skipped"] += 1
+                print(f"[TELEGRAM] {method} chat={chat_id} skipped: no budget within {max_wait}s")
+                return {"ok": False, "description": f"local rate budget exhausted ({max_wait}s)"}
+            data = self._post(token, method, payload, timeout, buckets)
+            retry_after = _retry_after(data)
+            if retry_after is None or time.monotonic() + retry_after > deadline:
+                return data
+
+    def _post(self, token, method, payload, timeout, buckets):
+        resp = http_clients.telegram.post(f"https://api.telegram.org/bot{token}/{method}", json=payload, timeout=timeout)
+        data = resp.json()
+        retry_after = _retry_after(data)
+        if retry_after is not None:
+            self.stats["rate_limited"] += 1
+            print(f"[TELEGRAM] 429 on {method} chat={payload.get('chat_id')}, retry after {retry_after}s")
+            # flood limit ของ Telegram ส่วนใหญ่เป็นต่อ chat — หยุดเฉพาะ chat นั้น
+            buckets[-1].penalize(retry_after)
+        else:
+            self.stats["sent"] += 1
+        return data
+
+    # ── animation ──
+
+    def animate(self, token, chat_id, msg_id, base_text):
+        """เริ่ม/เปลี่ยนข้อความ animate ของ msg_id นี้ (แทนที่เฟรมเดิมทันที)"""
+        key = (token, chat_id, msg_id)
+        with self._cond:
+            anim = self._anims.get(key)
+            if anim is None:
+                anim = self._anims[key] = _Animation(token, chat_id, msg_id, base_text)
+            anim.base_text = base_text
+            anim.frame = 0
+            anim.next_at = 0.0
+            self._ensure_thread()
+            self._cond.notify()
+
+    def stop(self, token, chat_id, msg_id, timeout=5):
+        """หยุด animate — รอ request ที่กำลังส่งให้จบก่อน (กันเฟรมเก่าทับข้อความสุดท้าย)"""
+        with self._cond:
+            anim = self._anims.pop((token, chat_id, msg_id), None)
+        if anim:
+            anim.idle.wait(timeout)
+
+    def edit(self, token, chat_id, msg_id, text, **extra):
+        """แก้ข้อความครั้งเดียว — ยกเลิก animation ของข้อความนี้ก่อน"""
+        self.stop(token, chat_id, msg_id)
+        payload = {"chat_id": chat_id, "message_id": msg_id, "text": text}
+        payload.update(extra)
+        return self.call(token, "editMessageText", payload)
+
+    def _ensure_thread(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="tg-status-scheduler", daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        while True:
+            with self._cond:
+                now = time.monotonic()
+                due, next_wake = [], None
+                for anim in self._anims.values():
+                    if not anim.idle.is_set():
+                        continue
+                    if anim.next_at <= now:
+                        wait = max(b.delay() for b in self._budget(anim.token, anim.chat_id))
+                        if wait > 0:
+                            # ยังไม่มี budget → เลื่อน, เฟรมจะถูกคำนวณใหม่ตอนส่ง (เฟรมระหว่างทางถูกข้าม)
+                            anim.next_at = now + wait
+                            self.stats["skipped"] += 1
+                        else:
+                            due.append(anim)
+                            continue
+                    next_wake = anim.next_at if next_wake is None else min(next_wake, anim.next_at)
+                for anim in due:
+                    anim.idle.clear()
+                    anim.next_at = now + self.interval
+                    self._senders.submit(self._send_frame, anim)
+                if not due:
+                    self._cond.wait(None if next_wake is None else max(0.01, next_wake - now))
+
+    def _send_frame(self, anim):
+        try:
+            text = anim.base_text + DOTS[anim.frame % len(DOTS)]
+            anim.frame += 1
+            if text == anim.last_text:
+                self.stats["skipped"] += 1
+                return
+            buckets = self._budget(anim.token, anim.chat_id)
+            if not acquire_all(buckets, timeout=0):
+                self.stats["skipped"] += 1
+                return
+            data = self._post(anim.token, "editMessageText", {
+                "chat_id": anim.chat_id,
+                "message_id": anim.msg_id,
+                "text": text,
+                "parse_mode": "HTML",
+            }, 15, buckets)
+            if data.get("ok"):
+                anim.last_text = text
+            elif _retry_after(data) is None:
+                print(f"[TELEGRAM] Status edit failed: {data.get('description')}")
+        except Exception as e:
+            self.stats["errors"] += 1
+            print(f"[TELEGRAM] Status edit error: {e}")
+        finally:
+            anim.idle.set()
+            with self._cond:
+                self._cond.notify()
+
+    def status(self):
+        with self._cond:
+            return dict(self.stats, animations=len(self._anims))
+
+
+def _retry_after(data):
+    if isinstance(data, dict) and data.get("error_code") == 429:
+        return float((data.get("parameters") or {}).get("retry_after", 1))
+    return None
+
+
+scheduler = StatusScheduler()
@@ -0,0 +1,265 @@
+"""
+ตัดคำไทย + จัดซับ — แทนการส่ง SRT ไปให้ Gemini แก้ (ทำใน process, deterministic, ใช้เวลาระดับ ms)
+
+- ตัดคำแบบ maximal matching กับคลังคำที่แถมมา (thai_words.txt: คำพากย์รีวิว + PyThaiNLP words_th ~60k คำ)
+  เลือกทางที่มีตัวอักษรนอกคลังน้อยสุด แล้วจำนวนคำน้อยสุด; ส่วนที่ไม่รู้จักตัดที่ขอบ cluster (พยัญชนะ + สระ/วรรณยุกต์) เท่านั้น
+- จับคู่ตัวอักษรของ script กับคำที่มีเวลา (Whisper หรือ align.py) ด้วย sequence alignment
+  → เวลาของทุกตัวอักษรใน script (ข้อความบนจอตรง script เสมอ ไม่ใช่คำที่ Whisper ได้ยิน)
+- รวมคำเป็น block บรรทัดเดียวไม่เกิน THAI_SUB_MAX_CHARS ตัว (ไม่นับสระบน/ล่าง/วรรณยุกต์)
+  ชอบตัดตรงเว้นวรรค/ช่วงหยุดพูด ไม่ตัดกลางคำ
+
+ENV:
+  THAI_SUB_MAX_CHARS  ความยาวสูงสุดต่อ block (default 20)
+  THAI_LEXICON        ไฟล์คำเพิ่มเติม (1 คำต่อบรรทัด, คั่นหลายไฟล์ด้วย :)
+"""
+import os
+import re
+import threading
+import unicodedata
+from difflib import SequenceMatcher
+
+THAI_SUB_MAX_CHARS = int(os.environ.get("THAI_SUB_MAX_CHARS", "20"))
+THAI_LEXICON = os.environ.get("THAI_LEXICON", "")
+
+LEXICON_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "thai_words.txt")
+
+_LEADING_VOWELS = "เแโใไ"
+_FOLLOWING = "ะาำๅๆ"
+_RUN_RE = re.compile(r"[฀-๿]+|[A-Za-z0-9]+(?:[.,][0-9]+)*|\s+|.", re.S)
+_SENTENCE_END = ("ค่ะ", "คะ", "ครับ", "นะ", "จ้า", "เลย", "!", "?", ".", "…")
+# คำลงท้ายที่ไม่ควรขึ้นต้น block ใหม่
+_PARTICLES = ("ค่ะ", "คะ", "ครับ", "นะ", "นะคะ", "นะครับ", "จ้า", "จ้ะ", "เลย", "เลยค่ะ", "สิ", "สิคะ", "ด้วย", "กัน",
+              "แล้ว", "ไหม", "มั้ย", "เนอะ", "ๆ")
+
+# ต้นทุนของการตัด block: ที่ว่างเหลือในบรรทัด + ตัดตรงที่ไม่ใช่เว้นวรรค − โบนัสจบประโยค/ช่วงหยุดพูด
+_SLACK_COST = 2.0
+_SHORT_LINE = 25.0
+_NO_SPACE_BREAK = 30.0
+_PARTICLE_BREAK = 30.0
+_SENTENCE_BREAK_BONUS = 10.0
+_PAUSE_BONUS_PER_SEC = 40.0
+_MIN_BLOCK_SEC = 0.3
+
+_lexicon = None
+_lexicon_lock = threading.Lock()
+
+
+def _load_words(path):
+    with open(path, encoding="utf-8") as f:
+        return {w for w in (line.strip() for line in f) if w and not w.startswith("#")}
+
+
+def lexicon():
+    """(set ของคำ, ความยาวคำที่มี เรียงยาว→สั้น) — โหลดครั้งเดียวต่อ process"""
+    global _lexicon
+    if _lexicon is None:
+        with _lexicon_lock:
+            if _lexicon is None:
+                words = _load_words(LEXICON_PATH)
+                for path in filter(None, THAI_LEXICON.split(":")):
+                    try:
+                        words |= _load_words(path)
+                    except OSError as e:
+                        print(f"[THAISEG] Cannot load lexicon {path}: {e}")
+                lengths = sorted({len(w) for w in words}, reverse=True)
+                _lexicon = (frozenset(words), lengths)
+    return _lexicon
+
+
+def cache_tag():
+    """ค่าที่มีผลกับซับที่ได้ — ใส่ใน result cache key"""
+    words, _lengths = lexicon()
+    return f"thaiseg:v1:{THAI_SUB_MAX_CHARS}:{len(words)}"
+
+
+def width(text):
+    """ความกว้างบนจอโดยประมาณ — ไม่นับสระบน/ล่างและวรรณยุกต์"""
+    return sum(1 for ch in text if unicodedata.category(ch) != "Mn")
+
+
+def _cluster_bounds(text):
+    """ตำแหน่งที่ตัดได้ใน run ภาษาไทย (สระหน้าไม่แยกจากพยัญชนะตัวถัดไป, สระหลัง/วรรณยุกต์ไม่แยกจากตัวหน้า)"""
+    bounds = [0]
+    for i in range(1, len(text)):
+        ch, prev = text[i], text[i - 1]
+        if unicodedata.category(ch) == "Mn" or ch in _FOLLOWING or prev in _LEADING_VOWELS:
+            continue
+        bounds.append(i)
+    bounds.append(len(text))
+    return bounds
+
+
+def _segment_thai(text):
+    """maximal matching ของ run ภาษาไทย (ไม่มีเว้นวรรค) → list ของคำ"""
+    words, lengths = lexicon()
+    bounds = _cluster_bounds(text)
+    is_bound = set(bounds)
+    n = len(text)
+    # best[i] = (ตัวอักษรนอกคลัง, จำนวนคำ, จุดก่อนหน้า, เป็นคำในคลังไหม)
+    best = {0: (0, 0, None, True)}
+    nxt = dict(zip(bounds, bounds[1:]))
+    for i in bounds[:-1]:
+        if i not in best:
+            continue
+        unk, count, _p, _k = best[i]
+        for length in lengths:
+            j = i + length
+            if j > n or j not in is_bound or text[i:j] not in words:
+                continue
+            cand = (unk, count + 1, i, True)
+            if j not in best or cand[:2] < best[j][:2]:
+                best[j] = cand
+        j = nxt[i]
+        cand = (unk + (j - i), count + 1, i, False)
+        if j not in best or cand[:2] < best[j][:2]:
+            best[j] = cand
+
+    pieces = []
+    j = n
+    while j > 0:
+        _u, _c, i, known = best[j]
+        pieces.append((text[i:j], known))
+        j = i
+    pieces.reverse()
+
+    # cluster ที่ไม่รู้จักติดกันรวมเป็นก้อนเดียว (ชื่อเฉพาะ/คำทับศัพท์) — ไม่ตัดกลาง
+    out = []
+    for piece, known in pieces:
+        if out and not known and not out[-1][1]:
+            out[-1] = (out[-1][0] + piece, False)
+        else:
+            out.append((piece, known))
+    return [p for p, _k in out]
+
+
+def tokenize(text):
+    """ข้อความ → list ของ token (คำไทย, คำอังกฤษ/ตัวเลข, เครื่องหมาย, เว้นวรรคเป็น " ")"""
+    tokens = []
+    for m in _RUN_RE.finditer(text):
+        run = m.group(0)
+        if run.isspace():
+            if tokens and tokens[-1] != " ":
+                tokens.append(" ")
+        elif "฀" <= run[0] <= "๿":
+            tokens.extend(_segment_thai(run))
+        else:
+            tokens.append(run)
+    while tokens and tokens[-1] == " ":
+        tokens.pop()
+    return tokens
+
+
+def char_times(script, words):
+    """
+    เวลา (start, end) ของทุกตัวอักษรใน script ที่ตัดช่องว่างแล้ว
+    words: [(start, end, text)] เช่น transcribe.Word จาก Whisper หรือ align.align
+    """
+    flat = re.sub(r"\s+", "", script)
+    heard, heard_times = [], []
+    for start, end, text in words:
+        text = re.sub(r"\s+", "", text)
+        step = (end - start) / max(len(text), 1)
+        for k, ch in enumerate(text):
+            heard.append(ch)
+            heard_times.append((start + step * k, start + step * (k + 1)))
+    if not flat:
+        return []
+    if not heard:
+        return [(0.0, 0.0)] * len(flat)
+
+    times = [None] * len(flat)
+    matcher = SequenceMatcher(None, flat, "".join(heard), autojunk=False)
+    for a, b, size in matcher.get_matching_blocks():
+        for k in range(size):
+            times[a + k] = heard_times[b + k]
+
+    # ตัวอักษรที่ไม่ตรงกับที่ได้ยิน → เฉลี่ยตามจำนวนตัวอักษรระหว่างตัวที่จับคู่ได้สองข้าง
+    i = 0
+    while i < len(flat):
+        if times[i] is not None:
+            i += 1
+            continue
+        j = i
+        while j < len(flat) and times[j] is None:
+            j += 1
+        t0 = times[i - 1][1] if i > 0 else heard_times[0][0]
+        t1 = times[j][0] if j < len(flat) else heard_times[-1][1]
+        t1 = max(t1, t0)
+        step = (t1 - t0) / (j - i)
+        for k in range(i, j):
+            times[k] = (t0 + step * (k - i), t0 + step * (k - i + 1))
+        i = j
+    return times
+
+
+def blocks(script, words, max_chars=None):
+    """script + คำที่มีเวลา → [(start, end, text)] block ละ 1 บรรทัด"""
+    max_chars = max_chars or THAI_SUB_MAX_CHARS
+    tokens = tokenize(script)
+    times = char_times(script, words)
+    if not times:
+        return []
+
+    # token ที่เป็นคำพร้อมเวลา + เว้นวรรคนำหน้าไหม
+    items = []
+    pos, space = 0, False
+    for tok in tokens:
+        if tok == " ":
+            space = True
+            continue
+        n = len(re.sub(r"\s+", "", tok))
+        items.append((tok, times[pos][0], times[pos + n - 1][1], space))
+        pos += n
+        space = False
+
+    # DP เลือกจุดตัด: best[j] = ต้นทุนต่ำสุดของการจัด items[:j]
+    n = len(items)
+    best = [0.0] + [float("inf")] * n
+    back = [0] * (n + 1)
+    for j in range(1, n + 1):
+        line_w = 0
+        for i in range(j - 1, -1, -1):
+            tok = items[i][0]
+            line_w += width(tok) + (1 if i < j - 1 and items[i + 1][3] else 0)
+            if line_w > max_chars and i < j - 1:
+                break
+            cost = best[i] + _SLACK_COST * (max_chars - min(line_w, max_chars))
+            if line_w < max_chars // 3:
+                cost += _SHORT_LINE
+            if j < n:
+                if not items[j][3]:
+                    cost += _NO_SPACE_BREAK
+                if items[j][0] in _PARTICLES:
+                    cost += _PARTICLE_BREAK
+                if items[j - 1][0].endswith(_SENTENCE_END):
+                    cost -= _SENTENCE_BREAK_BONUS
+                cost -= _PAUSE_BONUS_PER_SEC * min(max(items[j][1] - items[j - 1][2], 0.0), 0.5)
+            if cost < best[j]:
+                best[j], back[j] = cost, i
+
+    cuts = []
+    j = n
+    while j > 0:
+        cuts.append((back[j], j))
+        j = back[j]
+    cuts.reverse()
+
+    out = []
+    for i, j in cuts:
+        text = "".join((" " if k > i and items[k][3] else "") + items[k][0] for k in range(i, j))
+        start = max(items[i][1], out[-1][1] if out else 0.0)
+        end = max(items[j - 1][2], start + _MIN_BLOCK_SEC)
+        out.append((start, end, text))
+    return out
+
+
+def _srt_time(t):
+    ms = int(round(max(t, 0) * 1000))
+    return f"{ms // 3600000:02d}:{ms // 60000 % 60:02d}:{ms // 1000 % 60:02d},{ms % 1000:03d}"
+
+
+def to_srt(script, words, max_chars=None):
+    """script + คำที่มีเวลา → SRT (พร้อมส่งเข้า _convert_to_ass)"""
+    out = [f"{i}\n{_srt_time(s)} --> {_srt_time(e)}\n{text}"
+           for i, (s, e, text) in enumerate(blocks(script, words, max_chars), 1)]
+    return "\n\n".join(out) + ("\n" if out else "")
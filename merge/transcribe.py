@@ -0,0 +1,406 @@
+"""
+Whisper transcription service — โหลด faster-whisper model ครั้งเดียวตอน container start
+แล้วใช้ซ้ำทุกงาน /pipeline แทนการ spawn whisper-ctranslate2 ทุกครั้ง
+
+transcribe_pcm(): ถอดเฉพาะช่วงที่มีเสียงพูดของ PCM จาก TTS (ไม่เสียเวลากับความเงียบ)
+ตัดเป็น chunk ตรงช่วงเงียบแล้วถอดทุก chunk พร้อมกัน — เวลาของคำเลื่อนกลับเป็นเวลาบนวิดีโอ
+
+WHISPER_BATCH_SIZE > 1: chunk จากทุกงานเข้าคิวเดียว (BatchQueue) รวมเป็น micro-batch
+แล้วถอดใน forward pass เดียวของ BatchedInferencePipeline — งานที่ถึงขั้นซับพร้อมกันไม่ต้องต่อคิวกันทีละงาน
+
+ENV:
+  WHISPER_MODEL         (default "turbo")
+  WHISPER_COMPUTE_TYPE  (default "int8")
+  WHISPER_CONCURRENCY   จำนวนงานที่ถอดเสียงพร้อมกันสูงสุด (default 1)
+  WHISPER_CPU_THREADS   thread ต่อ inference (default 0 = แบ่ง core เท่าๆ กันตามจำนวน worker)
+  WHISPER_CHUNK_WORKERS จำนวน chunk ของงานเดียวที่ถอดพร้อมกัน (default min(4, จำนวน core))
+  WHISPER_CHUNK_SECONDS ความยาว chunk ขั้นต่ำ (default 8) — ปกติแบ่งช่วงพูดเท่าๆ กันตามจำนวน worker
+  WHISPER_BATCH_SIZE    จำนวน chunk สูงสุดต่อ batch ข้ามงาน (default 0 = ปิด, ถอดแบบ chunk ขนานต่องาน)
+  WHISPER_BATCH_WAIT_MS รอ chunk อื่นมาร่วม batch นานสุดกี่ ms นับจาก chunk แรกเข้าคิว (default 50)
+  WHISPER_TIMEOUT       วินาทีสูงสุดของการถอดเสียง 1 งาน รวมเวลารอคิว (default 300) — เกินแล้ว raise TimeoutError
+"""
+import os
+import threading
+import time
+from collections import deque, namedtuple
+from concurrent.futures import Future, ThreadPoolExecutor
+from concurrent.futures import TimeoutError as FutureTimeout
+
+import numpy as np
+
+WHISPER_MODEL = os.environ.get("WHISPER_MODEL", "turbo")
+WHISPER_COMPUTE_TYPE = os.environ.get("WHISPER_COMPUTE_TYPE", "int8")
+WHISPER_CONCURRENCY = int(os.environ.get("WHISPER_CONCURRENCY", "1"))
+WHISPER_CPU_THREADS = int(os.environ.get("WHISPER_CPU_THREADS", "0"))
+WHISPER_CHUNK_WORKERS = int(os.environ.get("WHISPER_CHUNK_WORKERS", str(min(4, os.cpu_count() or 1))))
+WHISPER_CHUNK_SECONDS = float(os.environ.get("WHISPER_CHUNK_SECONDS", "8"))
+WHISPER_BATCH_SIZE = int(os.environ.get("WHISPER_BATCH_SIZE", "0"))
+WHISPER_BATCH_WAIT_MS = float(os.environ.get("WHISPER_BATCH_WAIT_MS", "50"))
+WHISPER_TIMEOUT = float(os.environ.get("WHISPER_TIMEOUT", "300"))
+
+# ctranslate2 worker หนึ่งตัวต่อ inference ที่รันพร้อมกันได้ — แบ่ง core ให้เท่าๆ กัน
+# (โหมด batch: forward ทีละ batch ใช้ทุก core ใน worker เดียว)
+_WORKERS = 1 if WHISPER_BATCH_SIZE > 1 else max(1, WHISPER_CONCURRENCY * max(1, WHISPER_CHUNK_WORKERS))
+_THREADS = WHISPER_CPU_THREADS or max(1, (os.cpu_count() or 1) // _WORKERS)
+
+WHISPER_SAMPLE_RATE = 16000
+# VAD: เฟรม 20ms, เงียบอย่างน้อย 250ms ถึงตัด chunk, เก็บขอบไว้ 100ms กันคำแรก/คำสุดท้ายขาด
+_VAD_FRAME_MS = 20
+_VAD_MIN_SILENCE_MS = 250
+_VAD_PAD_MS = 100
+# คำเดียวพร้อมเวลา (วินาที) — ใช้แทนไฟล์ SRT ที่ whisper-ctranslate2 เขียนลง disk
+Word = namedtuple("Word", ["start", "end", "text"])
+
+_model = None
+_model_lock = threading.Lock()
+_load_error = None
+_load_seconds = None
+_slots = threading.BoundedSemaphore(WHISPER_CONCURRENCY)
+_chunk_pool = ThreadPoolExecutor(max_workers=_WORKERS, thread_name_prefix="whisper")
+_active = 0
+_active_lock = threading.Lock()
+
+
+def load_model():
+    """โหลด WhisperModel (ครั้งเดียวต่อ process) — เรียกซ้ำได้ คืน model เดิม"""
+    global _model, _load_error, _load_seconds
+    if _model is not None:
+        return _model
+    with _model_lock:
+        if _model is not None:
+            return _model
+        from faster_whisper import WhisperModel
+        t0 = time.time()
+        print(f"[WHISPER] Loading model {WHISPER_MODEL} ({WHISPER_COMPUTE_TYPE})...")
+        try:
+            _model = WhisperModel(
+                WHISPER_MODEL,
+                device="cpu",
+                compute_type=WHISPER_COMPUTE_TYPE,
+                cpu_threads=_THREADS,
+                num_workers=_WORKERS,
+            )
+        except Exception as e:
+            _load_error = str(e)
+            raise
+        _load_error = None
+        _load_seconds = time.time() - t0
+        print(f"[WHISPER] Model ready in {_load_seconds:.1f}s")
+        return _model
+
+
+def preload():
+    """เริ่มโหลด model ใน background thread ตอน container start — ไม่บล็อก /health"""
+    def _run():
+        try:
+            load_model()
+        except Exception as e:
+            print(f"[WHISPER] Preload failed: {e}")
+    threading.Thread(target=_run, daemon=True).start()
+
+
+def status():
+    """สถานะสำหรับ /health"""
+    return {
+        "model": WHISPER_MODEL,
+        "loaded": _model is not None,
+        "load_seconds": round(_load_seconds, 2) if _load_seconds is not None else None,
+        "error": _load_error,
+        "concurrency": WHISPER_CONCURRENCY,
+        "chunk_workers": WHISPER_CHUNK_WORKERS,
+        "cpu_threads": _THREADS,
+        "active": _active,
+        "batch": batcher.status() if batcher else None,
+    }
+
+
+def voiced_chunks(pcm, sample_rate=24000, parts=1, min_seconds=None):
+    """
+    VAD แบบ energy บน PCM s16le mono → [(start, end)] วินาที เฉพาะช่วงที่มีเสียงพูด
+    ช่วงพูดรวมเป็น chunk ราว (ช่วงพูดทั้งหมด / parts) แต่ไม่สั้นกว่า min_seconds — ตัดตรงช่วงเงียบเท่านั้น
+    """
+    min_seconds = WHISPER_CHUNK_SECONDS if min_seconds is None else min_seconds
+    x = np.frombuffer(pcm[:len(pcm) // 2 * 2], dtype="<i2").astype(np.float32) / 32768.0
+    hop = sample_rate * _VAD_FRAME_MS // 1000
+    n = len(x) // hop
+    if not n:
+        return []
+    db = 20 * np.log10(np.sqrt((x[:n * hop].reshape(n, hop) ** 2).mean(axis=1)) + 1e-9)
+    floor, loud = np.percentile(db, 10), np.percentile(db, 95)
+    voiced = db > max(floor + 0.3 * (loud - floor), -55.0)
+    if not voiced.any():
+        return []
+
+    # ช่วงพูด = run ของเฟรมมีเสียง ที่คั่นด้วยเงียบ ≥ _VAD_MIN_SILENCE_MS
+    edges = np.diff(np.concatenate([[0], voiced.astype(np.int8), [0]]))
+    starts, ends = np.flatnonzero(edges == 1), np.flatnonzero(edges == -1)
+    min_gap = _VAD_MIN_SILENCE_MS // _VAD_FRAME_MS
+    spans = [[starts[0], ends[0]]]
+    for s, e in zip(starts[1:], ends[1:]):
+        if s - spans[-1][1] < min_gap:
+            spans[-1][1] = e
+        else:
+            spans.append([s, e])
+
+    # จำนวน chunk: แบ่งเท่าๆ กันตาม parts แต่ไม่สั้นกว่า min_seconds
+    # และรวม pad สองข้างแล้วไม่ยาวเกินช่อง 30s (ช่องของ BatchQueue — เกินแล้วทั้ง batch ถอดทีละ chunk)
+    pad = _VAD_PAD_MS / 1000
+    max_chunk = _WINDOW - 2 * pad
+    span = (spans[-1][1] - spans[0][0]) * _VAD_FRAME_MS / 1000
+    n_chunks = max(1, min(max(1, parts), int(span // max(min_seconds, 0.1))), -int(-span // max_chunk))
+    # ตัดที่ช่วงเงียบที่ใกล้ตำแหน่งแบ่งเท่าๆ กันที่สุด
+    gaps = [(spans[i][1] + spans[i + 1][0]) / 2 for i in range(len(spans) - 1)]
+    cuts = set()
+    for k in range(1, n_chunks):
+        target = spans[0][0] + (spans[-1][1] - spans[0][0]) * k / n_chunks
+        free = [i for i in range(len(gaps)) if i not in cuts]
+        if free:
+            cuts.add(min(free, key=lambda i: abs(gaps[i] - target)))
+    groups = []     # (ช่วงพูดแรก, ช่วงพูดสุดท้าย) ของแต่ละ chunk
+    first = 0
+    for i in sorted(cuts) + [len(spans) - 1]:
+        groups.append((first, i))
+        first = i + 1
+    # ช่วงเงียบที่ใกล้จุดแบ่งอาจอยู่ห่าง → chunk ยาวเกิน max_chunk: แบ่งซ้ำที่ช่วงเงียบใกล้กึ่งกลาง
+    # (ช่วงพูดต่อเนื่องที่ยาวเกินเองแบ่งไม่ได้)
+    max_frames = max_chunk * 1000 / _VAD_FRAME_MS
+    chunks = []
+    while groups:
+        lo, hi = groups.pop(0)
+        if hi > lo and spans[hi][1] - spans[lo][0] > max_frames:
+            mid = (spans[lo][0] + spans[hi][1]) / 2
+            i = min(range(lo, hi), key=lambda i: abs(gaps[i] - mid))
+            groups[:0] = [(lo, i), (i + 1, hi)]
+        else:
+            chunks.append((spans[lo][0], spans[hi][1]))
+
+    total = len(x) / sample_rate
+    return [(max(0.0, float(s) * _VAD_FRAME_MS / 1000 - pad), min(total, float(e) * _VAD_FRAME_MS / 1000 + pad))
+            for s, e in chunks]
+
+
+def _to_whisper_audio(pcm, sample_rate):
+    """PCM s16le → numpy float32 16kHz (input ที่ faster-whisper ใช้ตรงๆ ไม่ต้อง decode ไฟล์)"""
+    x = np.frombuffer(pcm[:len(pcm) // 2 * 2], dtype="<i2").astype(np.float32) / 32768.0
+    if sample_rate == WHISPER_SAMPLE_RATE or not len(x):
+        return x
+    n = int(len(x) * WHISPER_SAMPLE_RATE / sample_rate)
+    return np.interp(np.arange(n) * (sample_rate / WHISPER_SAMPLE_RATE), np.arange(len(x)), x).astype(np.float32)
+
+
+def _infer(model, audio, language):
+    segments, _info = model.transcribe(audio, language=language, word_timestamps=True)
+    return [Word(w.start, w.end, w.word) for seg in segments for w in seg.words or []]
+
+
+_WINDOW = 30.0      # วินาทีต่อหน้าต่างของ Whisper — ช่องของแต่ละ chunk ใน batch
+
+
+class BatchQueue:
+    """
+    คิว chunk เสียงข้ามงาน → micro-batch (ไม่เกิน max_batch chunk, รอไม่เกิน max_wait นับจาก chunk แรก)
+    ถอดทั้ง batch ใน forward pass เดียว แล้วส่งคำกลับไปยัง Future ของแต่ละ chunk
+    """
+
+    def __init__(self, max_batch=WHISPER_BATCH_SIZE, max_wait=WHISPER_BATCH_WAIT_MS / 1000):
+        self.max_batch = max(1, max_batch)
+        self.max_wait = max_wait
+        self._queue = deque()           # (audio 16kHz, language, Future, เวลาเข้าคิว)
+        self._cond = threading.Condition()
+        self._pipeline = None
+        self._thread = None
+        self.stats = {"batches": 0, "chunks": 0, "fallbacks": 0, "busy_s": 0.0}
+        self._sizes = deque(maxlen=500)
+        self._waits = deque(maxlen=500)
+
+    def submit(self, audio, language="th"):
+        fut = Future()
+        with self._cond:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._loop, daemon=True, name="whisper-batch")
+                self._thread.start()
+            self._queue.append((audio, language, fut, time.monotonic()))
+            self._cond.notify()
+        return fut
+
+    def _take(self):
+        """รอ chunk แรก แล้วรอเพิ่มจนเต็ม batch หรือครบ max_wait — คืน chunk ภาษาเดียวกันชุดหนึ่ง"""
+        with self._cond:
+            while not self._queue:
+                self._cond.wait()
+            deadline = self._queue[0][3] + self.max_wait
+            while len(self._queue) < self.max_batch:
+                left = deadline - time.monotonic()
+                if left <= 0:
+                    break
+                self._cond.wait(left)
+            language = self._queue[0][1]
+            batch, rest = [], deque()
+            while self._queue and len(batch) < self.max_batch:
+                item = self._queue.popleft()
+                if item[1] != language:
+                    rest.append(item)
+                elif item[2].set_running_or_notify_cancel():   # งานที่หมดเวลาแล้ว cancel chunk ทิ้ง → ข้าม
+                    batch.append(item)
+            self._queue.extendleft(reversed(rest))
+            return batch
+
+    def _loop(self):
+        while True:
+            batch = self._take()
+            if not batch:
+                continue
+            started = time.monotonic()
+            try:
+                results = self._run([a for a, _l, _f, _t in batch], batch[0][1])
+            except Exception as e:
+                for _a, _l, fut, _t in batch:
+                    fut.set_exception(e)
+                continue
+            busy = time.monotonic() - started
+            with self._cond:
+                self.stats["batches"] += 1
+                self.stats["chunks"] += len(batch)
+                self.stats["busy_s"] += busy
+                self._sizes.append(len(batch))
+                self._waits.extend(started - t for _a, _l, _f, t in batch)
+            for (_a, _l, fut, _t), words in zip(batch, results):
+                fut.set_result(words)
+
+    def _batched(self, model):
+        if self._pipeline is None:
+            try:
+                from faster_whisper import BatchedInferencePipeline
+            except ImportError:
+                self._pipeline = False
+            else:
+                self._pipeline = BatchedInferencePipeline(model=model)
+        return self._pipeline
+
+    def _run(self, audios, language):
+        """
+        ถอดหลาย chunk พร้อมกัน: วาง chunk ละช่อง 30s ใน audio ยาวเส้นเดียว + clip_timestamps ต่อช่อง
+        → BatchedInferencePipeline ถอดทุกช่องใน batch เดียว แล้วแยกคำกลับตามช่อง
+        """
+        model = load_model()
+        pipeline = self._batched(model)
+        fits = all(len(a) <= _WINDOW * WHISPER_SAMPLE_RATE for a in audios)
+        if len(audios) == 1 or not pipeline or not fits:
+            if len(audios) > 1:
+                with self._cond:
+                    self.stats["fallbacks"] += 1
+            return [_infer(model, a, language) for a in audios]
+
+        slot = int(_WINDOW * WHISPER_SAMPLE_RATE)
+        joined = np.zeros(slot * len(audios), dtype=np.float32)
+        clips = []
+        for i, a in enumerate(audios):
+            joined[i * slot:i * slot + len(a)] = a
+            clips.append({"start": i * _WINDOW, "end": i * _WINDOW + len(a) / WHISPER_SAMPLE_RATE})
+        segments, _info = pipeline.transcribe(joined, language=language, word_timestamps=True,
+                                              batch_size=len(audios), vad_filter=False, clip_timestamps=clips)
+        out = [[] for _ in audios]
+        for seg in segments:
+            for w in seg.words or []:
+                i = min(int(w.start // _WINDOW), len(audios) - 1)
+                out[i].append(Word(w.start - i * _WINDOW, w.end - i * _WINDOW, w.word))
+        return out
+
+    def status(self):
+        with self._cond:
+            sizes, waits = sorted(self._sizes), sorted(self._waits)
+
+            def pct(xs, p):
+                return round(xs[min(len(xs) - 1, int(p * len(xs)))], 3) if xs else None
+            return dict(self.stats, busy_s=round(self.stats["busy_s"], 2), queued=len(self._queue),
+                        max_batch=self.max_batch, max_wait_ms=round(self.max_wait * 1000),
+                        batch_size_avg=round(sum(sizes) / len(sizes), 2) if sizes else None,
+                        batch_size_p95=pct(sizes, 0.95), wait_p50=pct(waits, 0.5), wait_p95=pct(waits, 0.95))
+
+
+batcher = BatchQueue() if WHISPER_BATCH_SIZE > 1 else None
+
+
+def _timed_out():
+    return TimeoutError(f"Whisper transcription timed out (>{WHISPER_TIMEOUT:.0f}s)")
+
+
+def _results(futures, deadline):
+    """
+    รอผลทุก chunk ไม่เกิน deadline — decode ที่ค้างไม่บล็อกงาน (และ executor slot ของงาน) ตลอดไป
+    เกินเวลา → ยกเลิก chunk ที่ยังไม่เริ่ม แล้ว raise TimeoutError (chunk ที่กำลังถอดอยู่หยุดกลางทางไม่ได้)
+    """
+    try:
+        return [f.result(timeout=max(0.0, deadline - time.monotonic())) for f in futures]
+    except FutureTimeout:
+        for f in futures:
+            f.cancel()
+        raise _timed_out()
+
+
+def transcribe_pcm(pcm, sample_rate=24000, language="th"):
+    """
+    ถอดเสียง PCM s16le mono (เสียง TTS ก่อน pad) → list ของ Word เรียงตามเวลา
+    ถอดเฉพาะช่วงที่มีเสียง แบ่ง chunk ตรงช่วงเงียบแล้วถอดพร้อมกัน WHISPER_CHUNK_WORKERS chunk
+    (หรือส่งเข้า BatchQueue ร่วมกับงานอื่นถ้าเปิด WHISPER_BATCH_SIZE)
+    ใช้เวลาเกิน WHISPER_TIMEOUT (รวมรอคิว) → raise TimeoutError
+    """
+    global _active
+    workers = max(1, WHISPER_CHUNK_WORKERS)
+    chunks = voiced_chunks(pcm, sample_rate, parts=workers)
+    if not chunks:
+        return []
+    model = load_model()
+    deadline = time.monotonic() + WHISPER_TIMEOUT
+    if batcher:
+        return _transcribe_batched(pcm, sample_rate, language, chunks, deadline)
+    if not _slots.acquire(timeout=WHISPER_TIMEOUT):
+        raise _timed_out()
+    with _active_lock:
+        _active += 1
+    try:
+        t0 = time.time()
+        bytes_per_sec = sample_rate * 2
+
+        def run(span):
+            a, b = (int(t * bytes_per_sec) // 2 * 2 for t in span)
+            words = _infer(model, _to_whisper_audio(pcm[a:b], sample_rate), language)
+            # เวลาใน chunk → เวลาบนวิดีโอ (เสียงพากย์เริ่มที่วินาทีที่ 0 ของวิดีโอ)
+            return [Word(w.start + span[0], w.end + span[0], w.text) for w in words]
+
+        # รอบละไม่เกิน workers chunk ต่องาน — งานอื่นที่ได้ slot ก็ยังมี worker ของตัวเอง
+        results = []
+        for i in range(0, len(chunks), workers):
+            results.extend(_results([_chunk_pool.submit(run, c) for c in chunks[i:i + workers]], deadline))
+        words = [w for ws in results for w in ws]
+        voiced = sum(b - a for a, b in chunks)
+        print(f"[WHISPER] Transcribed {len(words)} words in {time.time() - t0:.1f}s "
+              f"({len(chunks)} chunks, {voiced:.1f}s voiced of {len(pcm) / bytes_per_sec:.1f}s)")
+        return words
+    finally:
+        with _active_lock:
+            _active -= 1
+        _slots.release()
+
+
+def _transcribe_batched(pcm, sample_rate, language, chunks, deadline):
+    """ส่งทุก chunk เข้าคิว batch แล้วรอผล (ไม่เกิน deadline) — ไม่ถือ _slots (คิวคุมการใช้ model เอง)"""
+    global _active
+    with _active_lock:
+        _active += 1
+    try:
+        t0 = time.time()
+        bytes_per_sec = sample_rate * 2
+        futures = []
+        for start, end in chunks:
+            a, b = (int(t * bytes_per_sec) // 2 * 2 for t in (start, end))
+            futures.append(batcher.submit(_to_whisper_audio(pcm[a:b], sample_rate), language))
+        words = []
+        for (start, _end), chunk_words in zip(chunks, _results(futures, deadline)):
+            words.extend(Word(w.start + start, w.end + start, w.text) for w in chunk_words)
+        print(f"[WHISPER] Transcribed {len(words)} words in {time.time() - t0:.1f}s "
+              f"({len(chunks)} chunks via batch queue)")
+        return words
+    finally:
+        with _active_lock:
+            _active -= 1
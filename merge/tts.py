@@ -0,0 +1,190 @@
+"""
+TTS stage — แบ่ง script เป็นประโยค/วลี แล้วสังเคราะห์ทุกท่อนพร้อมกัน (ผ่าน rate limit ของ gemini.client)
+
+- ตัดที่ขอบประโยค/วลีของภาษาไทย (ช่องว่าง, ! ? … ขึ้นบรรทัดใหม่) รวมวลีสั้นๆ ให้ท่อนละไม่เกิน TTS_SEGMENT_CHARS
+- ท่อนไหนล้มจะ retry เฉพาะท่อนนั้น (retry/backoff ของ gemini.client ต่อ request)
+- ต่อ PCM s16le ของแต่ละท่อนด้วย crossfade สั้นๆ + ช่องว่างระหว่างท่อน
+- คืนเวลาเริ่ม/จบของแต่ละท่อนด้วย — ใช้เป็น timing หยาบของซับได้ฟรี
+- stream(): streaming TTS (streamGenerateContent) — ได้ PCM ทีละ chunk ส่งเข้า ffmpeg stdin ได้ทันที
+
+ENV:
+  TTS_SEGMENT_CHARS  ความยาวสูงสุดต่อท่อน (default 160, 0 = สังเคราะห์ทั้ง script ใน call เดียว)
+  TTS_PARALLEL       จำนวนท่อนที่สังเคราะห์พร้อมกัน (default 4)
+  TTS_GAP_MS         ช่องว่างระหว่างท่อน (default 80)
+  TTS_CROSSFADE_MS   crossfade ตรงรอยต่อ (default 15)
+  TTS_STREAM         งานที่ไม่ burn ซับใช้ streaming TTS ต่อเข้า merge ตรงๆ (default "1", "0" = รอเสียงครบก่อน)
+                     งานที่มีซับยังต้องรอเสียงครบ (เวลาซับมาจาก PCM ทั้งก้อน)
+"""
+import base64
+import os
+import re
+from array import array
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+
+import gemini
+
+TTS_MODEL = "gemini-2.5-flash-preview-tts"
+TTS_VOICE = "Puck"
+SAMPLE_RATE = 24000
+
+TTS_SEGMENT_CHARS = int(os.environ.get("TTS_SEGMENT_CHARS", "160"))
+TTS_PARALLEL = int(os.environ.get("TTS_PARALLEL", "4"))
+TTS_GAP_MS = int(os.environ.get("TTS_GAP_MS", "80"))
+TTS_CROSSFADE_MS = int(os.environ.get("TTS_CROSSFADE_MS", "15"))
+TTS_STREAM = os.environ.get("TTS_STREAM", "1") != "0"
+
+# ท่อนของเสียงพากย์ — เวลาเป็นวินาทีใน PCM ที่ต่อแล้ว
+Segment = namedtuple("Segment", ["start", "end", "text"])
+
+_pool = ThreadPoolExecutor(max_workers=max(1, TTS_PARALLEL), thread_name_prefix="tts")
+
+# ขอบประโยค/วลี: หลังเครื่องหมายจบประโยค หรือช่องว่าง (ภาษาไทยเว้นวรรคระหว่างประโยค/วลี)
+_BOUNDARY_RE = re.compile(r"(?<=[!?.…~])\s*|\s+|\n+")
+_SENTENCE_END = ("!", "?", ".", "…", "~", "ค่ะ", "คะ", "จ้า", "จ๊ะ", "นะ")
+
+
+def cache_tag():
+    """ค่าที่มีผลกับ PCM ที่ได้ — ใส่ใน result cache key"""
+    return f"{TTS_MODEL}:{TTS_VOICE}:seg{TTS_SEGMENT_CHARS}:gap{TTS_GAP_MS}:xf{TTS_CROSSFADE_MS}"
+
+
+def split_script(script, max_chars=None):
+    """
+    แบ่ง script เป็นท่อน ≤ max_chars ตัวอักษร ตัดที่ขอบวลีเท่านั้น
+    ถ้าเลือกได้ จะตัดหลังวลีที่จบประโยค (! ? ค่ะ ...) ก่อนวลีธรรมดา
+    """
+    max_chars = TTS_SEGMENT_CHARS if max_chars is None else max_chars
+    script = script.strip()
+    if not script or max_chars <= 0 or len(script) <= max_chars:
+        return [script] if script else []
+
+    phrases = [p for p in _BOUNDARY_RE.split(script) if p]
+    segments, cur = [], []
+    for phrase in phrases:
+        # วลีเดียวยาวเกิน (ไม่มีเว้นวรรคเลย) — ตัดตรงๆ ดีกว่าส่งท่อนยาว
+        while len(phrase) > max_chars:
+            if cur:
+                segments.append(" ".join(cur))
+                cur = []
+            segments.append(phrase[:max_chars])
+            phrase = phrase[max_chars:]
+        if cur and len(" ".join(cur + [phrase])) > max_chars:
+            # ย้อนไปตัดหลังวลีจบประโยคล่าสุด ถ้าไม่ทำให้ท่อนสั้นเกินครึ่ง
+            cut = len(cur)
+            for i in range(len(cur) - 1, 0, -1):
+                if cur[i - 1].endswith(_SENTENCE_END):
+                    cut = i
+                    break
+            if len(" ".join(cur[:cut])) < max_chars // 2:
+                cut = len(cur)
+            segments.append(" ".join(cur[:cut]))
+            cur = cur[cut:]
+            # ส่วนที่เหลือ + วลีใหม่ยังยาวเกิน → ปิดท่อนที่เหลือไปก่อน
+            if cur and len(" ".join(cur + [phrase])) > max_chars:
+                segments.append(" ".join(cur))
+                cur = []
+        cur.append(phrase)
+    if cur:
+        segments.append(" ".join(cur))
+    return segments
+
+
+def _tts_body(text):
+    return {
+        "contents": [{"parts": [{"text": text}]}],
+        "generationConfig": {
+            "responseModalities": ["AUDIO"],
+            "speechConfig": {"voiceConfig": {"prebuiltVoiceConfig": {"voiceName": TTS_VOICE}}}
+        }
+    }
+
+
+def synthesize_segment(text, api_key):
+    """สังเคราะห์ 1 ท่อน → PCM s16le mono 24kHz (bytes)"""
+    audio_b64, _model = gemini.client.generate(TTS_MODEL, _tts_body(text), api_key, timeout=60, purpose="tts",
+        validate=lambda d: d["candidates"][0]["content"]["parts"][0]["inlineData"]["data"])
+    return base64.b64decode(audio_b64)
+
+
+def _trim_silence(samples, threshold=200):
+    """ตัดความเงียบหัว/ท้ายท่อน (TTS มักเติมมา) — เหลือไว้นิดหน่อยให้ไม่กุด"""
+    keep = SAMPLE_RATE // 50     # 20ms
+    start, end = 0, len(samples)
+    while start < end and abs(samples[start]) < threshold:
+        start += 1
+    while end > start and abs(samples[end - 1]) < threshold:
+        end -= 1
+    return samples[max(0, start - keep):min(len(samples), end + keep)]
+
+
+def concat(pcms, gap_ms=None, crossfade_ms=None):
+    """
+    ต่อ PCM หลายท่อน → (pcm bytes, [(start, end) วินาที ต่อท่อน])
+    ตรงรอยต่อ: fade-out/fade-in สั้นๆ แล้วคั่นด้วยความเงียบ gap_ms (กันเสียงคลิก)
+    """
+    gap = int(SAMPLE_RATE * (TTS_GAP_MS if gap_ms is None else gap_ms) / 1000)
+    fade = int(SAMPLE_RATE * (TTS_CROSSFADE_MS if crossfade_ms is None else crossfade_ms) / 1000)
+    out = array("h")
+    spans = []
+    for i, pcm in enumerate(pcms):
+        samples = array("h")
+        samples.frombytes(pcm[:len(pcm) // 2 * 2])
+        if len(pcms) > 1:
+            samples = _trim_silence(samples)
+        n = min(fade, len(samples) // 2)
+        if i > 0 and n:
+            for k in range(n):
+                samples[k] = samples[k] * k // n
+        if i < len(pcms) - 1 and n:
+            for k in range(n):
+                samples[-1 - k] = samples[-1 - k] * k // n
+        if i > 0:
+            out.extend(array("h", bytes(gap * 2)))
+        start = len(out)
+        out.extend(samples)
+        spans.append((start / SAMPLE_RATE, len(out) / SAMPLE_RATE))
+    return out.tobytes(), spans
+
+
+def synthesize(script, api_key, max_chars=None):
+    """
+    script → (pcm bytes, [Segment]) — ทุกท่อนส่งพร้อมกัน เวลารวม ≈ ท่อนที่ช้าที่สุด
+    ท่อนที่ล้มจน retry หมดแล้ว → raise (งานล้มเหมือน TTS แบบเดิม)
+    """
+    texts = split_script(script, max_chars)
+    if len(texts) <= 1:
+        pcm = synthesize_segment(script, api_key)
+        return pcm, [Segment(0.0, len(pcm) / 2 / SAMPLE_RATE, script)]
+
+    print(f"[TTS] {len(texts)} segments ({', '.join(str(len(t)) for t in texts)} chars)")
+    futures = [_pool.submit(synthesize_segment, t, api_key) for t in texts]
+    pcms = [f.result() for f in futures]
+    pcm, spans = concat(pcms)
+    return pcm, [Segment(s, e, t) for (s, e), t in zip(spans, texts)]
+
+
+def stream(script, api_key, on_audio=None):
+    """
+    streaming TTS → yield PCM s16le mono 24kHz ทีละ chunk (decode base64 ทีละ event)
+    on_audio(seconds): เรียกทุก chunk ด้วยความยาวเสียงที่ได้รับแล้ว
+    """
+    carry = b""         # byte เศษที่ยังไม่ครบ 1 sample — ส่งต่อกับ chunk ถัดไป
+    received = 0
+    for event in gemini.client.stream(TTS_MODEL, _tts_body(script), api_key, timeout=60, purpose="tts_stream"):
+        for cand in event.get("candidates") or []:
+            for part in (cand.get("content") or {}).get("parts") or []:
+                data = (part.get("inlineData") or {}).get("data")
+                if not data:
+                    continue
+                pcm = carry + base64.b64decode(data)
+                cut = len(pcm) // 2 * 2
+                pcm, carry = pcm[:cut], pcm[cut:]
+                if not pcm:
+                    continue
+                received += len(pcm)
+                if on_audio:
+                    on_audio(received / 2 / SAMPLE_RATE)
+                yield pcm
+    if received == 0:
+        raise gemini.GeminiError("TTS stream returned no audio", retryable=True)
@@ -0,0 +1,213 @@
+"""
+XHS (小红书) resolver — ลิงก์ xhslink / xiaohongshu → direct video URL
+
+- cache ต่อ note ID (TTL + LRU) — ลิงก์สั้นคนละตัวที่ชี้ note เดียวกันใช้ผลเดียวกัน
+- single-flight: request พร้อมกันของลิงก์เดียวกันรวมเป็น fetch เดียว
+- อ่าน HTML แบบ stream และหยุดทันทีเมื่อเจอ masterUrl ของ sns-video
+
+ENV:
+  XHS_CACHE_TTL   วินาทีที่เก็บผล resolve (default 600 — URL ของ CDN มีอายุ)
+  XHS_CACHE_SIZE  จำนวน note สูงสุดใน cache (default 512)
+  XHS_BATCH_WORKERS  จำนวน resolve พร้อมกันของ batch (default 8)
+"""
+import codecs
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+from urllib.parse import urlsplit
+
+import http_clients
+
+XHS_CACHE_TTL = float(os.environ.get("XHS_CACHE_TTL", "600"))
+XHS_CACHE_SIZE = int(os.environ.get("XHS_CACHE_SIZE", "512"))
+XHS_BATCH_WORKERS = int(os.environ.get("XHS_BATCH_WORKERS", "8"))
+
+XHS_HEADERS = {
+    # Desktop UA เพื่อให้ได้ clean URL เหมือน Playwright
+    "User-Agent": "Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36",
+    "Accept": "text/html,application/xhtml+xml,application/xml;q=0.9,image/avif,image/webp,image/apng,*/*;q=0.8",
+    "Accept-Language": "zh-CN,zh;q=0.9,en;q=0.8",
+    "Cache-Control": "max-age=0",
+    "Sec-Ch-Ua": '"Not_A Brand";v="8", "Chromium";v="120", "Google Chrome";v="120"',
+    "Sec-Ch-Ua-Mobile": "?0",
+    "Sec-Ch-Ua-Platform": '"macOS"',
+}
+
+MASTER_URL_RE = re.compile(r'"masterUrl"\s*:\s*"([^"]+)"')
+ORIGIN_KEY_RE = re.compile(r'"originVideoKey"\s*:\s*"([^"]+)"')
+VIDEO_URL_RE = re.compile(r'"url"\s*:\s*"(https?://sns-video[^"]+)"')
+NOTE_ID_RE = re.compile(r"/(?:explore|discovery/item|item)/([0-9a-fA-F]{24})")
+
+CHUNK_SIZE = 64 * 1024
+# ต่อท้าย chunk ก่อนหน้าไว้ scan ซ้ำ — กัน pattern ที่ขาดกลางรอยต่อ chunk
+OVERLAP = 4096
+
+
+def note_id(url):
+    """note ID จาก URL ของ xiaohongshu (None ถ้าเป็นลิงก์สั้นที่ยังไม่ได้ follow redirect)"""
+    m = NOTE_ID_RE.search(urlsplit(url).path)
+    return m.group(1).lower() if m else None
+
+
+def normalize(url):
+    """key ของลิงก์ก่อน resolve — note ID ถ้ามี ไม่งั้น host+path (ตัด query/fragment ที่เป็น tracking)"""
+    nid = note_id(url)
+    if nid:
+        return f"note:{nid}"
+    parts = urlsplit(url.strip())
+    return f"link:{parts.netloc.lower()}{parts.path.rstrip('/')}"
+
+
+def _unescape(url):
+    return url.replace("\\u002F", "/")
+
+
+def scan_stream(chunks):
+    """
+    หา video URL จาก HTML ที่ทยอยมาเป็น chunk (bytes)
+    return (video_url หรือ None, วิธีที่เจอ, จำนวน byte ที่อ่าน, หยุดก่อนจบหรือไม่)
+    """
+    decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+    tail = ""
+    fallback, fallback_via = None, None
+    read = 0
+    for chunk in chunks:
+        read += len(chunk)
+        text = tail + decoder.decode(chunk)
+        # Pattern 1: masterUrl (H264 stream - usually clean) — เจอแล้วหยุดอ่านทันที
+        for m in MASTER_URL_RE.finditer(text):
+            cand = _unescape(m.group(1))
+            if "sns-video" in cand:
+                return cand, "masterUrl", read, True
+        # Pattern 2/3 เก็บไว้เป็นตัวสำรอง เผื่อทั้งหน้าไม่มี masterUrl
+        if fallback_via != "originVideoKey":
+            m = ORIGIN_KEY_RE.search(text)
+            if m:
+                fallback, fallback_via = f"https://sns-video-bd.xhscdn.com/{m.group(1)}", "originVideoKey"
+            elif fallback is None:
+                m = VIDEO_URL_RE.search(text)
+                if m:
+                    fallback, fallback_via = _unescape(m.group(1)), "url"
+        tail = text[-OVERLAP:]
+    return fallback, fallback_via, read, False
+
+
+class Resolver:
+    def __init__(self, session=None, ttl=XHS_CACHE_TTL, max_entries=XHS_CACHE_SIZE):
+        self.session = session or http_clients.xhs
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._cache = OrderedDict()     # key → (video_url, expires_at)
+        self._inflight = {}             # key → Future
+        self._lock = threading.Lock()
+        self._pool = None
+        self.stats = {"hits": 0, "misses": 0, "coalesced": 0, "early_stops": 0, "bytes_read": 0}
+
+    def _get_cached(self, key):
+        entry = self._cache.get(key)
+        if entry is None:
+            return None
+        if entry[1] < time.monotonic():
+            del self._cache[key]
+            return None
+        self._cache.move_to_end(key)
+        return entry[0]
+
+    def _store(self, keys, video_url):
+        expires = time.monotonic() + self.ttl
+        for k in keys:
+            self._cache[k] = (video_url, expires)
+            self._cache.move_to_end(k)
+        while len(self._cache) > self.max_entries:
+            self._cache.popitem(last=False)
+
+    def resolve(self, url):
+        """direct video URL ของลิงก์นี้ (None ถ้าไม่พบวิดีโอ) — raise ถ้า fetch ล้มเหลว"""
+        key = normalize(url)
+        with self._lock:
+            cached = self._get_cached(key)
+            if cached is not None:
+                self.stats["hits"] += 1
+                return cached
+            fut = self._inflight.get(key)
+            owner = fut is None
+            if owner:
+                fut = self._inflight[key] = Future()
+                self.stats["misses"] += 1
+            else:
+                self.stats["coalesced"] += 1
+        if not owner:
+            return fut.result()
+
+        try:
+            video_url, keys = self._fetch(url, key)
+        except BaseException as e:
+            with self._lock:
+                self._inflight.pop(key, None)
+            fut.set_exception(e)
+            raise
+        with self._lock:
+            if video_url:
+                # ไม่ cache ผลที่หาไม่เจอ — หน้าอาจยังโหลดไม่ครบ / โดน captcha
+                self._store(keys, video_url)
+            self._inflight.pop(key, None)
+        fut.set_result(video_url)
+        return video_url
+
+    def _fetch(self, url, key):
+        print(f"[XHS] Resolving: {url}")
+        resp = self.session.get(url, headers=XHS_HEADERS, allow_redirects=True, stream=True, timeout=15)
+        try:
+            final_url = resp.url
+            print(f"[XHS] Final URL: {final_url}")
+            keys = [key]
+            nid = note_id(final_url)
+            if nid and f"note:{nid}" != key:
+                # ลิงก์สั้นอีกตัวที่ชี้ note เดียวกันจะเจอ cache ของ note นี้
+                keys.append(f"note:{nid}")
+                with self._lock:
+                    cached = self._get_cached(keys[-1])
+                if cached is not None:
+                    with self._lock:
+                        self._store(keys, cached)
+                    return cached, keys
+
+            video_url, via, read, early = scan_stream(resp.iter_content(chunk_size=CHUNK_SIZE))
+        finally:
+            resp.close()
+
+        with self._lock:
+            self.stats["bytes_read"] += read
+            if early:
+                self.stats["early_stops"] += 1
+        if video_url:
+            print(f"[XHS] Found via {via}: {video_url} (read {read/1024:.0f} KB{', early stop' if early else ''})")
+        else:
+            print(f"[XHS] No video found in HTML (length={read})")
+        return video_url, keys
+
+    def resolve_many(self, urls):
+        """resolve หลายลิงก์พร้อมกัน — คืน list ตามลำดับ: {"url", "video_url"} หรือ {"url", "error"}"""
+        with self._lock:
+            if self._pool is None:
+                self._pool = ThreadPoolExecutor(max_workers=XHS_BATCH_WORKERS, thread_name_prefix="xhs")
+        futures = [self._pool.submit(self.resolve, u) for u in urls]
+        results = []
+        for u, f in zip(urls, futures):
+            try:
+                video_url = f.result()
+                results.append({"url": u, "video_url": video_url} if video_url
+                               else {"url": u, "error": "ไม่พบวิดีโอใน XHS link นี้"})
+            except Exception as e:
+                results.append({"url": u, "error": str(e)})
+        return results
+
+    def status(self):
+        with self._lock:
+            return dict(self.stats, cached=len(self._cache), inflight=len(self._inflight))
+
+
+resolver = Resolver()
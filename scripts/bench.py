@@ -0,0 +1,552 @@
+#!/usr/bin/env python3
+"""
+Benchmark ของ pipeline ในเครื่อง (ใช้โมดูลของ container ใน merge/ ตรงๆ)
+
+ใช้:
+  python scripts/bench.py proxy video.mp4 [--profile 360:2:150k --profile 240:1:80k]
+      เทียบ analysis proxy กับไฟล์ต้นฉบับ: ขนาด, เวลาย่อ, เวลาอัปโหลด, เวลาจน ACTIVE, script ที่ได้
+  python scripts/bench.py storyboard video.mp4 [--frames 8] [--runs 3]
+      latency ของ storyboard mode (เฟรม inline) เทียบกับ Files API (proxy → upload → ACTIVE → script)
+  python scripts/bench.py stream [--text "..."] [--video video.mp4] [--fake]
+      TTS แบบรอทั้งก้อน vs streaming: เวลาจนได้เสียงแรก, เวลารวม (+ merge เข้า ffmpeg ถ้าใส่ --video)
+      --fake = ใช้ scripts/fake_gemini.py แทน API จริง
+  python scripts/bench.py align [fixtures/] [--synthesize | --synthetic [--pauses random]] [--whisper]
+      ซับจาก forced alignment (align.py) vs Whisper (ทั้งคู่จัด block ด้วย thaiseg): เวลาที่ใช้ + error ของเวลาเริ่ม block
+      fixture = <name>.txt (script) + <name>.pcm|.wav (เสียง TTS) + <name>.srt (ซับอ้างอิงที่ตรวจด้วยมือแล้ว, optional)
+      default fixtures = scripts/fixtures/align (ดูผลที่วัดไว้ใน README.md ของโฟลเดอร์นั้น)
+      --synthesize = สร้าง .pcm ของ fixture ที่ยังไม่มีเสียงด้วย TTS จริง
+      --synthetic  = fixture ที่ไม่มีเสียงใช้เสียงพูดสังเคราะห์ที่รู้เวลาจริงทุกคำ (เทียบกับ <name>.synthetic.srt)
+      --pauses random = เสียงสังเคราะห์หยุดตามขอบคำแบบสุ่มแทนที่จะหยุดตรงเว้นวรรค (ไม่ตรงกับสิ่งที่ align สมมติ)
+  python scripts/bench.py batch fixtures/ [--jobs 4] [--size 1 --size 4 --size 8] [--wait-ms 50]
+      งานถอดเสียงพร้อมกันหลายงาน: chunk ขนานต่องาน (size 1) vs คิว batch ข้ามงาน — latency ต่องาน, เวลารวม, ขนาด batch
+  python scripts/bench.py burn video.mp4 [--segments 1 --segments 2 --segments 4] [--runs 1]
+      burn ซับ process เดียว vs แบ่ง segment ที่ keyframe burn ขนาน: เวลา, speedup, จำนวน segment ที่ได้จริง
+"""
+import argparse
+import glob
+import json
+import os
+import re
+import sys
+import tempfile
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(HERE, "..", "merge"))
+sys.path.insert(0, HERE)
+
+import gemini  # noqa: E402
+import align  # noqa: E402
+import media  # noqa: E402
+import thaiseg  # noqa: E402
+import transcribe  # noqa: E402
+import tts  # noqa: E402
+
+
+def _script_range(duration):
+    # ช่วงความยาวเดียวกับ prompt ของ pipeline
+    return max(int(duration * 7), 80), min(int(duration * 10), 800)
+
+
+def gemini_key():
+    from test_pipeline import API_KEY
+    return API_KEY
+
+
+def bench_proxy(args):
+    from test_pipeline import gemini_script
+
+    duration, vw, vh = media.probe(args.video)
+    duration = duration or 15.0
+    lo, hi = _script_range(duration)
+    src_size = os.path.getsize(args.video)
+    print(f"source: {args.video} {vw}x{vh} {duration:.1f}s {src_size/1024/1024:.1f} MB")
+    print(f"target script length: {lo}-{hi} chars\n")
+
+    variants = [("original", None)] + [(p, media.analysis_profile(p)) for p in args.profile]
+    rows = []
+    with tempfile.TemporaryDirectory() as tmpdir:
+        for name, profile in variants:
+            path, t_proxy = args.video, 0.0
+            if profile:
+                t0 = time.time()
+                path = media.make_analysis_proxy(args.video, os.path.join(tmpdir, f"{len(rows)}.mp4"), profile)
+                t_proxy = time.time() - t0
+            size = os.path.getsize(path)
+
+            t0 = time.time()
+            gfile = gemini.files.upload(gemini_key(), path)
+            t_upload = time.time() - t0
+            t0 = time.time()
+            active = gemini.files.wait(gfile, max_wait=300, interval=1)
+            t_active = time.time() - t0
+            t0 = time.time()
+            script, title, category = gemini_script(gfile.uri, duration) if active else ("", "", "")
+            t_script = time.time() - t0
+            gemini.files.delete(gfile)
+
+            rows.append((name, size, t_proxy, t_upload, t_active, t_script, script, title, category))
+
+    print(f"\n{'variant':<14}{'size MB':>9}{'ratio':>8}{'proxy s':>9}{'upload s':>10}{'active s':>10}"
+          f"{'script s':>10}{'total s':>9}{'chars':>7}")
+    for name, size, t_proxy, t_upload, t_active, t_script, script, _t, _c in rows:
+        total = t_proxy + t_upload + t_active + t_script
+        flag = "" if lo <= len(script) <= hi else " *"
+        print(f"{name:<14}{size/1024/1024:>9.2f}{src_size/size:>7.1f}x{t_proxy:>9.1f}{t_upload:>10.1f}"
+              f"{t_active:>10.1f}{t_script:>10.1f}{total:>9.1f}{len(script):>7}{flag}")
+    print("(* = ความยาว script อยู่นอกช่วงที่ prompt ขอ)\n")
+
+    # คุณภาพ script ต้องอ่านเทียบเอง — พิมพ์ของแต่ละแบบไว้ข้างกัน
+    for name, *_rest, script, title, category in rows:
+        print(f"── {name} ── [{category}] {title}\n{script}\n")
+
+
+def _storyboard_script(parts):
+    """generateContent ของ script จาก content parts (ไฟล์หรือ storyboard) — request เดียวกันทั้งสองโหมด"""
+    from test_pipeline import MODEL, PROMPT
+
+    data, _model = gemini.client.generate(MODEL, {"contents": [{"parts": parts + [{"text": PROMPT}]}]},
+                                          gemini_key(), timeout=120, purpose="bench_script",
+                                          validate=gemini.require_text)
+    text = gemini.response_text(data).replace("```json", "").replace("```", "").strip()
+    try:
+        return json.loads(text).get("thai_script", "")
+    except ValueError:
+        return text
+
+
+def bench_storyboard(args):
+    duration, vw, vh = media.probe(args.video)
+    duration = duration or 15.0
+    profile = media.analysis_profile()
+    print(f"source: {args.video} {vw}x{vh} {duration:.1f}s, frames={args.frames}, proxy={profile and profile['name']}\n")
+
+    rows = {"file": [], "storyboard": []}
+    for run in range(args.runs):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            # ── Files API path ──
+            t0 = time.time()
+            path = args.video
+            if profile:
+                path = media.make_analysis_proxy(args.video, os.path.join(tmpdir, "proxy.mp4"), profile)
+            t_prep = time.time() - t0
+            # ไม่ให้ใช้ไฟล์จากรอบก่อน — เทียบแบบ cold ทุกรอบ
+            gfile = gemini.files.upload(gemini_key(), path, sha256=f"bench-{time.time()}")
+            gemini.files.wait(gfile, max_wait=300, interval=1)
+            t_ready = time.time() - t0
+            script = _storyboard_script(gemini.video_parts(gfile.uri))
+            rows["file"].append((t_prep, t_ready - t_prep, time.time() - t0, len(script)))
+            gemini.files.delete(gfile)
+
+            # ── storyboard path ──
+            t0 = time.time()
+            frames = media.extract_storyboard(args.video, tmpdir, n=args.frames, duration=duration)
+            t_prep = time.time() - t0
+            kb = sum(len(j) for _t, j in frames) / 1024
+            script = _storyboard_script(gemini.storyboard_parts(frames, duration))
+            rows["storyboard"].append((t_prep, 0.0, time.time() - t0, len(script)))
+            print(f"run {run + 1}: file {rows['file'][-1][2]:.1f}s, storyboard {rows['storyboard'][-1][2]:.1f}s "
+                  f"({len(frames)} frames, {kb:.0f} KB)")
+
+    print(f"\n{'mode':<12}{'prep s':>8}{'upload+active s':>17}{'total s':>9}{'chars':>7}   (ค่าเฉลี่ย {args.runs} รอบ)")
+    for mode, rs in rows.items():
+        avg = [sum(r[i] for r in rs) / len(rs) for i in range(4)]
+        print(f"{mode:<12}{avg[0]:>8.1f}{avg[1]:>17.1f}{avg[2]:>9.1f}{avg[3]:>7.0f}")
+
+
+def bench_stream(args):
+    api_key = "fake"
+    if args.fake:
+        import fake_gemini
+        _server, gemini.API_BASE = fake_gemini.serve(seconds=args.seconds)
+        print(f"fake Gemini: {gemini.API_BASE} ({args.seconds}s PCM)")
+    else:
+        api_key = gemini_key()
+    duration = media.probe(args.video)[0] if args.video else None
+
+    rows = []
+    for run in range(args.runs):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            # ── แบบเดิม: รอ TTS ครบ แล้วค่อยเริ่ม ffmpeg ──
+            t0 = time.time()
+            pcm = tts.synthesize_segment(args.text, api_key)
+            t_audio = time.time() - t0
+            if args.video:
+                media.merge(args.video, pcm, os.path.join(tmpdir, "blocking.mp4"), duration or 15.0)
+            rows.append(("blocking", t_audio, time.time() - t0, len(pcm)))
+
+            # ── streaming: ffmpeg กิน PCM ทีละ chunk ──
+            first = []
+            t0 = time.time()
+
+            def on_audio(_seconds):
+                if not first:
+                    first.append(time.time() - t0)
+
+            size = [0]
+
+            def chunks():
+                for chunk in tts.stream(args.text, api_key, on_audio=on_audio):
+                    size[0] += len(chunk)
+                    yield chunk
+
+            if args.video:
+                media.merge(args.video, chunks(), os.path.join(tmpdir, "stream.mp4"), duration or 15.0)
+            else:
+                for _chunk in chunks():
+                    pass
+            rows.append(("stream", first[0] if first else 0.0, time.time() - t0, size[0]))
+            print(f"run {run + 1}: blocking {rows[-2][2]:.2f}s, stream {rows[-1][2]:.2f}s "
+                  f"(first audio {rows[-1][1]:.2f}s)")
+
+    print(f"\n{'mode':<10}{'first audio s':>15}{'total s':>9}{'audio s':>9}   (ค่าเฉลี่ย {args.runs} รอบ"
+          f"{', รวม merge' if args.video else ''})")
+    for mode in ("blocking", "stream"):
+        rs = [r for r in rows if r[0] == mode]
+        avg = [sum(r[i] for r in rs) / len(rs) for i in (1, 2, 3)]
+        print(f"{mode:<10}{avg[0]:>15.2f}{avg[1]:>9.2f}{avg[2] / 2 / tts.SAMPLE_RATE:>9.1f}")
+
+
+_SRT_BLOCK_RE = re.compile(r"(\d+):(\d+):(\d+)[,.](\d+)\s*-->.*\n(.+)")
+
+
+def _srt_starts(srt, script):
+    """SRT → [(ตำแหน่งตัวอักษรใน script ที่ตัดช่องว่างแล้ว, เวลาเริ่ม)] — block ที่หาใน script ไม่เจอข้ามไป"""
+    flat = re.sub(r"\s+", "", script)
+    out, cursor = [], 0
+    for h, m, sec, ms, text in _SRT_BLOCK_RE.findall(srt):
+        text = re.sub(r"\s+", "", text)
+        pos = flat.find(text[:6], cursor) if text else -1
+        if pos < 0:
+            continue
+        out.append((pos, int(h) * 3600 + int(m) * 60 + int(sec) + int(ms) / 1000))
+        cursor = pos + 1
+    return out
+
+
+def _time_at(starts, total, offset):
+    """เวลาที่ตัวอักษรที่ offset ถูกพูด — interpolate ระหว่างเวลาเริ่มของ block ถัดกัน"""
+    for i, (pos, t) in enumerate(starts):
+        nxt_pos, nxt_t = starts[i + 1] if i + 1 < len(starts) else (total, None)
+        if pos <= offset < nxt_pos:
+            if nxt_t is None:
+                return t
+            return t + (nxt_t - t) * (offset - pos) / max(nxt_pos - pos, 1)
+    return None
+
+
+def _start_error(srt, ref, script):
+    """mean / max |error| ของเวลาเริ่มแต่ละ block ใน ref เทียบกับ srt (วินาที)"""
+    errs = []
+    starts, total = _srt_starts(srt, script), len(re.sub(r"\s+", "", script))
+    for pos, t in _srt_starts(ref, script):
+        got = _time_at(starts, total, pos)
+        if got is not None:
+            errs.append(abs(got - t))
+    return (sum(errs) / len(errs), max(errs)) if errs else (None, None)
+
+
+def _load_pcm(base):
+    if os.path.exists(base + ".pcm"):
+        with open(base + ".pcm", "rb") as f:
+            return f.read()
+    if os.path.exists(base + ".wav"):
+        import wave
+        with wave.open(base + ".wav", "rb") as w:
+            if w.getframerate() != 24000 or w.getsampwidth() != 2 or w.getnchannels() != 1:
+                raise ValueError(f"{base}.wav ต้องเป็น s16le mono 24kHz")
+            return w.readframes(w.getnframes())
+    return None
+
+
+def _whisper_srt(pcm, script):
+    """path Whisper ของ pipeline: เวลาของคำจาก Whisper → thaiseg จัด block ตาม script"""
+    words = transcribe.transcribe_pcm(pcm, sample_rate=24000, language="th")
+    return thaiseg.to_srt(script, words)
+
+
+FIXTURES_DIR = os.path.join(HERE, "fixtures", "align")
+
+
+def _synthetic_speech(script, seed=0, sample_rate=24000, pauses="spaces"):
+    """
+    เสียงพูดสังเคราะห์ที่รู้เวลาจริงของทุกคำ — วัด align ได้โดยไม่ต้องมี TTS / ซับที่ตรวจด้วยมือ
+    คำละช่วงเสียง (harmonic + envelope ตามพยางค์ มีช่วงเบาแบบพยัญชนะกัก), ระหว่างคำห่าง 0–40ms,
+    noise พื้นหลังเบาๆ — ความเร็วพูด ~13 ตัวอักษร/วินาที แบบ TTS
+    pauses: "spaces" = หยุด 150–450ms ตรงเว้นวรรคทุกที่ (กรณีดีที่สุดของ align — ตรงกับสิ่งที่ align สมมติ)
+            "random" = หยุดตามขอบคำแบบสุ่ม ไม่สัมพันธ์กับเว้นวรรค (เว้นวรรคห่างแค่ 0–40ms เหมือนขอบคำอื่น)
+    return (pcm bytes, [transcribe.Word] เวลาจริง)
+    """
+    import numpy as np
+
+    rng = np.random.default_rng(seed)
+    pieces, words = [], []
+    t = 0.25
+
+    def silence(seconds):
+        pieces.append(np.zeros(int(seconds * sample_rate)))
+
+    def pause():
+        gap = rng.uniform(0.15, 0.45)
+        silence(gap)
+        return gap
+
+    silence(t)
+    for tok in thaiseg.tokenize(script):
+        if tok == " ":
+            t += pause() if pauses == "spaces" else 0.0
+            continue
+        chars = thaiseg.width(tok)
+        if not any(ch.isalnum() for ch in tok):
+            # เครื่องหมาย — ไม่ออกเสียง
+            words.append(transcribe.Word(t, t, tok))
+            continue
+        dur = chars * 0.075 * rng.uniform(0.8, 1.25) + (0.15 if any(ch.isdigit() for ch in tok) else 0.0)
+        n = int(dur * sample_rate)
+        x = np.arange(n) / sample_rate
+        f0 = rng.uniform(170, 230) * (1 + 0.05 * np.sin(2 * np.pi * 3 * x))
+        phase = 2 * np.pi * np.cumsum(f0) / sample_rate
+        voice = sum(np.sin(k * phase) / k for k in range(1, 6))
+        syllables = max(1, round(chars / 2.5))
+        env = 0.55 + 0.45 * np.abs(np.sin(np.pi * syllables * x / dur))
+        for _ in range(syllables - 1):
+            # พยัญชนะกัก: เบาลงเกือบเงียบ 15–35ms กลางคำ
+            c = int(rng.uniform(0.2, 0.8) * n)
+            env[c:c + int(rng.uniform(0.015, 0.035) * sample_rate)] *= 0.05
+        ramp = min(n // 4, int(0.01 * sample_rate))
+        env[:ramp] *= np.linspace(0, 1, ramp)
+        env[n - ramp:] *= np.linspace(1, 0, ramp)
+        pieces.append(voice * env * rng.uniform(0.6, 1.0) * 6000)
+        words.append(transcribe.Word(t, t + dur, tok))
+        t += dur
+        gap = rng.uniform(0.0, 0.04)
+        silence(gap)
+        t += gap
+        if pauses == "random" and rng.random() < 0.2:
+            t += pause()
+    silence(0.3)
+    audio = np.concatenate(pieces)
+    audio += rng.normal(0, 30, len(audio))
+    return np.clip(audio, -32768, 32767).astype("<i2").tobytes(), words
+
+
+def bench_align(args):
+    fixtures = sorted(os.path.splitext(p)[0] for p in glob.glob(os.path.join(args.fixtures, "*.txt")))
+    if not fixtures:
+        sys.exit(f"ไม่มี fixture (*.txt) ใน {args.fixtures}")
+    if args.synthetic and args.synthesize:
+        sys.exit("เลือกอย่างใดอย่างหนึ่ง: --synthetic หรือ --synthesize")
+
+    rows = []
+    for base in fixtures:
+        name = os.path.basename(base)
+        with open(base + ".txt", encoding="utf-8") as f:
+            script = f.read().strip()
+        pcm = _load_pcm(base)
+        if pcm is None and args.synthesize:
+            pcm, _segments = tts.synthesize(script, gemini_key())
+            with open(base + ".pcm", "wb") as f:
+                f.write(pcm)
+        ref = None
+        if pcm is None and args.synthetic:
+            # เสียงสังเคราะห์ + ซับอ้างอิงจากเวลาจริง (block เดียวกับที่ thaiseg จัด) — seed คงที่ต่อ fixture
+            pcm, truth = _synthetic_speech(script, seed=sum(name.encode()), pauses=args.pauses)
+            ref = thaiseg.to_srt(script, truth)
+            ref_path = base + ".synthetic.srt"
+            if args.pauses != "spaces":
+                ref_path = base + f".synthetic-{args.pauses}.srt"
+            elif os.path.exists(ref_path):
+                with open(ref_path, encoding="utf-8") as f:
+                    if f.read() != ref:
+                        print(f"{name}: {ref_path} ไม่ตรงกับเสียงสังเคราะห์ปัจจุบัน (thaiseg/คลังคำเปลี่ยน?) — ใช้ --dump เขียนใหม่")
+            if args.dump:
+                with open(ref_path, "w", encoding="utf-8") as f:
+                    f.write(ref)
+        if pcm is None:
+            print(f"{name}: ไม่มีเสียง (.pcm/.wav) — ข้าม (ใช้ --synthesize หรือ --synthetic)")
+            continue
+        if ref is None and os.path.exists(base + ".srt"):
+            with open(base + ".srt", encoding="utf-8") as f:
+                ref = f.read()
+
+        results = {}
+        t0 = time.time()
+        results["align"] = (align.to_srt(pcm, script), time.time() - t0)
+        if args.whisper:
+            t0 = time.time()
+            results["whisper"] = (_whisper_srt(pcm, script), time.time() - t0)
+        if args.dump:
+            for method, (srt, _el) in results.items():
+                with open(f"{base}.{method}.srt", "w", encoding="utf-8") as f:
+                    f.write(srt)
+
+        audio_s = len(pcm) / 2 / 24000
+        for method, (srt, elapsed) in results.items():
+            mean_err, max_err = _start_error(srt, ref, script) if ref else (None, None)
+            if mean_err is None and method != "align" and "align" in results:
+                # ไม่มีซับอ้างอิง → เทียบกันเองระหว่างสองวิธี
+                mean_err, max_err = _start_error(srt, results["align"][0], script)
+            blocks = srt.count("-->")
+            rows.append((name, method, audio_s, elapsed, blocks, mean_err, max_err))
+
+    print(f"\n{'fixture':<16}{'method':<16}{'audio s':>8}{'time s':>9}{'blocks':>8}{'mean err':>10}{'max err':>9}")
+    for name, method, audio_s, elapsed, blocks, mean_err, max_err in rows:
+        me = f"{mean_err:.3f}" if mean_err is not None else "-"
+        mx = f"{max_err:.3f}" if max_err is not None else "-"
+        print(f"{name:<16}{method:<16}{audio_s:>8.1f}{elapsed:>9.3f}{blocks:>8}{me:>10}{mx:>9}")
+    print("(err = |เวลาเริ่ม block ของซับอ้างอิง − เวลาที่วิธีนั้นให้ ณ ตัวอักษรเดียวกัน| วินาที; "
+          "ไม่มี .srt → whisper เทียบกับ align)")
+
+
+def bench_batch(args):
+    import threading
+
+    pcms = [p for p in (_load_pcm(os.path.splitext(t)[0])
+                        for t in sorted(glob.glob(os.path.join(args.fixtures, "*.txt")))) if p]
+    if not pcms:
+        sys.exit(f"ไม่มีเสียง fixture (.pcm/.wav) ใน {args.fixtures}")
+    transcribe.load_model()
+    print(f"{len(pcms)} fixtures, {args.jobs} งานพร้อมกัน, whisper workers={transcribe._WORKERS} "
+          f"threads={transcribe._THREADS}\n")
+
+    print(f"{'batch':>6}{'wait ms':>9}{'total s':>9}{'job p50 s':>11}{'job max s':>11}{'avg batch':>11}{'wait p95':>10}")
+    for size in args.size:
+        transcribe.batcher = transcribe.BatchQueue(size, args.wait_ms / 1000) if size > 1 else None
+        latencies = []
+
+        def job(i):
+            t0 = time.time()
+            transcribe.transcribe_pcm(pcms[i % len(pcms)])
+            latencies.append(time.time() - t0)
+
+        t0 = time.time()
+        threads = [threading.Thread(target=job, args=(i,)) for i in range(args.jobs)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        total = time.time() - t0
+        latencies.sort()
+        st = transcribe.batcher.status() if transcribe.batcher else {}
+        print(f"{size:>6}{args.wait_ms:>9.0f}{total:>9.2f}{latencies[len(latencies) // 2]:>11.2f}{latencies[-1]:>11.2f}"
+              f"{st.get('batch_size_avg') or '-':>11}{st.get('wait_p95') or '-':>10}")
+    print("(batch 1 = ไม่ใช้คิว: chunk ขนานต่องานตาม WHISPER_CHUNK_WORKERS, งานต่อคิว WHISPER_CONCURRENCY)")
+
+
+_BENCH_CAPTIONS = ["ของมันต้องมีติดบ้าน", "ใช้ง่ายมากเลยค่ะ", "ราคาถูกสุดๆ", "กดสั่งได้ที่ตะกร้าเลย"]
+
+
+def _bench_ass(path, duration, vw, vh):
+    """ASS ทดสอบ — สไตล์ใกล้ของจริง (ตัวใหญ่ ขอบหนา) ซับเปลี่ยนทุก 1.5 วินาทีตลอดคลิป"""
+    def ts(t):
+        cs = int(round(t * 100))
+        return f"{cs // 360000}:{cs // 6000 % 60:02d}:{cs // 100 % 60:02d}.{cs % 100:02d}"
+
+    lines = [
+        "[Script Info]", "ScriptType: v4.00+", f"PlayResX: {vw}", f"PlayResY: {vh}", "",
+        "[V4+ Styles]",
+        "Format: Name, Fontname, Fontsize, PrimaryColour, OutlineColour, BorderStyle, Outline, Alignment, MarginV",
+        f"Style: Default,FC Iconic,{max(50, int(vw * 0.115))},&H00FFFFFF,&H00000000,1,10,2,250", "",
+        "[Events]", "Format: Layer, Start, End, Style, Text",
+    ]
+    t, i = 0.0, 0
+    while t < duration:
+        lines.append(f"Dialogue: 0,{ts(t)},{ts(min(t + 1.4, duration))},Default,{_BENCH_CAPTIONS[i % len(_BENCH_CAPTIONS)]}")
+        t, i = t + 1.5, i + 1
+    with open(path, "w", encoding="utf-8") as f:
+        f.write("\n".join(lines) + "\n")
+
+
+def bench_burn(args):
+    duration, vw, vh = media.probe(args.video)
+    if not duration:
+        sys.exit(f"อ่านความยาวของ {args.video} ไม่ได้")
+    keys = media.keyframes(args.video)
+    print(f"source: {args.video} {vw}x{vh} {duration:.1f}s, {len(keys)} keyframes, {os.cpu_count()} CPU\n")
+    pcm = bytes(int(duration * 24000) * 2)
+    fontsdir = os.path.join(HERE, "..", "merge")
+
+    print(f"{'segments':>9}{'used':>6}{'time s':>9}{'speedup':>9}{'output s':>10}")
+    base = None
+    for n in args.segments:
+        times, used = [], 1
+        for _run in range(args.runs):
+            with tempfile.TemporaryDirectory() as tmpdir:
+                ass_path = os.path.join(tmpdir, "subtitles.ass")
+                _bench_ass(ass_path, duration, vw, vh)
+                out = os.path.join(tmpdir, "output.mp4")
+                t0 = time.time()
+                if n > 1:
+                    used = media.merge_segmented(args.video, pcm, out, duration, n, ass_path=ass_path,
+                                                 fontsdir=fontsdir, thumb_path=os.path.join(tmpdir, "thumb.webp"))
+                else:
+                    media.merge(args.video, pcm, out, duration, ass_path=ass_path, fontsdir=fontsdir,
+                                thumb_path=os.path.join(tmpdir, "thumb.webp"), segments=1)
+                times.append(time.time() - t0)
+                out_duration = media.probe(out)[0] or 0.0
+        avg = sum(times) / len(times)
+        base = base or avg
+        print(f"{n:>9}{used:>6}{avg:>9.2f}{base / avg:>8.2f}x{out_duration:>10.2f}")
+    print("(used = segment ที่ได้จริงหลังเลือกจุดตัดที่ keyframe; GOP ยาว/คลิปสั้นได้น้อยกว่าที่ขอ)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    sub = parser.add_subparsers(dest="cmd", required=True)
+
+    p = sub.add_parser("proxy", help="analysis proxy vs ไฟล์ต้นฉบับ")
+    p.add_argument("video")
+    p.add_argument("--profile", action="append", default=None,
+                   help="short_side:fps:bitrate (ใส่ได้หลายครั้ง, default ANALYSIS_PROXY)")
+    p.set_defaults(fn=bench_proxy)
+
+    p = sub.add_parser("storyboard", help="storyboard mode vs Files API")
+    p.add_argument("video")
+    p.add_argument("--frames", type=int, default=8)
+    p.add_argument("--runs", type=int, default=3)
+    p.set_defaults(fn=bench_storyboard)
+
+    p = sub.add_parser("stream", help="streaming TTS vs TTS ทั้งก้อน")
+    p.add_argument("--text", default="สวัสดีค่ะ วันนี้มาดูของดีราคาถูกกัน ใช้ง่ายมาก คุ้มสุดๆ ต้องมีติดบ้านไว้เลยนะคะ")
+    p.add_argument("--video", default=None, help="ต่อเสียงเข้า media.merge ด้วย (ต้องมี ffmpeg)")
+    p.add_argument("--runs", type=int, default=3)
+    p.add_argument("--fake", action="store_true", help="ใช้ fake_gemini stand-in server")
+    p.add_argument("--seconds", type=float, default=10.0, help="ความยาวเสียงของ --fake")
+    p.set_defaults(fn=bench_stream)
+
+    p = sub.add_parser("align", help="forced alignment vs Whisper")
+    p.add_argument("fixtures", nargs="?", default=FIXTURES_DIR, help="โฟลเดอร์ fixture (default scripts/fixtures/align)")
+    p.add_argument("--synthesize", action="store_true", help="สร้างเสียงของ fixture ที่ยังไม่มีด้วย TTS")
+    p.add_argument("--synthetic", action="store_true", help="fixture ที่ไม่มีเสียงใช้เสียงพูดสังเคราะห์ที่รู้เวลาจริง")
+    p.add_argument("--pauses", choices=["spaces", "random"], default="spaces",
+                   help="ตำแหน่งช่วงหยุดของ --synthetic: ตรงเว้นวรรค (default) หรือสุ่มตามขอบคำ")
+    p.add_argument("--whisper", action="store_true", help="รัน Whisper เทียบด้วย (ต้องมี faster-whisper)")
+    p.add_argument("--dump", action="store_true", help="เขียน <name>.<method>.srt ไว้ตรวจด้วยตา")
+    p.set_defaults(fn=bench_align)
+
+    p = sub.add_parser("batch", help="คิว batch ถอดเสียงข้ามงาน")
+    p.add_argument("fixtures", help="โฟลเดอร์ fixture (ใช้แค่ไฟล์เสียง)")
+    p.add_argument("--jobs", type=int, default=4)
+    p.add_argument("--size", type=int, action="append", default=None, help="ขนาด batch (ใส่ได้หลายครั้ง)")
+    p.add_argument("--wait-ms", type=float, default=50.0)
+    p.set_defaults(fn=bench_batch)
+
+    p = sub.add_parser("burn", help="burn ซับ process เดียว vs แบ่ง segment ขนาน")
+    p.add_argument("video")
+    p.add_argument("--segments", type=int, action="append", default=None,
+                   help="จำนวน segment (ใส่ได้หลายครั้ง, 1 = process เดียว)")
+    p.add_argument("--runs", type=int, default=1)
+    p.set_defaults(fn=bench_burn)
+
+    args = parser.parse_args()
+    if getattr(args, "profile", "") is None:
+        args.profile = [media.ANALYSIS_PROXY]
+    if getattr(args, "size", "") is None:
+        args.size = [1, 4, 8]
+    if getattr(args, "segments", "") is None:
+        args.segments = [1, 2, 4, 8]
+    args.fn(args)
+
+
+if __name__ == "__main__":
+    main()
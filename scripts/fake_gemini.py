@@ -0,0 +1,108 @@
+#!/usr/bin/env python3
+"""
+Gemini stand-in ในเครื่อง — ตอบ TTS ด้วย PCM สำเร็จรูป (sine 24kHz) ไม่ต้องใช้ API key / quota
+
+- :generateContent        → PCM ทั้งก้อนใน response เดียว (เหมือน TTS แบบเดิม)
+- :streamGenerateContent  → SSE ส่ง PCM ทีละ chunk ห่างกัน --interval วินาที (จำลองเสียงที่ทยอยมา)
+
+ใช้:
+  python scripts/fake_gemini.py [--port 8765] [--seconds 10] [--chunk-ms 500] [--interval 0.2]
+  GEMINI_API_BASE=http://127.0.0.1:8765 python scripts/bench.py stream --text "..."
+"""
+import argparse
+import base64
+import json
+import math
+import re
+import threading
+import time
+from array import array
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+SAMPLE_RATE = 24000
+PATH_RE = re.compile(r"^/v1beta/models/([^/:]+):(generateContent|streamGenerateContent)")
+
+
+def sine_pcm(seconds, freq=220.0):
+    """PCM s16le mono 24kHz ของ sine — ค่าเดิมทุกครั้ง เทียบผลได้"""
+    n = int(SAMPLE_RATE * seconds)
+    return array("h", (int(8000 * math.sin(2 * math.pi * freq * i / SAMPLE_RATE)) for i in range(n))).tobytes()
+
+
+def _audio_event(pcm):
+    return {"candidates": [{"content": {"parts": [{"inlineData": {
+        "mimeType": f"audio/L16;codec=pcm;rate={SAMPLE_RATE}",
+        "data": base64.b64encode(pcm).decode()}}]}}]}
+
+
+class Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    pcm = b""
+    chunk_bytes = SAMPLE_RATE
+    interval = 0.2
+    first_delay = 0.3
+
+    def log_message(self, fmt, *args):
+        pass
+
+    def do_POST(self):
+        m = PATH_RE.match(self.path)
+        self.rfile.read(int(self.headers.get("Content-Length") or 0))
+        if not m:
+            self.send_error(404)
+            return
+        time.sleep(self.first_delay)
+        # chunk ขนาดคี่ (ไม่ลง sample) โดยตั้งใจ — ฝั่ง client ต้องต่อ byte เศษเองได้
+        step = self.chunk_bytes | 1
+        if m.group(2) == "generateContent":
+            # แบบไม่ stream ต้องรอให้ "สังเคราะห์" ครบทุก chunk ก่อนตอบ — เวลารวมเท่ากับแบบ stream
+            time.sleep(self.interval * math.ceil(len(self.pcm) / step))
+            body = json.dumps(_audio_event(self.pcm)).encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+            return
+
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        for off in range(0, len(self.pcm), step):
+            data = f"data: {json.dumps(_audio_event(self.pcm[off:off + step]))}\r\n\r\n".encode()
+            self.wfile.write(f"{len(data):x}\r\n".encode() + data + b"\r\n")
+            self.wfile.flush()
+            time.sleep(self.interval)
+        self.wfile.write(b"0\r\n\r\n")
+
+
+def serve(port=0, seconds=10.0, chunk_ms=500, interval=0.2, first_delay=0.3):
+    """เปิด server ใน background thread — return (server, base_url)"""
+    Handler.pcm = sine_pcm(seconds)
+    Handler.chunk_bytes = SAMPLE_RATE * 2 * chunk_ms // 1000
+    Handler.interval = interval
+    Handler.first_delay = first_delay
+    server = ThreadingHTTPServer(("127.0.0.1", port), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_address[1]}"
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--seconds", type=float, default=10.0, help="ความยาวเสียงที่ตอบ")
+    parser.add_argument("--chunk-ms", type=int, default=500, help="ความยาวเสียงต่อ SSE event")
+    parser.add_argument("--interval", type=float, default=0.2, help="หน่วงระหว่าง event (วินาที)")
+    parser.add_argument("--first-delay", type=float, default=0.3, help="หน่วงก่อนตอบ (วินาที)")
+    args = parser.parse_args()
+    server, url = serve(args.port, args.seconds, args.chunk_ms, args.interval, args.first_delay)
+    print(f"fake Gemini on {url} ({args.seconds}s PCM, {args.chunk_ms}ms/event every {args.interval}s)")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,10 @@
+"""
+โมดูลของ container อยู่ใน merge/ แบบ flat (import gemini, import tts, ...) — ให้ test import ได้แบบเดียวกัน
+scripts/ ใส่ไว้ด้วยสำหรับ stand-in server (fake_gemini)
+"""
+import os
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, "merge"))
+sys.path.insert(0, os.path.join(ROOT, "scripts"))
@@ -0,0 +1,40 @@
+"""
+align.py กับเสียงพูดสังเคราะห์ที่รู้เวลาจริง (fixture เดียวกับ bench.py align --synthetic)
+
+เสียงที่ใช้วัดหยุดตามขอบคำแบบสุ่ม ไม่ตรงเว้นวรรคของ script (pauses="random") — ถ้าหยุดตรงเว้นวรรค
+align จะได้คำตอบจากช่วงเงียบโดยตรง (error ~10ms) ซึ่งไม่บอกอะไรเกี่ยวกับเสียง TTS จริง
+"""
+import glob
+import os
+
+import pytest
+
+import align
+import bench
+import thaiseg
+
+FIXTURES = sorted(glob.glob(os.path.join(bench.FIXTURES_DIR, "*.txt")))
+
+
+def _load(path):
+    with open(path, encoding="utf-8") as f:
+        return f.read().strip()
+
+
+@pytest.mark.parametrize("path", FIXTURES, ids=lambda p: os.path.basename(p)[:-4])
+def test_synthetic_reference_is_current(path):
+    name = os.path.basename(path)[:-4]
+    _pcm, truth = bench._synthetic_speech(_load(path), seed=sum(name.encode()))
+    with open(path[:-4] + ".synthetic.srt", encoding="utf-8") as f:
+        assert f.read() == thaiseg.to_srt(_load(path), truth)
+
+
+@pytest.mark.parametrize("path", FIXTURES, ids=lambda p: os.path.basename(p)[:-4])
+def test_align_with_pauses_off_the_spaces(path):
+    name, script = os.path.basename(path)[:-4], _load(path)
+    pcm, truth = bench._synthetic_speech(script, seed=sum(name.encode()), pauses="random")
+    ref = thaiseg.to_srt(script, truth)
+
+    mean_err, max_err = bench._start_error(align.to_srt(pcm, script), ref, script)
+    # ค่าที่วัดได้ตอนนี้ (README ของ fixture): mean 0.21–0.72s, max 0.50–1.60s — กันไม่ให้แย่ลงอีก
+    assert mean_err < 0.8 and max_err < 1.8
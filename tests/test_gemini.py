@@ -0,0 +1,166 @@
+import requests
+import pytest
+
+import gemini
+
+
+class FakeResponse:
+    def __init__(self, status_code, data):
+        self.status_code = status_code
+        self._data = data
+
+    def json(self):
+        return self._data
+
+
+class FakeSession:
+    """ตอบตาม list ที่เตรียมไว้ทีละ request — ตัวที่เป็น exception จะถูก raise"""
+
+    def __init__(self, *responses):
+        self.responses = list(responses)
+        self.calls = 0
+
+    def post(self, url, **kwargs):
+        self.calls += 1
+        r = self.responses.pop(0)
+        if isinstance(r, Exception):
+            raise r
+        return r
+
+
+OK = FakeResponse(200, {"candidates": [{"content": {"parts": [{"text": "ok"}]}}]})
+OVERLOAD = FakeResponse(503, {"error": {"code": 503, "status": "UNAVAILABLE", "message": "overloaded"}})
+INTERNAL = FakeResponse(500, {"error": {"code": 500, "status": "INTERNAL", "message": "boom"}})
+
+
+def half_open_client(session):
+    client = gemini.Client(session=session, max_attempts=1, fallbacks={})
+    breaker = client._breaker("m")
+    breaker.threshold, breaker.cooldown = 1, 0.0
+    breaker.failure(0.0)
+    return client, breaker
+
+
+@pytest.mark.parametrize("trial", [
+    INTERNAL,
+    requests.ConnectionError("reset"),
+    FakeResponse(200, {"candidates": []}),
+])
+def test_half_open_trial_resolves_on_non_overload_error(trial):
+    client, breaker = half_open_client(FakeSession(trial, OK))
+    assert client._pick(["m"], 0) == "m" and breaker.trial
+
+    _result, err, _dt = client._attempt("m", {}, "key", 5, "test", lambda d: d["candidates"][0])
+    assert err is not None and not err.overloaded
+    assert not breaker.trial
+    # พ้น cooldown (0s) → ได้ลองใหม่ และสำเร็จแล้วปิด
+    assert breaker.allow(10**9)
+    _result, err, _dt = client._attempt("m", {}, "key", 5, "test", None)
+    assert err is None
+    assert breaker.state(10**9) == "closed"
+
+
+def test_half_open_trial_resolves_on_limiter_timeout(monkeypatch):
+    client, breaker = half_open_client(FakeSession(OK))
+    monkeypatch.setattr(gemini.AdaptiveLimiter, "acquire", lambda self, timeout=None: False)
+    assert breaker.allow(10**9) and breaker.trial
+
+    _result, err, _dt = client._attempt("m", {}, "key", 5, "test", None)
+    assert err is not None
+    assert not breaker.trial
+
+
+def test_overload_trial_reopens():
+    client, breaker = half_open_client(FakeSession(OVERLOAD))
+    assert breaker.allow(10**9)
+    _result, err, _dt = client._attempt("m", {}, "key", 5, "test", None)
+    assert err.overloaded and not breaker.trial and breaker.opened == 2
+
+
+class SlowSession:
+    """model ใน URL → (วินาทีที่หน่วง, response) — จำลอง model หลักที่ตอบช้า"""
+
+    def __init__(self, plan):
+        self.plan = plan
+
+    def post(self, url, **kwargs):
+        import time
+        for model, (delay, resp) in self.plan.items():
+            if f"/models/{model}:" in url:
+                time.sleep(delay)
+                return resp
+        raise AssertionError(url)
+
+
+def hedge_client(plan):
+    client = gemini.Client(session=SlowSession(plan), max_attempts=1, fallbacks={"slow": "fast"})
+    client.hedge_enabled = True
+    client.hedge_delay = lambda purpose, m: 0.05
+    return client
+
+
+def test_hedge_loser_releases_slot_when_winner_returns():
+    import time
+    client = hedge_client({"slow": (1.0, OK), "fast": (0.0, OK)})
+    t0 = time.monotonic()
+    data, model = client.generate("slow", {}, "hedge-key", purpose="script",
+                                  validate=gemini.require_text, hedge=True)
+    assert model == "fast" and time.monotonic() - t0 < 0.5
+    # ตัวแพ้ยังรอ HTTP อยู่ แต่คืน slot ของ limiter แล้ว
+    assert gemini.limiter("hedge-key", "slow").inflight == 0
+    assert gemini.limiter("hedge-key", "fast").inflight == 0
+
+
+def test_hedge_ignores_empty_candidate():
+    blocked = FakeResponse(200, {"candidates": [{"finishReason": "SAFETY"}]})
+    client = hedge_client({"slow": (0.3, OK), "fast": (0.0, blocked)})
+    data, model = client.generate("slow", {}, "hedge-key2", purpose="script",
+                                  validate=gemini.require_text, hedge=True)
+    assert model == "slow" and gemini.response_text(data) == "ok"
+
+
+def test_no_hedge_without_validator():
+    client = hedge_client({"slow": (0.2, OK), "fast": (0.0, OK)})
+    _data, model = client.generate("slow", {}, "hedge-key3", purpose="script", hedge=True)
+    assert model == "slow" and client.hedge_stats["hedged"] == 0
+
+
+class UploadResponse:
+    def __init__(self, status_code, headers=None, data=None):
+        self.status_code = status_code
+        self.headers = headers or {}
+        self._data = data or {}
+        self.text = ""
+
+    def json(self):
+        return self._data
+
+
+class UploadSession:
+    def __init__(self, chunk_responses):
+        self.chunk_responses = list(chunk_responses)
+        self.offsets = []
+
+    def post(self, url, headers=None, **kwargs):
+        command = (headers or {}).get("X-Goog-Upload-Command", "")
+        if command == "start":
+            return UploadResponse(200, {"X-Goog-Upload-URL": "http://upload/session"})
+        if command == "query":
+            return UploadResponse(200, {"X-Goog-Upload-Status": "active",
+                                        "X-Goog-Upload-Size-Received": str(self.offsets[-1])})
+        self.offsets.append(int(headers["X-Goog-Upload-Offset"]))
+        return self.chunk_responses.pop(0)
+
+
+def test_upload_chunk_429_retries_after_retry_after(monkeypatch):
+    slept = []
+    monkeypatch.setattr(gemini.time, "sleep", slept.append)
+    done = UploadResponse(200, data={"file": {"name": "files/x", "uri": "gs://x"}})
+    session = UploadSession([UploadResponse(429, {"Retry-After": "3"}), done])
+    manager = gemini.FileManager(session=session, chunk_size=1, retries=3)
+
+    info = manager._upload_resumable("key", b"video", "video/mp4", "x")
+    assert info["name"] == "files/x"
+    assert session.offsets == [0, 0]
+    assert slept == [3.0]
+    assert manager.stats["chunk_retries"] == 1
@@ -0,0 +1,44 @@
+import threading
+
+import pytest
+
+import jobs
+
+
+def _blocked_executor(queue_size):
+    executor = jobs.JobExecutor(workers=1, queue_size=queue_size)
+    release, started = threading.Event(), threading.Event()
+
+    def hold():
+        started.set()
+        release.wait(5)
+
+    executor.submit("running", hold)
+    assert started.wait(2)
+    return executor, release
+
+
+def test_bounded_queue_rejects_when_full():
+    executor, release = _blocked_executor(queue_size=1)
+    try:
+        assert executor.submit("a", lambda: None)["queuePosition"] == 1
+        with pytest.raises(jobs.QueueFull) as exc:
+            executor.submit("b", lambda: None)
+        assert exc.value.retry_after >= 5
+        assert executor.get("b") is None
+        assert not executor.load()["accepting"]
+        # งานเดิมที่ยังอยู่ในระบบ (Worker retry) → คืนสถานะเดิม ไม่ raise
+        assert executor.submit("a", lambda: None)["state"] == "queued"
+    finally:
+        release.set()
+
+
+def test_unbounded_queue_accepts_everything():
+    executor, release = _blocked_executor(queue_size=0)
+    try:
+        for i in range(20):
+            executor.submit(f"job{i}", lambda: None)
+        load = executor.load()
+        assert load["queued"] == 20 and load["accepting"] and load["free_slots"] is None
+    finally:
+        release.set()
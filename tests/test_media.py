@@ -0,0 +1,42 @@
+import threading
+
+import media
+
+
+def test_segment_count_ignores_bad_spec():
+    assert media.segment_count(60, spec="lots") == 1
+    assert media.segment_count(60, spec="2") == 2
+
+
+def test_merge_without_subtitles_does_not_read_merge_segments(monkeypatch):
+    ran = []
+    monkeypatch.setattr(media, "MERGE_SEGMENTS", "lots")
+    monkeypatch.setattr(media, "segment_count", lambda *a: 1 / 0)
+    monkeypatch.setattr(media, "_run", lambda cmd, **kw: ran.append(cmd))
+    media.merge("in.mp4", b"\0\0", "out.mp4", 10.0)
+    assert len(ran) == 1
+
+
+def test_segmented_progress_comes_from_one_thread(monkeypatch, tmp_path):
+    parts = [(str(tmp_path / f"seg{k}.mp4"), k * 5.0, (k + 1) * 5.0) for k in range(3)]
+    monkeypatch.setattr(media, "keyframes", lambda path: [0.0, 5.0, 10.0])
+    monkeypatch.setattr(media, "plan_cuts", lambda keys, duration, n: [5.0, 10.0])
+    monkeypatch.setattr(media, "split_at_keyframes", lambda path, out_dir, cuts: parts)
+
+    def fake_run(cmd, pcm=None, on_progress=None, what="merge"):
+        if on_progress:
+            for t in (1.0, 3.0, 5.0):
+                on_progress(t)
+
+    monkeypatch.setattr(media, "_run", fake_run)
+    callers, seen = set(), []
+
+    def on_progress(seconds):
+        callers.add(threading.current_thread().name)
+        seen.append(seconds)
+
+    out = tmp_path / "out.mp4"
+    assert media.merge_segmented("in.mp4", b"\0\0", str(out), 15.0, 3, ass_path="subs.ass",
+                                 on_progress=on_progress) == 3
+    assert callers == {threading.current_thread().name}
+    assert seen == sorted(seen) and seen[-1] == 15.0
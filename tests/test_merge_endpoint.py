@@ -0,0 +1,88 @@
+"""/merge: request แบบ multipart / raw PCM / JSON และ response แบบ multipart/mixed ที่ stream จาก disk"""
+import base64
+import email
+import email.policy
+import io
+import json
+import os
+from types import SimpleNamespace
+
+import pytest
+
+import server
+
+PCM = bytes(range(256)) * 40
+
+
+@pytest.fixture
+def merged(monkeypatch):
+    calls = []
+
+    def download(url, path, **kwargs):
+        with open(path, "wb") as f:
+            f.write(b"source")
+        return SimpleNamespace(path=path, size=6, sha256=None)
+
+    def merge(video_path, pcm, output_path, duration, sample_rate=24000, thumb_path=None, **kwargs):
+        calls.append({"pcm": bytes(pcm), "sample_rate": sample_rate, "dir": os.path.dirname(output_path)})
+        with open(output_path, "wb") as f:
+            f.write(b"MP4" * 1000)
+        with open(thumb_path, "wb") as f:
+            f.write(b"WEBP")
+
+    monkeypatch.setattr(server.spool, "download", download)
+    monkeypatch.setattr(server.media, "probe", lambda path: (12.5, 720, 1280))
+    monkeypatch.setattr(server.media, "merge", merge)
+    return calls
+
+
+def _parts(resp):
+    msg = email.message_from_bytes(
+        f"Content-Type: {resp.headers['Content-Type']}\r\n\r\n".encode() + resp.get_data(),
+        policy=email.policy.HTTP)
+    return [(p.get_content_type(), p.get_payload(decode=True)) for p in msg.iter_parts()]
+
+
+def test_multipart_request_streams_multipart_response(merged):
+    client = server.app.test_client()
+    resp = client.post("/merge", content_type="multipart/form-data", data={
+        "video_url": "https://example.com/v.mp4", "sample_rate": "16000",
+        "audio": (io.BytesIO(PCM), "audio.pcm"),
+    })
+    assert resp.status_code == 200 and resp.mimetype == "multipart/mixed"
+    parts = _parts(resp)
+    assert [ctype for ctype, _body in parts] == ["application/json", "video/mp4", "image/webp"]
+    meta = json.loads(parts[0][1])
+    assert meta["success"] and meta["video_size"] == 3000 and meta["thumb_size"] == 4
+    assert parts[1][1] == b"MP4" * 1000 and parts[2][1] == b"WEBP"
+    assert merged[0]["pcm"] == PCM and merged[0]["sample_rate"] == 16000
+    # tmpdir ถูกลบหลังส่ง response ครบ
+    resp.close()
+    assert not os.path.exists(merged[0]["dir"])
+
+
+def test_raw_pcm_body_with_query_fields(merged):
+    client = server.app.test_client()
+    resp = client.post("/merge?video_url=https://example.com/v.mp4&sample_rate=24000", data=PCM,
+                       content_type="application/octet-stream")
+    assert resp.status_code == 200 and resp.mimetype == "multipart/mixed"
+    assert merged[0]["pcm"] == PCM
+
+
+def test_json_request_keeps_base64_response(merged):
+    client = server.app.test_client()
+    resp = client.post("/merge", json={"video_url": "https://example.com/v.mp4",
+                                       "audio_base64": base64.b64encode(PCM).decode()})
+    data = resp.get_json()
+    assert resp.status_code == 200
+    assert base64.b64decode(data["video_base64"]) == b"MP4" * 1000
+    assert base64.b64decode(data["thumb_base64"]) == b"WEBP"
+
+
+def test_missing_audio_or_bad_mode_is_400(merged):
+    client = server.app.test_client()
+    assert client.post("/merge", content_type="multipart/form-data",
+                       data={"video_url": "https://example.com/v.mp4"}).status_code == 400
+    resp = client.post("/merge?video_url=https://example.com/v.mp4&response=xml", data=PCM,
+                       content_type="application/octet-stream")
+    assert resp.status_code == 400 and not merged
@@ -0,0 +1,64 @@
+import threading
+import time
+
+import progress
+
+
+class Sink:
+    def __init__(self, delay=0.0):
+        self.records = []
+        self.delay = delay
+        self.event = threading.Event()
+
+    def __call__(self, record):
+        time.sleep(self.delay)
+        self.records.append(record)
+        self.event.set()
+
+
+def test_updates_within_interval_coalesce_into_one_flush():
+    sink = Sink()
+    writer = progress.ProgressWriter({"id": "v1"}, sink, interval=0.3)
+    writer.update(stepName="a", flush_now=True)
+    assert sink.event.wait(2)
+    for i in range(50):
+        writer.update(percent=i)
+    time.sleep(0.1)
+    # ยังไม่ครบ interval หลัง flush แรก → ยังไม่เขียนซ้ำ
+    assert len(sink.records) == 1
+    writer.close()
+    assert writer.updates == 51
+    assert len(sink.records) == 2 and sink.records[-1]["percent"] == 49
+
+
+def test_flush_now_skips_the_interval():
+    sink = Sink()
+    writer = progress.ProgressWriter({"id": "v1"}, sink, interval=60)
+    writer.update(step=1, flush_now=True)
+    assert sink.event.wait(2)
+    sink.event.clear()
+    writer.update(step=2, flush_now=True)
+    assert sink.event.wait(2)
+    assert [r["step"] for r in sink.records] == [1, 2]
+    writer.close()
+
+
+def test_slow_flush_writes_only_latest_state():
+    sink = Sink(delay=0.2)
+    writer = progress.ProgressWriter({"id": "v1"}, sink, interval=0)
+    writer.update(step=1)
+    time.sleep(0.05)
+    for step in range(2, 10):
+        writer.update(step=step)
+    writer.close()
+    steps = [r["step"] for r in sink.records]
+    assert steps[0] == 1 and steps[-1] == 9 and len(steps) <= 3
+
+
+def test_close_without_flush_drops_pending_state():
+    sink = Sink()
+    writer = progress.ProgressWriter({"id": "v1"}, sink, interval=60)
+    writer.update(step=1)
+    writer.close(flush=False)
+    writer.update(step=2)
+    assert sink.records == [] and writer.get()["step"] == 1
@@ -0,0 +1,63 @@
+import pytest
+
+import ratelimit
+
+
+class FakeTime:
+    def __init__(self):
+        self.now = 1000.0
+
+    def monotonic(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.now += seconds
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    fake = FakeTime()
+    monkeypatch.setattr(ratelimit, "time", fake)
+    return fake
+
+
+def test_bucket_refills_up_to_burst(clock):
+    bucket = ratelimit.TokenBucket(rate=2, burst=3)
+    assert all(bucket.try_acquire() for _ in range(3))
+    assert not bucket.try_acquire()
+    assert bucket.delay() == pytest.approx(0.5)
+    clock.sleep(0.5)
+    assert bucket.try_acquire() and not bucket.try_acquire()
+    clock.sleep(60)
+    # สะสมได้ไม่เกิน burst
+    assert sum(bucket.try_acquire() for _ in range(10)) == 3
+
+
+def test_penalize_blocks_and_empties_bucket(clock):
+    bucket = ratelimit.TokenBucket(rate=10, burst=5)
+    bucket.penalize(4)
+    assert not bucket.try_acquire()
+    assert bucket.delay() == pytest.approx(4)
+    clock.sleep(3.9)
+    assert not bucket.try_acquire()
+    clock.sleep(0.1)
+    assert bucket.try_acquire()
+
+
+def test_acquire_waits_or_times_out(clock):
+    bucket = ratelimit.TokenBucket(rate=1, burst=1)
+    assert bucket.acquire()
+    assert not bucket.acquire(timeout=0.5)
+    start = clock.now
+    assert bucket.acquire(timeout=5)
+    assert clock.now - start == pytest.approx(0.5, abs=0.02)
+
+
+def test_acquire_all_takes_nothing_until_every_bucket_is_ready(clock):
+    fast, slow = ratelimit.TokenBucket(rate=10, burst=1), ratelimit.TokenBucket(rate=1, burst=1)
+    assert slow.try_acquire()
+    assert not ratelimit.acquire_all([fast, slow], timeout=0.5)
+    # fast ไม่ถูกตัด token ทิ้งไว้ระหว่างรอ slow
+    assert fast.delay() == 0
+    assert ratelimit.acquire_all([fast, slow], timeout=1)
+    assert not fast.try_acquire() and not slow.try_acquire()
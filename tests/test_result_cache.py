@@ -0,0 +1,60 @@
+import result_cache
+
+
+def test_key_depends_on_every_part_and_its_boundaries():
+    base = result_cache.key("abc", "model", 1)
+    assert base == result_cache.key("abc", "model", 1)
+    assert base != result_cache.key("abc", "model", 2)
+    assert base != result_cache.key("abc", "other", 1)
+    # ขอบของแต่ละส่วนนับด้วย — "ab"+"c" ไม่ชนกับ "a"+"bc"
+    assert result_cache.key("ab", "c") != result_cache.key("a", "bc")
+    assert result_cache.key("x") == result_cache.key(b"x")
+
+
+def test_hit_and_miss_per_stage(tmp_path):
+    cache = result_cache.JobCache(result_cache.DiskTier(str(tmp_path), 1 << 20))
+    k = result_cache.key(result_cache.sha256("script"), "tts-model")
+    assert cache.get_bytes("tts", k) is None
+    cache.put_bytes("tts", k, b"pcm")
+    assert cache.get_bytes("tts", k) == b"pcm"
+    # stage อื่นที่ key เดียวกันเป็นคนละ entry
+    assert cache.get_text("srt", k) is None
+    assert cache.report == {"tts": {"hits": 1, "misses": 1}, "srt": {"hits": 0, "misses": 1}}
+
+
+def test_disk_tier_evicts_least_recently_used(tmp_path):
+    disk = result_cache.DiskTier(str(tmp_path), max_bytes=10)
+    disk.put_bytes("s", "a", b"1234")
+    disk.put_bytes("s", "b", b"1234")
+    assert disk.get_path("s", "a")          # a ใช้ล่าสุด → b เก่าสุด
+    disk.put_bytes("s", "c", b"1234")
+    assert disk.get_path("s", "b") is None
+    assert disk.get_path("s", "a") and disk.get_path("s", "c")
+    assert disk.usage()["bytes"] == 8
+
+
+def test_disk_tier_rescans_existing_entries(tmp_path):
+    result_cache.DiskTier(str(tmp_path), 1 << 20).put_bytes("srt", "k", b"data")
+    assert result_cache.DiskTier(str(tmp_path), 1 << 20).get_path("srt", "k")
+
+
+class FakeRemote:
+    def __init__(self, entries):
+        self.entries = entries
+
+    def fetch(self, stage, k, dest_path):
+        if (stage, k) not in self.entries:
+            return False
+        with open(dest_path, "wb") as f:
+            f.write(self.entries[(stage, k)])
+        return True
+
+    def store(self, stage, k, src_path):
+        pass
+
+
+def test_remote_hit_is_copied_to_disk(tmp_path):
+    disk = result_cache.DiskTier(str(tmp_path), 1 << 20)
+    cache = result_cache.JobCache(disk, FakeRemote({("script", "k"): b"{}"}))
+    assert cache.get_bytes("script", "k") == b"{}"
+    assert disk.get_path("script", "k")
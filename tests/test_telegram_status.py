@@ -0,0 +1,14 @@
+import telegram_status
+
+
+def test_call_skips_post_when_budget_times_out(monkeypatch):
+    scheduler = telegram_status.StatusScheduler(global_rate=1.0, chat_rate=1.0)
+    posted = []
+    monkeypatch.setattr(scheduler, "_post", lambda *args: posted.append(args) or {"ok": True})
+
+    assert scheduler.call("tok", "sendMessage", {"chat_id": 1, "text": "a"}, max_wait=0)["ok"]
+    # budget ของ chat นี้หมดแล้ว และไม่ยอมรอ → ต้องไม่ส่ง
+    data = scheduler.call("tok", "sendMessage", {"chat_id": 1, "text": "b"}, max_wait=0)
+    assert not data["ok"]
+    assert len(posted) == 1
+    assert scheduler.status()["skipped"] == 1
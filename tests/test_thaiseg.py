@@ -0,0 +1,33 @@
+import pytest
+
+import thaiseg
+
+# วลีที่เจอบ่อยในบทพากย์ — ตัดผิดตรงนี้ = ซับขึ้นบรรทัดใหม่กลางคำ
+PHRASES = [
+    ("ตายแล้วค่ะ", ["ตาย", "แล้ว", "ค่ะ"]),
+    ("ของมันต้องมี", ["ของ", "มัน", "ต้อง", "มี"]),
+    ("ยังใช้ของเดิมอยู่เหรอจ๊ะ", ["ยัง", "ใช้", "ของ", "เดิม", "อยู่", "เหรอ", "จ๊ะ"]),
+    ("น่าสงสารตัวเอง", ["น่าสงสาร", "ตัวเอง"]),
+    ("เห็นปุ๊บหัวใจแม่สั่นเลยค่ะ", ["เห็น", "ปุ๊บ", "หัวใจ", "แม่", "สั่น", "เลยค่ะ"]),
+    ("ไม่งั้นแม่จะโกรธ", ["ไม่งั้น", "แม่", "จะ", "โกรธ"]),
+    ("ลิงก์ข้างล่างจ้า", ["ลิงก์", "ข้างล่าง", "จ้า"]),
+    ("เครื่องดูดฝุ่นไร้สาย", ["เครื่องดูดฝุ่น", "ไร้สาย"]),
+    ("ล้างจานสะอาดเอี่ยม", ["ล้างจาน", "สะอาด", "เอี่ยม"]),
+    ("ส่งฟรีทั่วประเทศ", ["ส่งฟรี", "ทั่วประเทศ"]),
+]
+
+
+@pytest.mark.parametrize("text,words", PHRASES)
+def test_everyday_phrases(text, words):
+    assert thaiseg.tokenize(text) == words
+
+
+def test_blocks_break_only_between_words():
+    script = " ".join(text for text, _words in PHRASES)
+    words = [w for _text, ws in PHRASES for w in ws]
+    timed = [(i * 0.3, i * 0.3 + 0.25, w) for i, w in enumerate(words)]
+    blocks = thaiseg.blocks(script, timed, max_chars=14)
+    # ทุก block ต้องประกอบจากคำเต็มๆ: ต่อกันแล้วตัดได้ตรงกับคำที่คาด
+    pieces = [tok for _s, _e, text in blocks for tok in thaiseg.tokenize(text) if tok != " "]
+    assert pieces == words
+    assert all(thaiseg.width(text) <= 14 for _s, _e, text in blocks if len(thaiseg.tokenize(text)) > 1)
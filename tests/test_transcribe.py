@@ -0,0 +1,51 @@
+import threading
+import time
+
+import numpy as np
+import pytest
+
+import transcribe
+
+
+def _tone(seconds, sample_rate=24000):
+    t = np.arange(int(seconds * sample_rate)) / sample_rate
+    return (np.sin(2 * np.pi * 220 * t) * 8000).astype("<i2").tobytes()
+
+
+def test_transcribe_pcm_times_out_on_stuck_decode(monkeypatch):
+    release = threading.Event()
+    monkeypatch.setattr(transcribe, "load_model", lambda: object())
+    monkeypatch.setattr(transcribe, "_infer", lambda *args: release.wait(5) and [])
+    monkeypatch.setattr(transcribe, "WHISPER_TIMEOUT", 0.2)
+
+    started = time.monotonic()
+    try:
+        with pytest.raises(TimeoutError):
+            transcribe.transcribe_pcm(_tone(1.0))
+    finally:
+        release.set()
+    assert time.monotonic() - started < 2
+    # slot ของงานต้องคืนแล้ว แม้ decode ยังค้างอยู่
+    assert transcribe.status()["active"] == 0
+
+
+def test_batch_queue_skips_cancelled_chunks(monkeypatch):
+    queue = transcribe.BatchQueue(max_batch=4, max_wait=0.05)
+    seen = []
+    monkeypatch.setattr(queue, "_run", lambda audios, language: seen.append(len(audios)) or [[] for _ in audios])
+
+    dropped = queue.submit(np.zeros(10, dtype=np.float32))
+    dropped.cancel()
+    kept = queue.submit(np.zeros(10, dtype=np.float32))
+    assert kept.result(timeout=2) == []
+    assert seen == [1]
+
+
+def test_voiced_chunks_fit_the_batch_window():
+    sample_rate = 24000
+    gap = np.zeros(int(0.4 * sample_rate), dtype="<i2").tobytes()
+    # ช่วงเงียบที่ใกล้กึ่งกลางที่สุดอยู่ห่าง → เดิมได้ chunk 30.6s (เกินช่อง 30s หลัง pad)
+    pcm = gap + _tone(27.0) + gap + _tone(5.0) + gap + _tone(25.0) + gap
+    for parts in (1, 2, 4):
+        chunks = transcribe.voiced_chunks(pcm, sample_rate, parts=parts)
+        assert chunks and all(end - start <= transcribe._WINDOW for start, end in chunks)
@@ -0,0 +1,21 @@
+import random
+
+import tts
+
+
+def test_split_after_backtrack_respects_limit():
+    # หลังย้อนไปตัดที่จบประโยค ส่วนที่เหลือ + วลียาวถัดไปเคยได้ท่อน ~1.5 เท่าของ limit
+    script = " ".join(["ก" * 27 + "ค่ะ", "ข" * 29, "ค" * 55])
+    segments = tts.split_script(script, 60)
+    assert max(len(s) for s in segments) <= 60
+    assert " ".join(segments) == script
+
+
+def test_split_random_scripts_within_limit():
+    rng = random.Random(7)
+    for _ in range(300):
+        phrases = ["ก" * rng.randint(1, 50) + rng.choice(["", "ค่ะ", "!"]) for _ in range(rng.randint(1, 30))]
+        script = " ".join(phrases)
+        segments = tts.split_script(script, 60)
+        assert all(len(s) <= 60 for s in segments)
+        assert " ".join(segments) == script
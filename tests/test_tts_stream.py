@@ -0,0 +1,106 @@
+"""
+streaming TTS ครบทาง: fake_gemini (SSE ส่ง PCM สำเร็จรูป) → Client.stream → tts.stream → ffmpeg stdin (media.merge)
+"""
+import shutil
+import subprocess
+import sys
+
+import pytest
+
+import fake_gemini
+import gemini
+import media
+import tts
+
+SECONDS = 3.0
+
+
+@pytest.fixture
+def fake_api(monkeypatch):
+    server, url = fake_gemini.serve(seconds=SECONDS, chunk_ms=250, interval=0.01, first_delay=0.0)
+    monkeypatch.setattr(gemini, "API_BASE", url)
+    yield url
+    server.shutdown()
+
+
+def test_stream_yields_all_audio(fake_api):
+    heard = []
+    pcm = b"".join(tts.stream("ทดสอบ", "fake-key", on_audio=heard.append))
+    assert pcm == fake_gemini.sine_pcm(SECONDS)
+    # chunk จาก server ขนาดคี่ — ทุก chunk ที่ yield ต้องลง sample พอดี
+    assert heard == sorted(heard) and heard[-1] == pytest.approx(SECONDS)
+
+
+@pytest.mark.skipif(not (shutil.which("ffmpeg") and shutil.which("ffprobe")), reason="ต้องมี ffmpeg/ffprobe")
+def test_stream_into_merge(fake_api, tmp_path):
+    video = str(tmp_path / "video.mp4")
+    subprocess.run(["ffmpeg", "-v", "error", "-y", "-f", "lavfi", "-i", f"color=black:s=160x284:r=10:d={SECONDS}",
+                    "-c:v", "libx264", "-pix_fmt", "yuv420p", video], check=True)
+    output = str(tmp_path / "output.mp4")
+    heard, progress = [], []
+
+    media.merge(video, tts.stream("ทดสอบ", "fake-key", on_audio=heard.append), output, SECONDS,
+                sample_rate=tts.SAMPLE_RATE, on_progress=progress.append)
+
+    r = subprocess.run(["ffprobe", "-v", "error", "-select_streams", "a:0", "-show_entries", "stream=duration",
+                        "-of", "csv=p=0", output], capture_output=True, text=True, check=True)
+    assert float(r.stdout) == pytest.approx(SECONDS, abs=0.1)
+    assert heard[-1] == pytest.approx(SECONDS)
+    assert progress and max(progress) == pytest.approx(SECONDS, abs=0.2)
+
+
+# encoder ปลอม: อ่าน stdin ทีละก้อน เขียนลงไฟล์ output แล้วรายงาน -progress แบบ ffmpeg
+FAKE_ENCODER = """
+import sys
+out, n = open(sys.argv[1], "wb"), 0
+while True:
+    data = sys.stdin.buffer.read1(65536)
+    if not data:
+        break
+    out.write(data)
+    n += len(data)
+    print(f"out_time_us={n * 1000000 // (2 * 24000)}", flush=True)
+"""
+
+
+def test_stream_overlaps_merge_without_ffmpeg(monkeypatch, tmp_path):
+    server, url = fake_gemini.serve(seconds=SECONDS, chunk_ms=250, interval=0.05, first_delay=0.0)
+    monkeypatch.setattr(gemini, "API_BASE", url)
+    monkeypatch.setattr(media, "build_merge_cmd",
+                        lambda video, output, *args, **kwargs: [sys.executable, "-c", FAKE_ENCODER, output])
+    events = []
+    output = tmp_path / "output.raw"
+    try:
+        media.merge("video.mp4", tts.stream("ทดสอบ", "fake-key", on_audio=lambda s: events.append(("audio", s))),
+                    str(output), SECONDS, sample_rate=tts.SAMPLE_RATE,
+                    on_progress=lambda s: events.append(("encode", s)))
+    finally:
+        server.shutdown()
+
+    assert output.read_bytes() == fake_gemini.sine_pcm(SECONDS)
+    # encoder ได้เสียงก่อน TTS stream จบ — สองขั้นทำงานซ้อนกัน ไม่ได้รอเสียงครบก่อน
+    last_audio = max(i for i, (kind, _s) in enumerate(events) if kind == "audio")
+    assert any(kind == "encode" for kind, _s in events[:last_audio])
+
+
+class BrokenStreamSession:
+    class Response:
+        status_code = 200
+
+        def iter_lines(self):
+            yield b'data: {"candidates": [ broken'
+
+        def close(self):
+            pass
+
+    def post(self, url, **kwargs):
+        return self.Response()
+
+
+def test_malformed_event_is_gemini_error(monkeypatch):
+    monkeypatch.setattr(gemini.time, "sleep", lambda s: None)
+    client = gemini.Client(session=BrokenStreamSession(), max_attempts=2)
+    with pytest.raises(gemini.GeminiError):
+        list(client.stream("m", {}, "key", purpose="tts_stream"))
+    metric = client.status()["calls"]["tts_stream:m"]
+    assert metric["attempts"] == 2 and metric["failures"] == 2
@@ -0,0 +1,82 @@
+import threading
+import time
+
+import xhs
+
+NOTE = "0123456789abcdef01234567"
+PAGE = (b'<html>' + b'x' * 100000 +
+        b'"masterUrl":"http:\\u002F\\u002Fsns-video-bd.xhscdn.com\\u002Fstream\\u002Fv.mp4"' + b'y' * 100000)
+
+
+class FakeSession:
+    """session.get → response ที่ redirect ไปหน้า note — บล็อกไว้จนกว่าจะ release (จำลอง fetch ช้า)"""
+
+    def __init__(self, final_url=f"https://www.xiaohongshu.com/explore/{NOTE}", page=PAGE):
+        self.final_url = final_url
+        self.page = page
+        self.calls = 0
+        self.release = threading.Event()
+        self.release.set()
+
+    def get(self, url, **kwargs):
+        self.calls += 1
+        self.release.wait(5)
+        session = self
+
+        class Response:
+            url = session.final_url
+
+            def iter_content(self, chunk_size):
+                for i in range(0, len(session.page), chunk_size):
+                    yield session.page[i:i + chunk_size]
+
+            def close(self):
+                pass
+        return Response()
+
+
+def test_concurrent_requests_share_one_fetch():
+    session = FakeSession()
+    session.release.clear()
+    resolver = xhs.Resolver(session=session)
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(resolver.resolve("http://xhslink.com/a/AbC")))
+               for _ in range(5)]
+    for t in threads:
+        t.start()
+    while resolver.status()["coalesced"] < 4:
+        time.sleep(0.01)
+    session.release.set()
+    for t in threads:
+        t.join(5)
+
+    assert session.calls == 1
+    assert results == ["http://sns-video-bd.xhscdn.com/stream/v.mp4"] * 5
+    status = resolver.status()
+    assert status["misses"] == 1 and status["coalesced"] == 4 and status["inflight"] == 0
+
+
+def test_short_links_to_the_same_note_hit_the_cache():
+    session = FakeSession()
+    resolver = xhs.Resolver(session=session)
+    first = resolver.resolve("http://xhslink.com/a/AbC")
+    # ลิงก์สั้นอีกตัว: ยังต้อง follow redirect แต่ไม่ต้องอ่านหน้าซ้ำ
+    assert resolver.resolve("http://xhslink.com/a/Other?share=1") == first
+    assert resolver.resolve(f"https://www.xiaohongshu.com/explore/{NOTE}?xsec=t") == first
+    assert session.calls == 2
+    assert resolver.status()["bytes_read"] < 2 * len(PAGE)
+
+
+def test_failed_fetch_is_not_cached():
+    session = FakeSession(page=b"<html>captcha</html>")
+    resolver = xhs.Resolver(session=session)
+    assert resolver.resolve("http://xhslink.com/a/AbC") is None
+    assert resolver.resolve("http://xhslink.com/a/AbC") is None
+    assert session.calls == 2
+
+
+def test_scan_stream_stops_at_master_url():
+    chunks = [PAGE[i:i + 1000] for i in range(0, len(PAGE), 1000)]
+    url, via, read, early = xhs.scan_stream(chunks)
+    assert via == "masterUrl" and early and read < len(PAGE)
+    assert url == "http://sns-video-bd.xhscdn.com/stream/v.mp4"